@@ -0,0 +1,354 @@
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import resource
+import tracemalloc
+import subprocess
+import multiprocessing
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import rasterio
+from rasterio.transform import from_origin
+
+
+# NWIS parameter codes used in the column names of synthetic RDB responses
+PARAMETER_CODES = {'gauge height': '00065',
+                   'streamflow': '00060'}
+
+
+
+
+def synthetic_rdb_lines(days, gauge='03000000', data_type='gauge height', interval_minutes=15, gap_density=0.0,
+                        mean_gap_days=5.0, bad_fraction=0.0, start='1990-10-01', seed=0):
+    """
+    Generate the lines of a synthetic NWIS instantaneous values (RDB) response for one gauge.
+
+    Values are a seasonal cycle plus random storm peaks with exponential recession, so rolling statistics and
+    event counts behave like a real gauge record. Gaps (missing stretches, e.g., from equipment failures) are
+    placed at random with exponentially distributed lengths.
+
+    Parameters
+    ----------
+    days : float
+        Length of the record in days.
+    gauge : string
+        Site number of the gauge.
+    data_type : string
+        'gauge height' or 'streamflow' (parameter code of value columns).
+    interval_minutes : int
+        Minutes between measurements.
+    gap_density : float
+        Fraction of the record removed as gaps (0 for a complete record).
+    mean_gap_days : float
+        Mean length of gaps in days.
+    bad_fraction : float
+        Fraction of values replaced by non-numeric codes (e.g., 'Eqp', 'Ice').
+    start : string
+        Date of first measurement.
+    seed : int
+        Random seed.
+
+    Returns
+    -------
+    list
+        RDB lines (comments, header, format-spec row, and data rows) without line endings.
+
+    """
+    rng = np.random.default_rng(seed)
+    n = int(days * 24 * 60 / interval_minutes)
+    steps_per_day = 24 * 60 / interval_minutes
+    times = pd.date_range(start, periods=n, freq=f'{interval_minutes}min')
+
+    # seasonal cycle plus storms (random peaks with exponential recession over a few days)
+    t = np.arange(n) / steps_per_day
+    values = 2.0 + 0.8 * np.sin(2 * np.pi * t / 365.25) + rng.normal(0, 0.02, n)
+    storms = np.zeros(n)
+    storm_steps = rng.random(n) < 1 / (20 * steps_per_day)
+    storms[storm_steps] = rng.exponential(2.0, storm_steps.sum())
+    decay = np.exp(-1 / (2 * steps_per_day))
+    kernel = decay ** np.arange(int(10 * steps_per_day))
+    values += np.convolve(storms, kernel)[:n]
+
+    # gaps with exponentially distributed lengths until gap_density of the record is removed
+    keep = np.ones(n, dtype=bool)
+    while gap_density > 0 and 1 - keep.mean() < gap_density:
+        length = max(1, int(rng.exponential(mean_gap_days) * steps_per_day))
+        gap_start = rng.integers(0, n)
+        keep[gap_start:gap_start + length] = False
+
+    column = f'{rng.integers(10000, 99999)}_{PARAMETER_CODES[data_type]}'
+    df = pd.DataFrame({'agency_cd': 'USGS', 'site_no': gauge, 'datetime': times.strftime('%Y-%m-%d %H:%M'), 'tz_cd': 'EST',
+                       column: np.round(values, 2).astype(str), f'{column}_cd': 'A'})[keep]
+
+    bad = rng.random(len(df)) < bad_fraction
+    df.loc[bad, column] = rng.choice(['Eqp', 'Ice', 'Bkw'], bad.sum())
+
+    lines = ['# ---------------------------------- WARNING ----------------------------------------',
+             '# Synthetic data generated for benchmarks (not from NWIS).',
+             f'#  USGS {gauge} SYNTHETIC GAUGE',
+             '#',
+             '\t'.join(df.columns),
+             '\t'.join(['5s', '15s', '20d', '6s', '14n', '10s'])]
+    lines += df.to_csv(sep='\t', header=False, index=False, lineterminator='\n').splitlines()
+
+    return lines
+
+
+
+def synthetic_dem_tiles(output_dir, rows=2, cols=2, tile_size=1024, overlap=6, resolution=1 / 10800,
+                        origin=(-86.0, 38.0), crs='EPSG:4269', seed=0):
+    """
+    Write a grid of synthetic DEM geotiff tiles (USGS 1/3 arc-second style, overlapping by a few pixels).
+
+    Elevations are a sum of smooth random waves plus noise, so tiles join seamlessly and terrain features and
+    zonal statistics are not trivial. Tiles are named like USGS tiles (USGS_13_{row}_{col}.tif).
+
+    Parameters
+    ----------
+    output_dir : string
+        Directory for the tiles.
+    rows, cols : int
+        Number of tile rows and columns.
+    tile_size : int
+        Width and height of each tile in pixels (not counting overlap).
+    overlap : int
+        Pixels shared with each neighbouring tile.
+    resolution : float
+        Pixel size in units of crs.
+    origin : tuple
+        (left, top) of the upper left tile.
+    crs : string
+        Crs of the tiles.
+    seed : int
+        Random seed.
+
+    Returns
+    -------
+    list
+        Paths of the tiles.
+
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    waves = [(rng.uniform(50, 400), rng.uniform(5, 30), rng.uniform(0, 2 * np.pi), rng.uniform(0, 2 * np.pi)) for _ in range(8)]
+
+    paths = []
+    for row in range(rows):
+        for col in range(cols):
+            row_off, col_off = row * tile_size - overlap, col * tile_size - overlap
+            size = tile_size + 2 * overlap
+            y, x = np.mgrid[row_off:row_off + size, col_off:col_off + size].astype('float64')
+
+            # waves and noise depend only on global pixel position, so overlapping pixels agree
+            dem = 200 + sum(amplitude * np.sin(x / period + phase_x) * np.cos(y / period + phase_y)
+                            for period, amplitude, phase_x, phase_y in waves)
+            dem += np.random.default_rng([seed, row, col]).normal(0, 0.1, dem.shape)
+
+            transform = from_origin(origin[0] + col_off * resolution, origin[1] - row_off * resolution, resolution, resolution)
+            profile = {'driver': 'GTiff', 'height': size, 'width': size, 'count': 1, 'dtype': 'float32', 'crs': crs,
+                       'transform': transform, 'nodata': -999999.0, 'tiled': True, 'blockxsize': 256, 'blockysize': 256}
+
+            path = os.path.join(output_dir, f'USGS_13_{row}_{col}.tif')
+            with rasterio.open(path, 'w', **profile) as dst:
+                dst.write(dem.astype('float32'), 1)
+            paths.append(path)
+
+    return paths
+
+
+
+def synthetic_watersheds(n, bounds, crs, id_col='huc10', seed=0):
+    """HUC-like polygons (Voronoi cells of n random points clipped to bounds) with ids, names, and areas."""
+    rng = np.random.default_rng(seed)
+    points = shapely.points(rng.uniform(bounds[0], bounds[2], n), rng.uniform(bounds[1], bounds[3], n))
+    extent = shapely.box(*bounds)
+    cells = shapely.intersection(shapely.get_parts(shapely.voronoi_polygons(shapely.multipoints(points), extend_to=extent)), extent)
+    gdf = gpd.GeoDataFrame({id_col: [f'{i:010d}' for i in range(len(cells))], 'name': [f'Watershed {i}' for i in range(len(cells))],
+                            'loaddate': '2024-01-01'}, geometry=cells, crs=crs)
+    gdf['areasqkm'] = gdf.to_crs(gdf.estimate_utm_crs()).area / 1e6 if gdf.crs.is_geographic else gdf.area / 1e6
+    return gdf
+
+
+
+
+def _memory_mb(field='VmHWM'):
+    """Peak (VmHWM) or current (VmRSS) resident memory of this process (MB)."""
+    # on Linux ru_maxrss is kept across exec (so includes the parent's peak), but the VmHWM of a new process is not
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+
+def _measure_job(setup, function, repeat, queue):
+    """Run setup and function repeat times in this (fresh) process and put timings and memory on queue."""
+    try:
+        baseline = _memory_mb('VmRSS')
+        seconds = []
+        for _ in range(repeat):
+            args, kwargs = setup()
+            start = time.perf_counter()
+            function(*args, **kwargs)
+            seconds.append(time.perf_counter() - start)
+
+        # one more run traced separately, since tracemalloc slows allocations
+        args, kwargs = setup()
+        tracemalloc.start()
+        function(*args, **kwargs)
+        traced = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        queue.put({'seconds': min(seconds), 'mean_seconds': float(np.mean(seconds)), 'repeat': repeat,
+                   'baseline_rss_mb': baseline, 'peak_rss_mb': _memory_mb(), 'peak_traced_mb': traced / 1024 ** 2})
+    except Exception as error:
+        queue.put({'error': f'{type(error).__name__}: {error}'})
+
+
+
+def measure(setup, function, repeat=3):
+    """
+    Time function and record its peak memory in a new process.
+
+    Parameters
+    ----------
+    setup : callable
+        Module-level function returning (args, kwargs) for function; called before each run and not timed.
+    function : callable
+        Module-level function to benchmark.
+    repeat : int
+        Number of timed runs.
+
+    Returns
+    -------
+    dict
+        'seconds' (best run), 'mean_seconds', 'repeat', 'baseline_rss_mb' (resident memory of the process after
+        imports), 'peak_rss_mb' (peak resident memory of the process, including setup), and 'peak_traced_mb' (peak
+        of Python and numpy allocations during one run of function), or 'error' if setup or function raised.
+
+    """
+    # each measurement in its own process so peak memory is not carried over from earlier runs
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_measure_job, args=(setup, function, repeat, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+
+def benchmark_environment():
+    """Commit, machine, and package versions recorded with benchmark results."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'commit': commit, 'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'host': socket.gethostname(), 'platform': platform.platform(), 'python': platform.python_version(),
+            'cpus': os.cpu_count(), 'numpy': np.__version__, 'pandas': pd.__version__, 'rasterio': rasterio.__version__}
+
+
+
+def run_benchmarks(cases, output_path=None, repeat=3, progress=print):
+    """
+    Run benchmark cases and append results to a JSON lines file.
+
+    Parameters
+    ----------
+    cases : list
+        Dicts with 'name', 'scale', 'params' (dict recorded with results), 'setup', and 'function' (see measure).
+    output_path : string, optional
+        JSON lines file results are appended to (one record per case, with benchmark_environment).
+    repeat : int
+        Number of timed runs of each case.
+    progress : callable, optional
+        Called with a message after each case (None for silence).
+
+    Returns
+    -------
+    list
+        Result records.
+
+    """
+    environment = benchmark_environment()
+    records = []
+
+    for case in cases:
+        record = dict(environment, case=case['name'], scale=case['scale'], params=case.get('params', {}))
+        record.update(measure(case['setup'], case['function'], repeat))
+        records.append(record)
+
+        if output_path is not None:
+            with open(output_path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+
+        if progress is not None:
+            if 'error' in record:
+                progress(f"{case['name']} [{case['scale']}]: {record['error']}")
+            else:
+                progress(f"{case['name']} [{case['scale']}]: {record['seconds']:.3f} s, {record['peak_rss_mb']:.0f} MB peak")
+
+    return records
+
+
+
+def read_benchmark_results(path):
+    """Dataframe of benchmark records in a JSON lines file."""
+    with open(path) as f:
+        return pd.DataFrame([json.loads(line) for line in f if line.strip()])
+
+
+
+def compare_benchmarks(baseline, current, tolerance=0.2, memory_tolerance=0.2, min_seconds=0.05):
+    """
+    Compare benchmark results (e.g., of two commits) case by case.
+
+    The latest record of each case and scale in each file is compared, and a case is flagged as a regression
+    if it is slower (best time) or uses more peak traced memory than the baseline by more than the tolerance.
+    Cases faster than min_seconds in the baseline are not flagged for time (their timings are mostly noise).
+
+    Parameters
+    ----------
+    baseline : string or dataframe
+        Baseline results (JSON lines path or read_benchmark_results dataframe).
+    current : string or dataframe
+        Results to check.
+    tolerance : float
+        Allowed relative increase in time.
+    memory_tolerance : float
+        Allowed relative increase in peak traced memory.
+    min_seconds : float
+        Shortest baseline time checked for time regressions.
+
+    Returns
+    -------
+    DataFrame
+        Times, memory, ratios (current / baseline), and 'regression' flag indexed by case and scale.
+
+    """
+    frames = []
+    for results in [baseline, current]:
+        df = read_benchmark_results(results) if isinstance(results, str) else results
+        if 'error' in df.columns:
+            df = df[df['error'].isna()]
+        frames.append(df.drop_duplicates(['case', 'scale'], keep='last').set_index(['case', 'scale'])[['seconds', 'peak_traced_mb', 'peak_rss_mb']])
+
+    comparison = frames[0].join(frames[1], how='inner', lsuffix='_baseline', rsuffix='_current')
+    comparison['time_ratio'] = comparison['seconds_current'] / comparison['seconds_baseline']
+    comparison['memory_ratio'] = comparison['peak_traced_mb_current'] / comparison['peak_traced_mb_baseline']
+    slower = (comparison['time_ratio'] > 1 + tolerance) & (comparison['seconds_baseline'] >= min_seconds)
+    comparison['regression'] = slower | (comparison['memory_ratio'] > 1 + memory_tolerance)
+
+    return comparison
@@ -0,0 +1,149 @@
+"""
+Offline benchmarks of the stream flow event and spatial preprocessing steps on synthetic data.
+
+Generates synthetic gauge records (NWIS RDB responses of configurable length and gap density, parsed with
+write_rdb_lines as downloads are), synthetic DEM tiles, and HUC-like watershed polygons at each scale, then times
+read_and_prepare_data, calculate_ci, calculate_percentile, get_frequencies, mosaic_dem_tiles, and
+zonal_statistics_to_csv and records their peak memory (each case in a fresh process). Results are appended to a
+JSON lines file with the commit, so runs of two commits can be compared to catch regressions. Synthetic inputs
+are cached in --data-dir between runs. Run from the Benchmarks directory, e.g.
+
+    python Watersheds_Benchmarks.py --scales small medium --output benchmarks.jsonl
+    python Watersheds_Benchmarks.py --compare baseline.jsonl benchmarks.jsonl
+"""
+
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+from functools import partial
+
+import pandas as pd
+import rasterio
+
+# stage utilities (each stage folder is its own import root, as in the notebooks)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for stage in ['', 'Data', 'WatershedClustering', 'StreamFlowEvents']:
+    sys.path.insert(0, os.path.join(ROOT, stage))
+
+from Benchmark_Utils import synthetic_rdb_lines, synthetic_dem_tiles, synthetic_watersheds, run_benchmarks, compare_benchmarks
+from Data_Utils import write_rdb_lines, mosaic_dem_tiles
+from WatershedClustering_Utils import zonal_statistics_to_csv
+from StreamFlowEvents_Utils import read_and_prepare_data, calculate_ci, calculate_percentile, get_frequencies
+
+
+# input sizes of each scale (gauge record length in days at 15 minute intervals, DEM tile grid, number of watersheds)
+SCALES = {'small': {'days': 2 * 365, 'gap_density': 0.05, 'tiles': [1, 2], 'tile_size': 512, 'watersheds': 25},
+          'medium': {'days': 10 * 365, 'gap_density': 0.05, 'tiles': [2, 2], 'tile_size': 1024, 'watersheds': 100},
+          'large': {'days': 40 * 365, 'gap_density': 0.05, 'tiles': [3, 3], 'tile_size': 2048, 'watersheds': 400}}
+
+STATISTICS = ['sum', 'majority', 'range', 'mean', 'std', 'min', 'percentile_10', 'percentile_25', 'median',
+              'percentile_75', 'percentile_90', 'max']
+
+WINDOW, MIN_PERIODS, ALPHA = '90D', 30, 0.05
+
+
+def prepare_inputs(data_dir, params):
+    """Write (or reuse) synthetic gauge csv, DEM tiles and mosaic, and watersheds for params of a scale."""
+    key = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+    scale_dir = os.path.join(data_dir, key)
+    paths = {'gauge_csv': os.path.join(scale_dir, 'gauge.csv'), 'tiles_dir': os.path.join(scale_dir, 'dem_tiles'),
+             'mosaic': os.path.join(scale_dir, 'dem_mosaic.tif'), 'watersheds': os.path.join(scale_dir, 'watersheds.shp'),
+             'output_dir': os.path.join(scale_dir, 'outputs')}
+    os.makedirs(paths['output_dir'], exist_ok=True)
+
+    if not os.path.exists(paths['gauge_csv']):
+        lines = synthetic_rdb_lines(params['days'], gap_density=params['gap_density'])
+        write_rdb_lines(lines, paths['gauge_csv'] + '.part')
+        os.replace(paths['gauge_csv'] + '.part', paths['gauge_csv'])
+
+    tiles = synthetic_dem_tiles(paths['tiles_dir'], *params['tiles'], tile_size=params['tile_size'])
+    paths['tiles'] = tiles
+
+    if not os.path.exists(paths['mosaic']):
+        mosaic_dem_tiles(tiles, paths['mosaic'] + '.part.tif')
+        os.replace(paths['mosaic'] + '.part.tif', paths['mosaic'])
+
+    if not os.path.exists(paths['watersheds']):
+        with rasterio.open(paths['mosaic']) as src:
+            bounds, crs = src.bounds, src.crs
+        synthetic_watersheds(params['watersheds'], bounds, crs).to_file(paths['watersheds'])
+
+    return paths
+
+
+##### setup functions of each case (run in the benchmark process before each timed run)
+def setup_read(paths):
+    return (paths['gauge_csv'],), {'resample': '1D'}
+
+
+def setup_ci(paths):
+    return (read_and_prepare_data(paths['gauge_csv'], resample='1D'), WINDOW, MIN_PERIODS, ALPHA), {}
+
+
+def setup_percentile(paths):
+    return (read_and_prepare_data(paths['gauge_csv'], resample='1D'), WINDOW, MIN_PERIODS, 90), {}
+
+
+def setup_frequencies(paths):
+    df = calculate_ci(read_and_prepare_data(paths['gauge_csv'], resample='1D'), WINDOW, MIN_PERIODS, ALPHA)
+    for percentile in (90, 99):
+        df = calculate_percentile(df, WINDOW, MIN_PERIODS, percentile)
+    return (df,), {'data_type': 'gauge height'}
+
+
+def setup_mosaic(paths):
+    return (paths['tiles'], os.path.join(paths['output_dir'], 'mosaic.tif')), {}
+
+
+def setup_zonal(paths):
+    return (paths['watersheds'], paths['mosaic'], STATISTICS, os.path.join(paths['output_dir'], 'zonalstats.csv')), {'index_col': 'huc10'}
+
+
+CASES = [('read_and_prepare_data', setup_read, read_and_prepare_data),
+         ('calculate_ci', setup_ci, calculate_ci),
+         ('calculate_percentile', setup_percentile, calculate_percentile),
+         ('get_frequencies', setup_frequencies, get_frequencies),
+         ('mosaic_dem_tiles', setup_mosaic, mosaic_dem_tiles),
+         ('zonal_statistics_to_csv', setup_zonal, zonal_statistics_to_csv)]
+
+
+def build_cases(scales, data_dir, names=None):
+    cases = []
+    for scale in scales:
+        paths = prepare_inputs(data_dir, SCALES[scale])
+        for name, setup, function in CASES:
+            if names is None or name in names:
+                cases.append({'name': name, 'scale': scale, 'params': SCALES[scale], 'setup': partial(setup, paths), 'function': function})
+    return cases
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark pipeline steps on synthetic data and record time and peak memory.')
+    parser.add_argument('--scales', nargs='+', default=['small', 'medium'], choices=list(SCALES))
+    parser.add_argument('--cases', nargs='+', default=None, choices=[name for name, _, _ in CASES], help='cases to run; all if omitted')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs of each case (best is recorded)')
+    parser.add_argument('--data-dir', default='benchmark_data', help='directory of cached synthetic inputs')
+    parser.add_argument('--output', default='benchmarks.jsonl', help='JSON lines file results are appended to')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), default=None, help='only compare two results files')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative increase in time and memory')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.compare is not None:
+        comparison = compare_benchmarks(*args.compare, tolerance=args.tolerance, memory_tolerance=args.tolerance)
+        with pd.option_context('display.width', 200, 'display.max_columns', None):
+            print(comparison.round(3))
+        return int(comparison['regression'].any())
+
+    run_benchmarks(build_cases(args.scales, args.data_dir, args.cases), args.output, args.repeat)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,13 +8,53 @@ Created on Mon Mar  4 11:09:55 2024
 
 
 import requests
-from datetime import datetime
+from datetime import datetime, timedelta
 import csv
 import os
+import sys
+import json
+import time
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
+import hashlib
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
 import rasterio
+from rasterio import features
+from rasterio.enums import Resampling
 from rasterio.merge import merge
+from rasterio.transform import from_origin
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import calculate_default_transform
+from rasterio.windows import Window, from_bounds
 import glob
 
+# instrumentation of utility functions (Instrumentation_Utils.py at the repository root; no-op unless enabled)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Instrumentation_Utils import instrumented, record_counts
+
+
+# NWIS parameter codes for each supported data type
+PARAMETER_CODES = {'gage height': '00065',
+                   'streamflow': '00060'}
+
+# HTTP status codes worth retrying (rate limiting and transient server errors)
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+NWIS_IV_URL = 'https://waterservices.usgs.gov/nwis/iv/'
+
+# dtypes for the RDB format-spec row suffixes (s = string, n = numeric, d = date)
+RDB_DTYPES = {'s': 'string',
+              'n': 'float64',
+              'd': 'datetime64[ns]'}
+
+# guards read-modify-write of watermark index files when refreshing gauges from several threads
+_watermark_lock = threading.Lock()
+
 
 def is_url_valid(url):
     
@@ -35,14 +75,148 @@ def get_tile_footprint(path):
 
 
 
-def get_stream_gauge_locations(save_dir, data='gage height', state='ky', begin_date='1950-10-01', end_date=datetime.today().strftime('%Y-%m-%d')):
+def _rdb_rows_to_frame(rows, header, dtypes):
+
+    df = pd.DataFrame(rows, columns=header)
+
+    # cast to the mapped dtype, so every chunk of a file has the same schema whatever values it holds
+    # (e.g., whole numbers would be inferred as int64, and datetimes at another resolution)
+    for col, dtype in zip(header, dtypes):
+        if dtype == 'float64':
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype(dtype)
+        elif dtype == 'datetime64[ns]':
+            df[col] = pd.to_datetime(df[col], errors='coerce').astype(dtype)
+
+    return df
+
+
+
+@instrumented(key='data_path')
+def write_rdb_lines(lines, data_path, metadata_path=None, output_format='csv', chunk_size=100000):
+    """
+    Function to write an iterable of NWIS RDB lines to a .csv or .parquet file in chunks.
+    
+    Lines are consumed one at a time (e.g., from response.iter_lines), so peak memory depends 
+    on chunk_size and not on the length of the record. Comment lines (#) are written to the 
+    metadata file, the header row is kept, and the RDB format-spec row (e.g., 5s, 15s, 20d) is 
+    dropped and used to type the columns of parquet output.
+
+    Parameters
+    ----------
+    lines : iterable
+        RDB lines as strings without line endings.
+    data_path : string
+        Path for the output data file.
+    metadata_path : string, optional
+        Path for the output metadata file; comment lines are discarded if None.
+    output_format : string
+        'csv' or 'parquet' (requires pyarrow).
+    chunk_size : int
+        Number of data rows buffered before each write.
+
+    Returns
+    -------
+    int
+        Number of data rows written.
+
+    """
+    if output_format not in ('csv', 'parquet'):
+        raise ValueError(f"output_format must be 'csv' or 'parquet', not {output_format!r}")
+
+    if output_format == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+    header = None
+    dtypes = None
+    chunk = []
+    row_count = 0
+    csvfile = None
+    csvwriter = None
+    parquet_writer = None
+    metadata_file = open(metadata_path, 'w') if metadata_path is not None else None
+
+    def write_chunk(rows):
+        nonlocal parquet_writer
+        if output_format == 'csv':
+            csvwriter.writerows(rows)
+        else:
+            table = pa.Table.from_pandas(_rdb_rows_to_frame(rows, header, dtypes), preserve_index=False)
+            if parquet_writer is None:
+                parquet_writer = pq.ParquetWriter(data_path, table.schema)
+            parquet_writer.write_table(table)
+
+    try:
+        for line in lines:
+
+            # comment lines go to the metadata file
+            if line.startswith('#'):
+                if metadata_file is not None:
+                    metadata_file.write(line + '\n')
+                continue
+
+            # skip blank lines
+            if not line.strip():
+                continue
+
+            fields = line.split('\t')
+
+            # first non-comment line is the header
+            if header is None:
+                header = fields
+                if output_format == 'csv':
+                    csvfile = open(data_path, 'w', newline='')
+                    csvwriter = csv.writer(csvfile)
+                    csvwriter.writerow(header)
+                continue
+
+            # second non-comment line is the format-spec row, which is only used for dtypes
+            if dtypes is None:
+                dtypes = [RDB_DTYPES.get(spec.strip()[-1:], 'string') for spec in fields]
+                continue
+
+            chunk.append(fields)
+            row_count += 1
+
+            if len(chunk) >= chunk_size:
+                write_chunk(chunk)
+                chunk = []
+
+        if header is not None and dtypes is None:
+            dtypes = ['string'] * len(header)
+
+        # write remaining rows (or an empty parquet table so the file always has a schema)
+        if chunk or (output_format == 'parquet' and parquet_writer is None and header is not None):
+            write_chunk(chunk)
+
+        # response without any data lines still produces an (empty) file
+        if header is None:
+            open(data_path, 'w').close()
+
+    finally:
+        if csvfile is not None:
+            csvfile.close()
+        if parquet_writer is not None:
+            parquet_writer.close()
+        if metadata_file is not None:
+            metadata_file.close()
+
+    record_counts(rows=row_count)
+
+    return row_count
+
+
+
+
+@instrumented
+def get_stream_gauge_locations(save_dir, data='gage height', state='ky', begin_date='1950-10-01', end_date=datetime.today().strftime('%Y-%m-%d'), stream=False, output_format='csv', chunk_size=100000):
 
     if data == 'gage height':
 
         url = f"https://nwis.waterdata.usgs.gov/{state}/nwis/uv/?index_pmcode_00065=1&group_key=NONE&format=sitefile_output&sitefile_output_format=rdb&column_name=site_no&column_name=station_nm&column_name=dec_lat_va&column_name=dec_long_va&column_name=alt_va&column_name=huc_cd&column_name=basin_cd&column_name=rt_bol&range_selection=date_range&begin_date={begin_date}&end_date={end_date}&date_format=YYYY-MM-DD&rdb_compression=file&list_of_search_criteria=realtime_parameter_selection"
 
         data_path = os.path.join(
-            save_dir, f'gage_height_{begin_date}_{end_date}.csv')
+            save_dir, f'gage_height_{begin_date}_{end_date}.{output_format}')
 
         metadata_path = os.path.join(
             save_dir, f'gage_height_{begin_date}_{end_date}_metadata.txt')
@@ -52,11 +226,18 @@ def get_stream_gauge_locations(save_dir, data='gage height', state='ky', begin_d
         url = f"https://nwis.waterdata.usgs.gov/{state}/nwis/uv/?index_pmcode_00060=1&group_key=NONE&format=sitefile_output&sitefile_output_format=rdb&column_name=site_no&column_name=station_nm&column_name=dec_lat_va&column_name=dec_long_va&column_name=alt_va&column_name=huc_cd&column_name=basin_cd&column_name=rt_bol&range_selection=date_range&begin_date={begin_date}&end_date={end_date}&date_format=YYYY-MM-DD&rdb_compression=file&list_of_search_criteria=realtime_parameter_selection"
 
         data_path = os.path.join(
-            save_dir, f'streamflow_{begin_date}_{end_date}.csv')
+            save_dir, f'streamflow_{begin_date}_{end_date}.{output_format}')
 
         metadata_path = os.path.join(
             save_dir, f'streamflow_{begin_date}_{end_date}_metadata.txt')
 
+    # streaming mode writes typed rows in chunks as they arrive (no format-spec row in output)
+    if stream:
+        with requests.get(url, stream=True) as response:
+            response.encoding = response.encoding or 'utf-8'
+            write_rdb_lines(response.iter_lines(decode_unicode=True), data_path, metadata_path, output_format, chunk_size)
+        return data_path
+
     response = requests.get(url)
     text_data = response.text
     lines = text_data.splitlines()
@@ -77,69 +258,509 @@ def get_stream_gauge_locations(save_dir, data='gage height', state='ky', begin_d
 
 
 
-def get_stream_gage_data(gage_id, save_dir, data='gage height', begin_date='1950-10-01', end_date=datetime.today().strftime('%Y-%m-%d')):
+def get_stream_gage_url(gage_id, data='gage height', begin_date='1950-10-01', end_date=datetime.today().strftime('%Y-%m-%d'), base_url=NWIS_IV_URL):
+    """
+    Function to format the NWIS instantaneous values url for a single stream gauge.
+
+    Parameters
+    ----------
+    gage_id : string
+        NWIS site number of the stream gauge.
+    data : string
+        Data type, either 'gage height' or 'streamflow'.
+    begin_date : string
+        First date of the request (YYYY-MM-DD).
+    end_date : string
+        Last date of the request (YYYY-MM-DD).
+    base_url : string
+        NWIS instantaneous values service url (override for mirrors or local test servers).
+
+    Returns
+    -------
+    string
+        Request url.
+
+    """
+    parameter_id = PARAMETER_CODES[data]
+
+    return f"{base_url}?sites={gage_id}&parameterCd={parameter_id}&startDT={begin_date}T00:00:00.176-05:00&endDT={end_date}T00:00:00.176-05:00&siteStatus=all&format=rdb"
+
+
+
+def request_with_retry(url, session=None, retries=0, backoff=1.0, timeout=None, stream=False):
+    """
+    Function to submit a GET request, retrying connection errors and transient status codes with exponential backoff.
+
+    Parameters
+    ----------
+    url : string
+        Request url.
+    session : requests.Session, optional
+        Session used for connection pooling; module level requests.get is used if None.
+    retries : int
+        Number of additional attempts after the first request.
+    backoff : float
+        Base delay in seconds; attempt n waits backoff * 2**n before retrying.
+    timeout : float, optional
+        Timeout in seconds passed to the request.
+    stream : bool
+        If True, the response body is not downloaded until it is iterated.
+
+    Returns
+    -------
+    requests.Response
+        Response from the last attempt.
+
+    """
+    getter = session.get if session is not None else requests.get
+
+    for attempt in range(retries + 1):
+
+        try:
+            response = getter(url, timeout=timeout, stream=stream)
+
+            # anything other than rate limiting or a transient server error is final
+            if response.status_code not in RETRY_STATUS_CODES or attempt == retries:
+                return response
+
+            response.close()
+
+        except requests.RequestException:
+            if attempt == retries:
+                raise
+
+        time.sleep(backoff * 2 ** attempt)
+
+
+
+@instrumented(key='gage_id')
+def get_stream_gage_data(gage_id, save_dir, data='gage height', begin_date='1950-10-01', end_date=datetime.today().strftime('%Y-%m-%d'), session=None, retries=0, backoff=1.0, timeout=None, base_url=NWIS_IV_URL, stream=False, output_format='csv', chunk_size=100000):
+    """
+    Function to download stream gauge data from NWIS and save as .csv (or .parquet) file.
+
+    Parameters
+    ----------
+    gage_id : string
+        NWIS site number of the stream gauge.
+    save_dir : string
+        Directory for saving the data file.
+    data : string
+        Data type, either 'gage height' or 'streamflow'.
+    begin_date : string
+        First date of the request (YYYY-MM-DD).
+    end_date : string
+        Last date of the request (YYYY-MM-DD).
+    session : requests.Session, optional
+        Session used for connection pooling.
+    retries : int
+        Number of retries for connection errors and transient status codes.
+    backoff : float
+        Base delay in seconds for exponential backoff between retries.
+    timeout : float, optional
+        Timeout in seconds for the request.
+    base_url : string
+        NWIS instantaneous values service url (override for mirrors or local test servers).
+    stream : bool
+        If True, read the response line by line and write rows in chunks so peak memory 
+        does not grow with the length of the record; comment lines are saved to a 
+        _metadata.txt file next to the data file.
+    output_format : string
+        'csv' or 'parquet' (parquet requires pyarrow).
+    chunk_size : int
+        Number of rows buffered before each write.
+
+    Returns
+    -------
+    string
+        Path to the data file, or None if the request was not successful.
 
+    """
     # handle missing directory from save_dir parameter
     if not os.path.exists(save_dir):
-        os.makedirs(save_dir)
+        os.makedirs(save_dir, exist_ok=True)
 
-    # get data type from data parameter
-    if data == 'gage height':
-        parameter_id = '00065'
+    # format url using gage_id, data, begin_date, and end_date parameters
+    url = get_stream_gage_url(gage_id, data, begin_date, end_date, base_url)
+
+    # create path to save data file
+    data_name = f"{gage_id}_{data.replace(' ','')}_{begin_date}_{end_date}"
+    data_path = os.path.join(save_dir, f"{data_name}.{output_format}")
+
+    # metadata (comment lines) only saved when streaming
+    metadata_path = os.path.join(save_dir, f"{data_name}_metadata.txt") if stream else None
+
+    # submit request for response using url (optionally pooled session and retries)
+    response = request_with_retry(url, session, retries, backoff, timeout, stream)
+
+    with response:
+
+        # if response is not valid then nothing is saved
+        if response.status_code != 200:
+            return None
+
+        # iterate lines as they arrive when streaming, otherwise split full response text into lines
+        if stream:
+            response.encoding = response.encoding or 'utf-8'
+            lines = response.iter_lines(decode_unicode=True)
+        else:
+            lines = response.text.splitlines()
+
+        # write to temporary file first so an interrupted download never leaves a partial file behind;
+        # header is kept, format-spec row is dropped, comment and blank lines are skipped
+        partial_path = data_path + '.part'
+        write_rdb_lines(lines, partial_path, metadata_path, output_format, chunk_size)
+
+    os.replace(partial_path, data_path)
+
+    return data_path
+
+
+
+@instrumented
+def get_stream_gage_data_bulk(gage_ids, save_dir, data='gage height', begin_date='1950-10-01', end_date=datetime.today().strftime('%Y-%m-%d'), max_workers=8, retries=3, backoff=1.0, timeout=60, manifest_path=None, base_url=NWIS_IV_URL, stream=False, output_format='csv'):
+    """
+    Function to download data for many stream gauges concurrently over one pooled HTTP session.
+    
+    Completed downloads are recorded in a json manifest as soon as each one finishes, so 
+    re-running after a crash or interruption skips gauges that already finished.
+
+    Parameters
+    ----------
+    gage_ids : list
+        NWIS site numbers of the stream gauges.
+    save_dir : string
+        Directory for saving the data files.
+    data : string or list
+        Data type(s) to download for every gauge, 'gage height' and/or 'streamflow'.
+    begin_date : string
+        First date of the request (YYYY-MM-DD).
+    end_date : string
+        Last date of the request (YYYY-MM-DD).
+    max_workers : int
+        Number of download threads (also the size of the connection pool).
+    retries : int
+        Number of retries per gauge for connection errors and transient status codes.
+    backoff : float
+        Base delay in seconds for exponential backoff between retries.
+    timeout : float
+        Timeout in seconds for each request.
+    manifest_path : string, optional
+        Path of json resume manifest; defaults to download_manifest.json in save_dir.
+    base_url : string
+        NWIS instantaneous values service url (override for mirrors or local test servers).
+    stream : bool
+        If True, stream each response to disk in chunks (see get_stream_gage_data).
+    output_format : string
+        'csv' or 'parquet'.
+
+    Returns
+    -------
+    dict
+        Keys are '{gage_id}_{data}' and values are paths to data files (None if the download failed; 
+        a warning with the error is issued for each failed download).
+
+    """
+    if isinstance(data, str):
+        data = [data]
+
+    if not os.path.exists(save_dir):
+        os.makedirs(save_dir, exist_ok=True)
+
+    if manifest_path is None:
+        manifest_path = os.path.join(save_dir, 'download_manifest.json')
+
+    # read manifest of completed downloads from previous runs
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    # build list of jobs, skipping completed downloads of the same date range that still exist on disk
+    results = {}
+    jobs = []
+    for gage_id in gage_ids:
+        for data_type in data:
+            key = f"{gage_id}_{data_type.replace(' ','')}"
+            path = manifest.get(f"{key}_{begin_date}_{end_date}")
+            if path is not None and os.path.exists(path):
+                results[key] = path
+            else:
+                jobs.append((key, gage_id, data_type))
+
+    # single session with connection pool sized to the number of worker threads
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    manifest_lock = threading.Lock()
+
+    def download(gage_id, data_type):
+        return get_stream_gage_data(gage_id, save_dir, data=data_type, begin_date=begin_date, end_date=end_date, 
+                                    session=session, retries=retries, backoff=backoff, timeout=timeout, base_url=base_url, 
+                                    stream=stream, output_format=output_format)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+            futures = {executor.submit(download, gage_id, data_type): key for key, gage_id, data_type in jobs}
+
+            for future in as_completed(futures):
+                key = futures[future]
+
+                # a failed gauge (request, parse, or write error) does not stop the other downloads
+                try:
+                    path = future.result()
+                except Exception as exception:
+                    path = None
+                    warnings.warn(f'download of {key} failed: {type(exception).__name__}: {exception}')
+
+                results[key] = path
+
+                # record finished download immediately (write then rename so manifest is never half written)
+                if path is not None:
+                    with manifest_lock:
+                        manifest[f"{key}_{begin_date}_{end_date}"] = path
+                        with open(manifest_path + '.part', 'w') as f:
+                            json.dump(manifest, f, indent=1)
+                        os.replace(manifest_path + '.part', manifest_path)
+    finally:
+        session.close()
+
+    return results
     
-    if data == 'streamflow':
-        parameter_id = '00060'
 
-    # format url using gage_id, parameter_id, begin_date, and end_date parameters
-    url = f"https://waterservices.usgs.gov/nwis/iv/?sites={gage_id}&parameterCd={parameter_id}&startDT={begin_date}T00:00:00.176-05:00&endDT={end_date}T00:00:00.176-05:00&siteStatus=all&format=rdb"
 
-    # create path to save data as .csv file
-    data_path = os.path.join(save_dir, f"{gage_id}_{data.replace(' ','')}_{begin_date}_{end_date}.csv")
 
-    # submit request for response using url
-    response = requests.get(url)
+def _read_last_csv_row(path, block_size=4096):
+
+    # read backwards from end of file until a complete last line is found (avoids reading whole file)
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        tail = b''
+        while position > 0:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            tail = f.read(step) + tail
+            if tail.rstrip(b'\r\n').count(b'\n') >= 1:
+                break
+
+    lines = tail.decode('utf-8').splitlines()
+    lines = [line for line in lines if line.strip()]
+
+    return next(csv.reader([lines[-1]])) if lines else None
+
+
+
+def _standard_time(timestamp):
+    """Local standard time of an NWIS timestamp ('YYYY-MM-DD HH:MM' with optional tz_cd, e.g., '... CDT'), so the repeated daylight saving fall-back hour sorts after the daylight hour."""
+    date, clock, *tz_cd = timestamp.split(' ')
+    timestamp = datetime.fromisoformat(f'{date} {clock}')
+    return timestamp - timedelta(hours=1) if tz_cd and tz_cd[0].endswith('DT') else timestamp
+
+
+
+def get_stream_gage_watermark(gage_id, save_dir, data='gage height', watermark_path=None):
+    """
+    Function to get the last timestamp already stored for a stream gauge.
+    
+    The watermark index is checked first; if the gauge is missing from the index, the last row 
+    of the canonical per-gauge .csv file is read instead. The time zone code (tz_cd) is kept with 
+    the timestamp, so the repeated hour at the end of daylight saving time is not mistaken for 
+    stored data.
+
+    Parameters
+    ----------
+    gage_id : string
+        NWIS site number of the stream gauge.
+    save_dir : string
+        Directory containing the canonical per-gauge .csv files.
+    data : string
+        Data type, either 'gage height' or 'streamflow'.
+    watermark_path : string, optional
+        Path of json watermark index; defaults to watermarks.json in save_dir.
+
+    Returns
+    -------
+    string
+        Last stored timestamp and time zone code (YYYY-MM-DD HH:MM TZ, or YYYY-MM-DD HH:MM if the 
+        file has no tz_cd column), or None if nothing is stored.
+
+    """
+    key = f"{gage_id}_{data.replace(' ','')}"
+
+    if watermark_path is None:
+        watermark_path = os.path.join(save_dir, 'watermarks.json')
+
+    if os.path.exists(watermark_path):
+        with open(watermark_path) as f:
+            watermark = json.load(f).get(key)
+        if watermark is not None:
+            return watermark
+
+    store_path = os.path.join(save_dir, f"{key}.csv")
+
+    if not os.path.exists(store_path):
+        return None
+
+    with open(store_path, newline='') as f:
+        header = next(csv.reader(f), None)
+
+    last_row = _read_last_csv_row(store_path)
+
+    if header is None or 'datetime' not in header or last_row is None or last_row == header or len(last_row) != len(header):
+        return None
+
+    watermark = last_row[header.index('datetime')]
+    if 'tz_cd' in header and last_row[header.index('tz_cd')]:
+        watermark = f"{watermark} {last_row[header.index('tz_cd')]}"
+
+    return watermark
+
+
+
+@instrumented(key='gage_id')
+def update_stream_gage_data(gage_id, save_dir, data='gage height', begin_date='1950-10-01', end_date=datetime.today().strftime('%Y-%m-%d'), session=None, retries=0, backoff=1.0, timeout=None, base_url=NWIS_IV_URL, watermark_path=None):
+    """
+    Function to incrementally refresh one canonical .csv file per stream gauge.
+    
+    Only data after the last stored timestamp (watermark) is requested; rows from the response 
+    that overlap the stored record (compared in local standard time, see get_stream_gage_watermark) 
+    are dropped and the rest are appended as they stream in. 
+    The watermark of each gauge is kept in a json index in save_dir. The canonical file has the 
+    same layout as get_stream_gage_data output, named {gage_id}_{data}.csv.
+
+    Parameters
+    ----------
+    gage_id : string
+        NWIS site number of the stream gauge.
+    save_dir : string
+        Directory containing the canonical per-gauge .csv files.
+    data : string
+        Data type, either 'gage height' or 'streamflow'.
+    begin_date : string
+        First date requested if nothing is stored for the gauge yet (YYYY-MM-DD).
+    end_date : string
+        Last date of the request (YYYY-MM-DD).
+    session : requests.Session, optional
+        Session used for connection pooling.
+    retries : int
+        Number of retries for connection errors and transient status codes.
+    backoff : float
+        Base delay in seconds for exponential backoff between retries.
+    timeout : float, optional
+        Timeout in seconds for the request.
+    base_url : string
+        NWIS instantaneous values service url (override for mirrors or local test servers).
+    watermark_path : string, optional
+        Path of json watermark index; defaults to watermarks.json in save_dir.
+
+    Returns
+    -------
+    int
+        Number of new rows appended, or None if the request was not successful or the response has 
+        no data (no datetime column).
+
+    """
+    if not os.path.exists(save_dir):
+        os.makedirs(save_dir, exist_ok=True)
 
-    # if response is valid then proceed with data scraping
-    if response.status_code == 200:
+    if watermark_path is None:
+        watermark_path = os.path.join(save_dir, 'watermarks.json')
 
-        # convert response to text
-        text_data = response.text
+    key = f"{gage_id}_{data.replace(' ','')}"
+    store_path = os.path.join(save_dir, f"{key}.csv")
 
-        # split text into lines
-        lines = text_data.splitlines()
+    # request from the day of the last stored timestamp (overlap is removed below)
+    watermark = get_stream_gage_watermark(gage_id, save_dir, data, watermark_path)
+    if watermark is not None:
+        begin_date = watermark[:10]
 
-        # initialize counter for non-comment line numbers
-        non_comment_line_counter = 0
+    url = get_stream_gage_url(gage_id, data, begin_date, end_date, base_url)
 
-        # write data from response to file (in-memory)
-        with open(data_path, 'w', newline='') as csvfile:
+    response = request_with_retry(url, session, retries, backoff, timeout, stream=True)
+
+    # existing header of canonical file (new rows are aligned to it by column name)
+    store_header = None
+    if os.path.exists(store_path) and os.path.getsize(store_path) > 0:
+        with open(store_path, newline='') as f:
+            store_header = next(csv.reader(f), None)
+
+    header = None
+    format_row_skipped = False
+    appended = 0
+    last_timestamp = watermark
+    if watermark is not None:
+        watermark_day, watermark_time = watermark[:10], _standard_time(watermark)
+
+    with response:
+
+        if response.status_code != 200:
+            return None
+
+        response.encoding = response.encoding or 'utf-8'
+
+        with open(store_path, 'a', newline='') as csvfile:
 
-            # initialize csv writer from text
             csvwriter = csv.writer(csvfile)
 
-            # iterate through lines from response/text
-            for line in lines:
+            for line in response.iter_lines(decode_unicode=True):
 
                 # skip comment lines starting with # or blank lines
                 if line.startswith('#') or not line.strip():
                     continue
 
-                # if line is not a comment or blank, increase the line number counter
-                non_comment_line_counter += 1
+                fields = line.split('\t')
 
-                # first line is header info, which is kept; second line is meaningless, which is skipped here
-                if non_comment_line_counter == 2:
+                # first non-comment line is the header; written only if canonical file is new
+                if header is None:
+                    header = fields
+                    if 'datetime' not in header:
+                        return None
+                    if store_header is None:
+                        store_header = header
+                        csvwriter.writerow(header)
+                    datetime_idx = header.index('datetime')
+                    tz_idx = header.index('tz_cd') if 'tz_cd' in header else None
+                    columns_idx = [header.index(col) if col in header else None for col in store_header]
                     continue
 
-                # split lines into new lines using a tab
-                data = line.split('\t')
+                # second non-comment line is the RDB format-spec row
+                if not format_row_skipped:
+                    format_row_skipped = True
+                    continue
 
-                # write line to csv file
-                csvwriter.writerow(data)
-    
+                # drop overlap with stored record (only the day of the watermark is requested again)
+                timestamp = fields[datetime_idx] if tz_idx is None else f'{fields[datetime_idx]} {fields[tz_idx]}'.rstrip()
+                if watermark is not None and timestamp[:10] <= watermark_day and _standard_time(timestamp) <= watermark_time:
+                    continue
 
+                csvwriter.writerow([fields[i] if i is not None else '' for i in columns_idx])
+                appended += 1
 
+                # rows of the response are in chronological order
+                last_timestamp = timestamp
 
+    # update watermark index (write then rename so index is never half written)
+    if last_timestamp is not None:
+        with _watermark_lock:
+            watermarks = {}
+            if os.path.exists(watermark_path):
+                with open(watermark_path) as f:
+                    watermarks = json.load(f)
+            watermarks[key] = last_timestamp
+            with open(watermark_path + '.part', 'w') as f:
+                json.dump(watermarks, f, indent=1)
+            os.replace(watermark_path + '.part', watermark_path)
+
+    return appended
+
+
+
+
+@instrumented
 def mosaic_dem_tiles(tiles_paths, output_path):
     """
     Function to merge multiple geotiff files and save as new, single geotiff.
@@ -165,6 +786,7 @@ def mosaic_dem_tiles(tiles_paths, output_path):
         tiles_datasets.append(dem)
 
     mosaic, transform = merge(tiles_datasets)
+    record_counts(pixels=mosaic.size)
 
     mosaic_metadata = tiles_datasets[0].meta.copy()
 
@@ -181,3 +803,445 @@ def mosaic_dem_tiles(tiles_paths, output_path):
         dem.close()
 
 
+
+@instrumented
+def mosaic_dem_tiles_windowed(tiles_paths, output_path, block_size=1024, max_memory_mb=256, compress='deflate'):
+    """
+    Function to merge multiple geotiff files into a single tiled, compressed geotiff block by block.
+    
+    The output grid is computed from the bounds of the tiles (same as rasterio.merge.merge), then 
+    each output block is merged from only the tiles that intersect it and written, so the full 
+    mosaic is never held in memory. Overlapping tiles are resolved the same way as mosaic_dem_tiles 
+    (first tile in tiles_paths wins).
+
+    Parameters
+    ----------
+    tiles_paths : list
+        Paths of input geotiff files.
+    output_path : string
+        Path for new geotiff mosaic output file.
+    block_size : int
+        Width and height of output blocks/tiles in pixels (multiple of 16).
+    max_memory_mb : float
+        Approximate cap on memory used per block; block_size is halved (down to 16, the smallest 
+        GeoTIFF tile) until a block fits, and ValueError is raised if no block size fits.
+    compress : string
+        GeoTIFF compression (e.g., 'deflate', 'lzw', 'zstd').
+
+    Returns
+    -------
+    None.
+
+    """
+    with ExitStack() as stack:
+
+        # open all tiles (metadata only; pixel data is read per block)
+        datasets = [stack.enter_context(rasterio.open(tile)) for tile in tiles_paths]
+        first = datasets[0]
+        xres, yres = first.res
+        count = first.count
+        itemsize = np.dtype(first.dtypes[0]).itemsize
+
+        # output grid from union of tile bounds
+        left = min(ds.bounds.left for ds in datasets)
+        bottom = min(ds.bounds.bottom for ds in datasets)
+        right = max(ds.bounds.right for ds in datasets)
+        top = max(ds.bounds.top for ds in datasets)
+        width = int(round((right - left) / xres))
+        height = int(round((top - bottom) / yres))
+        transform = from_origin(left, top, xres, yres)
+        record_counts(pixels=height * width * count)
+
+        # shrink blocks until merged block plus reads from overlapping tiles fit within memory cap (tiles are multiples of 16)
+        pixel_bytes = 2 * count * itemsize
+        block_size = max(16, block_size - block_size % 16)
+        while block_size > 16 and pixel_bytes * block_size ** 2 > max_memory_mb * 1024 ** 2:
+            block_size = max(16, block_size // 2 - block_size // 2 % 16)
+        if pixel_bytes * block_size ** 2 > max_memory_mb * 1024 ** 2:
+            raise ValueError(f'max_memory_mb={max_memory_mb} is smaller than the smallest block ({pixel_bytes * 16 ** 2 / 1024 ** 2:.3f} MB)')
+
+        profile = first.profile.copy()
+        profile.update({'driver': 'GTiff',
+                        'height': height,
+                        'width': width,
+                        'transform': transform,
+                        'count': count,
+                        'tiled': True,
+                        'blockxsize': block_size,
+                        'blockysize': block_size,
+                        'compress': compress,
+                        'BIGTIFF': 'IF_SAFER'})
+
+        with rasterio.open(output_path, 'w', **profile) as output_raster:
+
+            for row_off in range(0, height, block_size):
+                for col_off in range(0, width, block_size):
+
+                    window = Window(col_off, row_off, min(block_size, width - col_off), min(block_size, height - row_off))
+                    block_left, block_top = transform * (col_off, row_off)
+                    block_right, block_bottom = transform * (col_off + window.width, row_off + window.height)
+
+                    # only tiles intersecting block are read
+                    intersecting = [ds for ds in datasets if ds.bounds.left < block_right and ds.bounds.right > block_left 
+                                    and ds.bounds.bottom < block_top and ds.bounds.top > block_bottom]
+
+                    if not intersecting:
+                        continue
+
+                    block, _ = merge(intersecting, bounds=(block_left, block_bottom, block_right, block_top), 
+                                     res=(xres, yres), nodata=first.nodata)
+
+                    output_raster.write(block[:, :window.height, :window.width], window=window)
+
+
+
+def build_dem_vrt(tiles_paths, vrt_path):
+    """
+    Function to build a virtual raster (VRT) mosaic of geotiff tiles without copying pixel data.
+    
+    The VRT can be opened with rasterio like any other raster and is read lazily, so it can 
+    stand in for the mosaic geotiff in later steps.
+
+    Parameters
+    ----------
+    tiles_paths : list
+        Paths of input geotiff files.
+    vrt_path : string
+        Path for new .vrt file.
+
+    Returns
+    -------
+    string
+        Path to .vrt file.
+
+    """
+    from osgeo import gdal
+
+    # gdal takes overlapping pixels from the last source, so reverse to match merge (first tile wins)
+    vrt = gdal.BuildVRT(vrt_path, list(tiles_paths)[::-1])
+    vrt.FlushCache()
+    vrt = None
+
+    return vrt_path
+
+
+
+@instrumented(key='dem_path')
+def clip_reproject_dem(dem_path, polygons, output_path, dst_crs='EPSG:26916', resolution=None, resampling='cubic',
+                       block_size=1024, num_threads='ALL_CPUS', warp_mem_limit=256, compress='deflate'):
+    """
+    Function to clip a DEM (geotiff or VRT mosaic, e.g., from build_dem_vrt) to watershed polygons and reproject it in one pass.
+
+    Combines the mask (crop to watersheds) and gdal.Warp steps of PreProcessing_Spatial without holding either
+    raster in memory. The output grid is the default warp grid of the source pixels covering the watersheds
+    (the grid gdal.Warp gives for the cropped DEM). The output is then warped block by block through a WarpedVRT,
+    so each block only reads the source pixels it needs (with GDAL warp multithreading), blocks that do not
+    intersect the watersheds are skipped entirely, and pixels with centers outside the watersheds are nodata.
+
+    Parameters
+    ----------
+    dem_path : string
+        Path to source DEM (.tif or .vrt).
+    polygons : string or geodataframe
+        Watershed polygons (or path to polygon file) to clip to; any crs.
+    output_path : string
+        Path for clipped and reprojected geotiff.
+    dst_crs : string
+        Output crs.
+    resolution : float or tuple, optional
+        Output pixel size in units of dst_crs; default warp resolution if None.
+    resampling : string
+        Resampling method (rasterio.enums.Resampling name, e.g., 'cubic', 'bilinear', 'nearest').
+    block_size : int
+        Width and height of output blocks/tiles in pixels (multiple of 16).
+    num_threads : int or string
+        GDAL warp threads (NUM_THREADS warp option; 'ALL_CPUS' uses every core).
+    warp_mem_limit : int
+        GDAL warp memory limit (MB).
+    compress : string
+        GeoTIFF compression (e.g., 'deflate', 'lzw', 'zstd').
+
+    Returns
+    -------
+    string
+        Path to output geotiff.
+
+    """
+    gdf = gpd.read_file(polygons) if isinstance(polygons, str) else polygons
+    watersheds = shapely.union_all(gdf.to_crs(dst_crs).geometry.values)
+    shapely.prepare(watersheds)
+
+    with rasterio.open(dem_path) as src:
+
+        # source pixels covering watersheds (same crop as rasterio.mask.mask with crop=True)
+        crop = from_bounds(*gdf.to_crs(src.crs).total_bounds, transform=src.transform)
+        col_off, row_off = int(np.floor(crop.col_off)), int(np.floor(crop.row_off))
+        crop = Window(col_off, row_off, int(np.ceil(crop.col_off + crop.width)) - col_off, int(np.ceil(crop.row_off + crop.height)) - row_off)
+        crop = crop.intersection(Window(0, 0, src.width, src.height))
+        transform, width, height = calculate_default_transform(src.crs, dst_crs, crop.width, crop.height,
+                                                               *src.window_bounds(crop), resolution=resolution)
+
+        block_size = max(16, block_size - block_size % 16)
+        profile = {'driver': 'GTiff', 'height': height, 'width': width, 'count': 1, 'dtype': 'float32', 'crs': dst_crs,
+                   'transform': transform, 'nodata': np.nan, 'tiled': True, 'blockxsize': block_size,
+                   'blockysize': block_size, 'compress': compress, 'BIGTIFF': 'IF_SAFER'}
+
+        with WarpedVRT(src, crs=dst_crs, transform=transform, height=height, width=width, nodata=np.nan, dtype='float32',
+                       resampling=Resampling[resampling], warp_mem_limit=warp_mem_limit,
+                       warp_extras={'NUM_THREADS': num_threads}) as vrt, \
+             rasterio.open(output_path, 'w', **profile) as dst:
+
+            for row_off in range(0, height, block_size):
+                for col_off in range(0, width, block_size):
+
+                    window = Window(col_off, row_off, min(block_size, width - col_off), min(block_size, height - row_off))
+                    window_transform = rasterio.windows.transform(window, transform)
+                    window_box = shapely.box(*rasterio.windows.bounds(window, transform))
+
+                    # blocks outside watersheds are never read or warped (left as nodata)
+                    if not watersheds.intersects(window_box):
+                        continue
+
+                    block = vrt.read(1, window=window)
+                    if not watersheds.contains(window_box):
+                        inside = features.geometry_mask([watersheds.intersection(window_box)], block.shape, window_transform, invert=True)
+                        block[~inside] = np.nan
+
+                    dst.write(block, 1, window=window)
+                    record_counts(pixels=block.size)
+
+    return output_path
+
+
+
+
+
+def _write_watershed_index(gdf, index_path, id_col, columns, source=''):
+    """Save ids, bounds, extra columns, and WKB geometries (one byte buffer plus offsets) of polygons to .npz."""
+    wkb = shapely.to_wkb(gdf.geometry.values)
+    lengths = np.fromiter((len(geometry) for geometry in wkb), dtype=np.int64, count=len(wkb))
+    arrays = {'ids': gdf[id_col].to_numpy().astype(str),
+              'bounds': shapely.bounds(gdf.geometry.values),
+              'wkb': np.frombuffer(b''.join(wkb), dtype=np.uint8),
+              'offsets': np.concatenate([[0], np.cumsum(lengths)]),
+              'crs': np.array('' if gdf.crs is None else gdf.crs.to_wkt()),
+              'id_col': np.array(id_col),
+              'source': np.array(source)}
+    for col in columns:
+        values = gdf[col].to_numpy()
+        arrays[f'column_{col}'] = values.astype(str) if values.dtype == object else values
+
+    # write then rename so index is never half written
+    with open(index_path + '.part', 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(index_path + '.part', index_path)
+
+
+
+@instrumented(key='polygon_path')
+def build_watershed_index(polygon_path, index_path, id_col='huc10', columns=None):
+    """
+    Function to build a persistent spatial index file of watershed polygons (e.g., national HUC10s).
+
+    Geometries are stored as WKB with their ids and bounding boxes in a single .npz, so loading the index 
+    (load_watershed_index) only decodes geometries and bulk loads an STRtree instead of reading and parsing 
+    the shapefile. The index is only rebuilt if the polygon file has changed since it was built.
+
+    Parameters
+    ----------
+    polygon_path : string
+        Path to polygon file (shapefile, geopackage, etc.) of watersheds.
+    index_path : string
+        Path for index .npz file.
+    id_col : string
+        Column of watershed ids.
+    columns : list, optional
+        Other columns (e.g., 'name', 'areasqkm') to keep in the index.
+
+    Returns
+    -------
+    string
+        Path to index .npz file.
+
+    """
+    columns = list(columns or [])
+
+    # index is keyed on polygon file and options, as in rasterize_zones
+    stat = os.stat(polygon_path)
+    key_source = json.dumps([os.path.abspath(polygon_path), stat.st_size, stat.st_mtime_ns, id_col, columns])
+    key = hashlib.sha1(key_source.encode()).hexdigest()[:16]
+
+    if os.path.exists(index_path):
+        with np.load(index_path) as index:
+            if str(index['source']) == key:
+                return index_path
+
+    gdf = gpd.read_file(polygon_path, columns=[id_col] + columns)
+    _write_watershed_index(gdf, index_path, id_col, columns, key)
+
+    return index_path
+
+
+
+def load_watershed_index(index_path):
+    """
+    Function to load a watershed index built with build_watershed_index.
+
+    Parameters
+    ----------
+    index_path : string
+        Path to index .npz file.
+
+    Returns
+    -------
+    dict
+        'ids' (array of watershed ids), 'geometries' (array of shapely polygons), 'bounds' (n x 4 array), 
+        'tree' (shapely STRtree of geometries), 'crs', 'id_col', and 'columns' (dict of other kept columns).
+
+    """
+    with np.load(index_path) as index:
+        offsets = index['offsets']
+        buffer = index['wkb'].tobytes()
+        geometries = shapely.from_wkb([buffer[start:end] for start, end in zip(offsets[:-1], offsets[1:])])
+        return {'ids': index['ids'],
+                'geometries': geometries,
+                'bounds': index['bounds'],
+                'tree': shapely.STRtree(geometries),
+                'crs': str(index['crs']) or None,
+                'id_col': str(index['id_col']),
+                'columns': {name[len('column_'):]: index[name] for name in index.files if name.startswith('column_')},
+                'path': index_path}
+
+
+
+def watershed_index_frame(index, positions=None):
+    """Geodataframe (ids, kept columns, geometry) of all watersheds in index, or only those at positions."""
+    positions = slice(None) if positions is None else positions
+    data = {index['id_col']: index['ids'][positions]}
+    data.update({col: values[positions] for col, values in index['columns'].items()})
+    return gpd.GeoDataFrame(data, geometry=index['geometries'][positions], crs=index['crs'])
+
+
+
+def _index_geometries(index, geometries):
+    """Array of query geometries in crs of index from a bounding box, shapely geometry, geoseries, or geodataframe."""
+    if isinstance(geometries, (gpd.GeoDataFrame, gpd.GeoSeries)):
+        if index['crs'] is not None and geometries.crs is not None:
+            geometries = geometries.to_crs(index['crs'])
+        return geometries.geometry.values if isinstance(geometries, gpd.GeoDataFrame) else geometries.values
+    if isinstance(geometries, tuple) and len(geometries) == 4 and all(np.isscalar(value) for value in geometries):
+        return np.array([shapely.box(*geometries)])
+    return np.atleast_1d(np.asarray(geometries, dtype=object))
+
+
+
+@instrumented
+def query_watersheds(index, geometries, predicate='intersects'):
+    """
+    Function to select the watersheds of an index that satisfy a predicate with any of the query geometries.
+
+    Replaces gpd.sjoin(left_df=watersheds, right_df=boundary, how='inner', predicate=predicate) when 
+    extracting watersheds of a state (or several states, or a bounding box), without reading the watershed 
+    file or building a new tree for each query.
+
+    Parameters
+    ----------
+    index : dict
+        Watershed index from load_watershed_index.
+    geometries : tuple, shapely geometry, array, geoseries, or geodataframe
+        Query geometries; a tuple (minx, miny, maxx, maxy) is a bounding box in crs of index. Geoseries and 
+        geodataframes are reprojected to crs of index.
+    predicate : string, optional
+        Predicate between watershed and query geometry (e.g., 'intersects', 'within', 'contains'), or None for 
+        bounding box intersection only.
+
+    Returns
+    -------
+    GeoDataFrame
+        Matching watersheds (each once, in index order) with ids, kept columns, and geometry.
+
+    """
+    query = _index_geometries(index, geometries)
+
+    # tree.query tests query geometry against watersheds, so predicate is reversed (watershed within query = query contains watershed)
+    reverse = {'within': 'contains', 'contains': 'within', 'covered_by': 'covers', 'covers': 'covered_by'}
+    _, positions = index['tree'].query(query, predicate=reverse.get(predicate, predicate))
+
+    return watershed_index_frame(index, np.unique(positions))
+
+
+
+@instrumented
+def assign_points_to_watersheds(index, points, predicate='within'):
+    """
+    Function to assign points (e.g., stream gauges) to the watershed containing them, in bulk.
+
+    Replaces gpd.sjoin(left_df=points, right_df=watersheds, predicate='within'), so new gauges are assigned 
+    by querying the saved index instead of joining again with the full watershed file. A point on a boundary 
+    shared by two watersheds (predicate 'intersects') is assigned to the first in index order.
+
+    Parameters
+    ----------
+    index : dict
+        Watershed index from load_watershed_index.
+    points : geoseries or geodataframe
+        Points to assign (reprojected to crs of index).
+    predicate : string, optional
+        Predicate between point and watershed ('within' or 'intersects').
+
+    Returns
+    -------
+    Series
+        Watershed id of each point (same index as points; missing for points outside all watersheds).
+
+    """
+    query = _index_geometries(index, points)
+    point_positions, positions = index['tree'].query(query, predicate=predicate)
+
+    # first watershed of each point (query results are sorted by point)
+    first = np.unique(point_positions, return_index=True)[1]
+    ids = pd.Series(pd.NA, index=points.index, dtype='string', name=index['id_col'])
+    ids.iloc[point_positions[first]] = index['ids'][positions[first]]
+
+    return ids
+
+
+
+def extend_watershed_index(index_path, polygons, id_col=None):
+    """
+    Function to add watersheds (e.g., of a new state) to an index file, keeping watersheds already indexed.
+
+    Parameters
+    ----------
+    index_path : string
+        Path to index .npz file (from build_watershed_index).
+    polygons : string or geodataframe
+        Watershed polygons (or path to polygon file) to add; reprojected to crs of index. Polygons with ids 
+        already in the index are skipped.
+    id_col : string, optional
+        Column of watershed ids in polygons; same as index if None.
+
+    Returns
+    -------
+    dict
+        Updated watershed index (as from load_watershed_index).
+
+    """
+    index = load_watershed_index(index_path)
+    id_col = id_col or index['id_col']
+
+    gdf = gpd.read_file(polygons) if isinstance(polygons, str) else polygons
+    if index['crs'] is not None and gdf.crs is not None:
+        gdf = gdf.to_crs(index['crs'])
+
+    gdf = gdf.loc[~gdf[id_col].astype(str).isin(index['ids'])].rename(columns={id_col: index['id_col']})
+    if gdf.empty:
+        return index
+
+    added = gpd.GeoDataFrame(gdf[[index['id_col']] + list(index['columns'])], geometry=gdf.geometry.values, crs=gdf.crs)
+    combined = pd.concat([watershed_index_frame(index), added], ignore_index=True)
+
+    # source key cleared so a later build_watershed_index from the original file rebuilds it
+    _write_watershed_index(combined, index_path, index['id_col'], list(index['columns']))
+
+    return load_watershed_index(index_path)
@@ -0,0 +1,116 @@
+"""
+Benchmark of the persistent watershed index vs. spatial joins with geopandas.
+
+Times the two joins of the preprocessing notebooks, extracting the watersheds that intersect a state boundary
+(PreProcessing_Spatial) and assigning stream gauges to the watershed containing them (PreProcessing_StreamGauges),
+with gpd.sjoin on the watershed file and with query_watersheds/assign_points_to_watersheds on the saved index,
+and checks that both give the same watersheds. Defaults to the national HUC10 watersheds (about 18k polygons);
+if no watershed file is given, synthetic watersheds (Voronoi cells of random points) are generated instead.
+Run from the Data directory, e.g.
+
+    python SpatialIndex_Benchmark.py --polygons nhd/nhd_shapefiles/WBDHU10.shp --boundary ky_boundaries/boundaries_shapefiles/GU_StateOrTerritory.shp
+    python SpatialIndex_Benchmark.py --synthetic 18000 --points 5000
+"""
+
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import geopandas as gpd
+import shapely
+
+# synthetic data generators of the benchmark suite
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Benchmarks'))
+
+from Data_Utils import build_watershed_index, load_watershed_index, query_watersheds, assign_points_to_watersheds
+from Benchmark_Utils import synthetic_watersheds
+
+
+# extent of synthetic watersheds (roughly the conterminous U.S. in Albers equal area)
+SYNTHETIC_BOUNDS, SYNTHETIC_CRS = (-2.4e6, 2.6e5, 2.3e6, 3.2e6), 'EPSG:5070'
+
+
+def random_points(n, bounds, crs, seed=1):
+    rng = np.random.default_rng(seed)
+    points = shapely.points(rng.uniform(bounds[0], bounds[2], n), rng.uniform(bounds[1], bounds[3], n))
+    return gpd.GeoDataFrame({'site_no': np.arange(n).astype(str)}, geometry=points, crs=crs)
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def benchmark(polygon_path, boundary, points, index_path, id_col='huc10'):
+
+    results = {}
+
+    # index built once (not timed as part of the queries; this is the cost saved on every later join)
+    _, results['build_index_seconds'] = timed(build_watershed_index, polygon_path, index_path, id_col)
+    index, results['load_index_seconds'] = timed(load_watershed_index, index_path)
+
+    ##### watersheds intersecting boundary
+    def sjoin_watersheds():
+        gdf_watersheds = gpd.read_file(polygon_path, columns=[id_col])
+        return gpd.sjoin(left_df=gdf_watersheds, right_df=boundary.to_crs(gdf_watersheds.crs), how='inner', predicate='intersects')
+
+    joined, results['sjoin_intersects_seconds'] = timed(sjoin_watersheds)
+    queried, results['index_intersects_seconds'] = timed(query_watersheds, index, boundary)
+    results['intersects_watersheds'] = len(queried)
+    results['intersects_identical'] = set(joined[id_col].astype(str)) == set(queried[id_col])
+
+    ##### points within watersheds
+    def sjoin_points():
+        gdf_watersheds = gpd.read_file(polygon_path, columns=[id_col])
+        return gpd.sjoin(left_df=points.to_crs(gdf_watersheds.crs), right_df=gdf_watersheds, predicate='within')
+
+    joined, results['sjoin_within_seconds'] = timed(sjoin_points)
+    assigned, results['index_within_seconds'] = timed(assign_points_to_watersheds, index, points)
+    results['points_assigned'] = int(assigned.notna().sum())
+    expected = joined[~joined.index.duplicated()][id_col].astype(str)
+    results['within_identical'] = bool(assigned.dropna().sort_index().astype(str).equals(expected.sort_index()))
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the watershed index with gpd.sjoin for boundary and gauge joins.')
+    parser.add_argument('--polygons', default=None, help='watershed polygon file (e.g., national WBDHU10.shp); synthetic if omitted')
+    parser.add_argument('--boundary', default=None, help='boundary polygon file (e.g., state boundary); box in center of watersheds if omitted')
+    parser.add_argument('--id-col', default='huc10')
+    parser.add_argument('--synthetic', type=int, default=18000, help='number of synthetic watersheds')
+    parser.add_argument('--points', type=int, default=5000, help='number of random points (gauges) to assign')
+    parser.add_argument('--index', default=None, help='path for index .npz (temporary if omitted)')
+    parser.add_argument('--output', default=None, help='optional path for json results')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+
+        polygon_path = args.polygons
+        if polygon_path is None:
+            polygon_path = os.path.join(tmp_dir, 'synthetic_huc10.gpkg')
+            synthetic_watersheds(args.synthetic, SYNTHETIC_BOUNDS, SYNTHETIC_CRS).to_file(polygon_path)
+
+        info = gpd.read_file(polygon_path, rows=1)
+        bounds = gpd.read_file(polygon_path, columns=[]).total_bounds
+
+        if args.boundary is not None:
+            boundary = gpd.read_file(args.boundary)
+        else:
+            center, size = (bounds[:2] + bounds[2:]) / 2, (bounds[2:] - bounds[:2]) / 10
+            boundary = gpd.GeoDataFrame(geometry=[shapely.box(*(center - size), *(center + size))], crs=info.crs)
+
+        points = random_points(args.points, bounds, info.crs)
+        results = benchmark(polygon_path, boundary, points, args.index or os.path.join(tmp_dir, 'huc10_index.npz'), args.id_col)
+
+    print(json.dumps(results, indent=1))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
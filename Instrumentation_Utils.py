@@ -0,0 +1,241 @@
+"""
+Opt-in instrumentation of the stage utility functions.
+
+Functions decorated with @instrumented record one JSON line per call (wall and CPU time, bytes read and written,
+rows and pixels processed, peak resident memory, and the gauge or raster the call was for) while instrumentation
+is enabled, either with enable_instrumentation(path) or by setting the WATERSHEDS_INSTRUMENTATION environment
+variable to the JSON lines path (which also enables it in worker processes). When disabled, a decorated function
+only costs one dictionary lookup per call. summarize_instrumentation aggregates the records by function (and
+optionally by gauge or raster).
+
+The stage utility modules always import this module (adding the repository root to the path if needed), so there
+is one implementation of the decorators and no fallback copies in the stage modules.
+"""
+
+
+import os
+import json
+import time
+import socket
+import threading
+import functools
+
+import numpy as np
+import pandas as pd
+
+
+ENVIRONMENT_VARIABLE = 'WATERSHEDS_INSTRUMENTATION'
+
+# path and file descriptor of the JSON lines output (path None = disabled)
+_state = {'path': None, 'fd': None, 'pid': None}
+_lock = threading.Lock()
+_local = threading.local()
+
+# /proc counters (Linux); bytes read/written include sockets (e.g., HTTP responses) as well as files
+_THREAD_IO = '/proc/thread-self/io'
+_STATUS = '/proc/self/status'
+
+
+
+
+def enable_instrumentation(path):
+    """Record calls of instrumented functions to JSON lines file path (appended to) until disabled."""
+    disable_instrumentation()
+    with _lock:
+        _state['path'] = os.path.abspath(path)
+    os.environ[ENVIRONMENT_VARIABLE] = _state['path']
+
+
+
+def disable_instrumentation():
+    """Stop recording calls (in this process and in worker processes started afterwards)."""
+    with _lock:
+        if _state['fd'] is not None:
+            os.close(_state['fd'])
+        _state.update({'path': None, 'fd': None, 'pid': None})
+    os.environ.pop(ENVIRONMENT_VARIABLE, None)
+
+
+
+def instrumentation_enabled():
+    return _state['path'] is not None
+
+
+
+def _write_record(record):
+    """Append record as one JSON line (single O_APPEND write, so lines from threads and processes do not interleave)."""
+    with _lock:
+        # file is reopened after fork so each process has its own descriptor
+        if _state['fd'] is None or _state['pid'] != os.getpid():
+            _state['fd'] = os.open(_state['path'], os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            _state['pid'] = os.getpid()
+        os.write(_state['fd'], (json.dumps(record, default=str) + '\n').encode())
+
+
+
+def _io_counters():
+    """(bytes read, bytes written) by this thread so far, or (None, None) if not available."""
+    try:
+        with open(_THREAD_IO) as f:
+            counters = dict(line.split(':') for line in f)
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+
+def _memory_mb(field):
+    """Peak (VmHWM) or current (VmRSS) resident memory of this process (MB), or None if not available."""
+    try:
+        with open(_STATUS) as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+
+def _reset_peak_memory():
+    """Reset VmHWM to current resident memory (Linux), so the peak of the next call can be read."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+
+def _result_counts(result):
+    """Rows (dataframes, series, 1-D arrays) or pixels (2-D and 3-D arrays) of a function result."""
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        return {'rows': len(result)}
+    if isinstance(result, np.ndarray):
+        return {'pixels': int(result.size)} if result.ndim > 1 else {'rows': len(result)}
+    return {}
+
+
+
+def record_counts(**counts):
+    """Add counts (e.g., rows=..., pixels=..., bytes_downloaded=...) to the innermost instrumented call of this thread."""
+    stack = getattr(_local, 'stack', None)
+    if stack:
+        for name, value in counts.items():
+            stack[-1][name] = stack[-1].get(name, 0) + int(value)
+
+
+
+def instrumented(function=None, key=None):
+    """
+    Decorator recording each call of function while instrumentation is enabled.
+
+    Parameters
+    ----------
+    function : callable
+        Function to instrument (decorator used without arguments).
+    key : string, optional
+        Argument identifying what the call is for (e.g., 'gage_id', 'raster_path'), recorded as 'key'.
+
+    Returns
+    -------
+    callable
+        Wrapped function (same name, so it can still be pickled to worker processes).
+
+    """
+    if function is None:
+        return functools.partial(instrumented, key=key)
+
+    name = f'{function.__module__}.{function.__qualname__}'
+    code = function.__code__
+    key_position = list(code.co_varnames[:code.co_argcount]).index(key) if key in code.co_varnames[:code.co_argcount] else None
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if _state['path'] is None:
+            return function(*args, **kwargs)
+
+        stack = _local.__dict__.setdefault('stack', [])
+        if not stack:
+            _reset_peak_memory()
+        counts = {}
+        stack.append(counts)
+
+        read_before, written_before = _io_counters()
+        start, cpu_start = time.perf_counter(), time.thread_time()
+        error = None
+        try:
+            result = function(*args, **kwargs)
+            return result
+        except BaseException as exception:
+            error = f'{type(exception).__name__}: {exception}'
+            result = None
+            raise
+        finally:
+            seconds, cpu_seconds = time.perf_counter() - start, time.thread_time() - cpu_start
+            read_after, written_after = _io_counters()
+            stack.pop()
+
+            record = {'function': name, 'key': None, 'seconds': seconds, 'cpu_seconds': cpu_seconds,
+                      'bytes_read': None if read_before is None else read_after - read_before,
+                      'bytes_written': None if written_before is None else written_after - written_before}
+            if key is not None:
+                value = kwargs[key] if key in kwargs else args[key_position] if key_position is not None and key_position < len(args) else None
+                record['key'] = value if isinstance(value, (str, int, float)) or value is None else str(value)
+            record.update(_result_counts(result))
+            record.update(counts)
+            record.update({'peak_rss_mb': _memory_mb('VmHWM'), 'rss_mb': _memory_mb('VmRSS'), 'depth': len(stack),
+                           'pid': os.getpid(), 'thread': threading.current_thread().name, 'host': socket.gethostname(),
+                           'time': time.time(), 'error': error})
+            _write_record(record)
+
+    return wrapper
+
+
+
+def read_instrumentation(path):
+    """Dataframe of the call records in a JSON lines file."""
+    with open(path) as f:
+        return pd.DataFrame([json.loads(line) for line in f if line.strip()])
+
+
+
+def summarize_instrumentation(records, by_key=False):
+    """
+    Aggregate call records by function (and optionally by gauge or raster).
+
+    Parameters
+    ----------
+    records : string or dataframe
+        JSON lines path or read_instrumentation dataframe.
+    by_key : bool
+        Also group by the key of each call (gauge, raster, etc.).
+
+    Returns
+    -------
+    DataFrame
+        Calls, errors, total/mean/max seconds, CPU seconds, bytes read and written, rows and pixels processed, and
+        maximum peak resident memory, sorted by total seconds.
+
+    """
+    df = read_instrumentation(records) if isinstance(records, str) else records.copy()
+    for col in ['rows', 'pixels', 'bytes_read', 'bytes_written']:
+        if col not in df.columns:
+            df[col] = np.nan
+    df['errors'] = df['error'].notna()
+
+    groups = ['function', 'key'] if by_key else ['function']
+    summary = df.groupby(groups, dropna=False).agg(calls=('seconds', 'size'), errors=('errors', 'sum'),
+                                                   total_seconds=('seconds', 'sum'), mean_seconds=('seconds', 'mean'),
+                                                   max_seconds=('seconds', 'max'), cpu_seconds=('cpu_seconds', 'sum'),
+                                                   bytes_read=('bytes_read', 'sum'), bytes_written=('bytes_written', 'sum'),
+                                                   rows=('rows', 'sum'), pixels=('pixels', 'sum'),
+                                                   peak_rss_mb=('peak_rss_mb', 'max'))
+
+    return summary.sort_values('total_seconds', ascending=False)
+
+
+
+# enabled from the environment (e.g., in worker processes of an instrumented run)
+if os.environ.get(ENVIRONMENT_VARIABLE):
+    _state['path'] = os.path.abspath(os.environ[ENVIRONMENT_VARIABLE])
@@ -0,0 +1,366 @@
+import os
+import json
+import time
+import shutil
+import pickle
+import hashlib
+import inspect
+import importlib
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+
+# markers used in node arguments:
+#   SourceFile(path) - file (or directory, or shapefile with its sidecar files) outside the pipeline, hashed by content
+#   Output(name) - file (or directory if name ends with '/') written by the node into its artifact directory
+#   Artifact(node, output, path) - output of another node (return value if output is None; path within output directory)
+SourceFile = namedtuple('SourceFile', ['path'])
+Output = namedtuple('Output', ['name'])
+Artifact = namedtuple('Artifact', ['node', 'output', 'path'], defaults=[None, None])
+
+RESULT_FILE = 'result.pkl'
+DONE_FILE = 'done.json'
+
+
+
+
+def pipeline_node(name, function, kwargs=None, depends=None, publish=None, version=None, code_modules=None):
+    """
+    Define a pipeline node: function(**kwargs) with its artifacts cached under a key of its inputs.
+
+    Parameters
+    ----------
+    name : string
+        Unique node name.
+    function : callable
+        Module-level function (run in a worker process).
+    kwargs : dict, optional
+        Arguments of function; values may contain SourceFile, Output, and Artifact markers (also in lists/dicts).
+    depends : list, optional
+        SourceFile markers the function reads without receiving them as arguments (e.g., files found in a directory).
+    publish : dict, optional
+        Paths to copy outputs to after each build, by Output argument name (e.g., paths used by notebooks).
+    version : string, optional
+        Extra version string for changes the key can't see (e.g., external tools).
+    code_modules : list, optional
+        Modules (or module names) whose source is part of the node's code version besides the module defining 
+        function; required for wrapper functions calling utility functions of other modules.
+
+    Returns
+    -------
+    dict
+        Node definition for run_pipeline.
+
+    """
+    return {'name': name, 'function': function, 'kwargs': kwargs or {}, 'depends': depends or [],
+            'publish': publish or {}, 'version': version,
+            'code_modules': [module if isinstance(module, str) else module.__name__ for module in code_modules or []]}
+
+
+
+def _walk(value, function):
+    """Apply function to every marker in nested lists, tuples, and dicts of value."""
+    if isinstance(value, (SourceFile, Output, Artifact)):
+        return function(value)
+    if isinstance(value, dict):
+        return {k: _walk(v, function) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_walk(v, function) for v in value)
+    return value
+
+
+
+def _markers(value, kind):
+    found = []
+    _walk(value, lambda marker: found.append(marker) if isinstance(marker, kind) else None)
+    return found
+
+
+
+def _source_files(path):
+    """Files making up a source: directory contents, a shapefile and its sidecar files, or the file itself."""
+    if os.path.isdir(path):
+        return sorted(os.path.join(root, file) for root, _, files in os.walk(path) for file in files)
+    stem, extension = os.path.splitext(path)
+    if extension.lower() == '.shp':
+        directory = os.path.dirname(path) or '.'
+        return sorted(os.path.join(directory, file) for file in os.listdir(directory)
+                      if os.path.splitext(file)[0] == os.path.basename(stem))
+    return [path]
+
+
+
+def _file_hash(hashes, path):
+    """sha256 of file contents, memoized in hashes by absolute path, size, and modification time."""
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    known = hashes.get(path)
+    if known is not None and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+        return known['sha256']
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    hashes[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+    return digest.hexdigest()
+
+
+
+def source_hash(path, hashes=None):
+    """Content hash of a source file, directory, or shapefile (with its sidecar files)."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(f'source file not found: {path}')
+    hashes = {} if hashes is None else hashes
+    root = path if os.path.isdir(path) else os.path.dirname(path) or '.'
+    digest = hashlib.sha256()
+    for file in _source_files(path):
+        digest.update(os.path.relpath(file, root).encode())
+        digest.update(_file_hash(hashes, file).encode())
+    return digest.hexdigest()
+
+
+
+def code_version(function, modules=()):
+    """Hash of the source file defining function (covers helpers it calls in the same module) and of the source files of modules (names).
+
+    Decorated functions (e.g., instrumented) are unwrapped so the key covers their own module rather than the decorator's."""
+    paths = [inspect.getsourcefile(inspect.unwrap(function))] + [inspect.getsourcefile(importlib.import_module(module)) for module in modules]
+    digests = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            digests.append(hashlib.sha256(f.read()).hexdigest())
+    return digests[0] if len(digests) == 1 else hashlib.sha256(''.join(digests).encode()).hexdigest()
+
+
+
+def _node_key(node, keys, hashes):
+    """Key of a node's artifacts from its function, code version, arguments, sources, and upstream keys."""
+    def describe(marker):
+        if isinstance(marker, SourceFile):
+            return {'source': source_hash(marker.path, hashes)}
+        if isinstance(marker, Output):
+            return {'output': marker.name}
+        return {'artifact': keys[marker.node], 'output': marker.output, 'path': marker.path}
+
+    description = {'function': f"{node['function'].__module__}.{node['function'].__qualname__}",
+                   'code': code_version(node['function'], node.get('code_modules', ())),
+                   'kwargs': _walk(node['kwargs'], describe),
+                   'depends': [describe(marker) for marker in node['depends']],
+                   'version': node['version']}
+    return hashlib.sha256(json.dumps(description, sort_keys=True, default=repr).encode()).hexdigest()
+
+
+
+def _upstream(node):
+    return {marker.node for marker in _markers(node['kwargs'], Artifact)}
+
+
+
+def topological_order(nodes):
+    """Node names ordered so every node follows the nodes it depends on (ValueError for cycles and unknown nodes)."""
+    order, state = [], {}
+
+    def visit(name, path):
+        if name not in nodes:
+            raise ValueError(f"unknown node {name!r} (required by {path[-1]!r})")
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise ValueError(f"cycle in pipeline: {' -> '.join(path + [name])}")
+        state[name] = 'visiting'
+        for upstream in sorted(_upstream(nodes[name])):
+            visit(upstream, path + [name])
+        state[name] = 'done'
+        order.append(name)
+
+    for name in nodes:
+        visit(name, [])
+    return order
+
+
+
+def _run_node(function, kwargs, build_dir):
+    """Run node function in its build directory and save the return value (in worker process)."""
+    kwargs = _walk(kwargs, lambda marker: _load_result(marker.path))
+    start = time.perf_counter()
+    result = function(**kwargs)
+    seconds = time.perf_counter() - start
+    with open(os.path.join(build_dir, RESULT_FILE), 'wb') as f:
+        pickle.dump(result, f)
+    return seconds
+
+
+
+def _load_result(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+
+def _publish(source, destination):
+    """Copy artifact file (or every file of artifact directory) to destination, replacing existing files."""
+    if os.path.isdir(source):
+        for file in _source_files(source):
+            _publish(file, os.path.join(destination, os.path.relpath(file, source)))
+        return
+    os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+    shutil.copy2(source, destination + '.part')
+    os.replace(destination + '.part', destination)
+
+
+
+def run_pipeline(nodes, cache_dir='pipeline_cache', targets=None, workers=None, force=(), dry_run=False, progress=print):
+    """
+    Function to run a DAG of pipeline nodes, rebuilding only nodes whose artifacts are stale.
+
+    Every node's artifacts (output files and return value) are stored in cache_dir/{node}/{key}, where the key
+    is a hash of the function's code, its arguments, the contents of its source files, and the keys of upstream
+    nodes. A node is rebuilt only if no artifact exists for its current key, so changing one parameter reruns
+    only that node and nodes downstream of it, and switching back reuses the earlier artifacts. Independent
+    stale nodes run in parallel worker processes.
+
+    Parameters
+    ----------
+    nodes : list
+        Node definitions (see pipeline_node).
+    cache_dir : string
+        Directory of cached artifacts.
+    targets : list, optional
+        Names of nodes to bring up to date (with everything upstream of them); all nodes if None.
+    workers : int, optional
+        Number of worker processes (1 runs serially in this process).
+    force : list
+        Names of nodes to rebuild even if their artifacts exist.
+    dry_run : bool
+        Only report which nodes are stale.
+    progress : callable, optional
+        Called with a message as nodes are cached, started, and built (None for silence).
+
+    Returns
+    -------
+    dict
+        Status ('cached', 'stale', or 'built'), key, artifact directory, and build seconds by node name.
+
+    """
+    nodes = {node['name']: node for node in nodes}
+    order = topological_order(nodes)
+    progress = progress or (lambda message: None)
+
+    # only targets and nodes upstream of them
+    needed = set()
+    stack = list(targets if targets is not None else nodes)
+    while stack:
+        name = stack.pop()
+        if name not in needed:
+            if name not in nodes:
+                raise ValueError(f'unknown target {name!r}')
+            needed.add(name)
+            stack.extend(_upstream(nodes[name]))
+    order = [name for name in order if name in needed]
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # content hashes of source files are memoized so unchanged files aren't read again
+    hashes_path = os.path.join(cache_dir, 'file_hashes.json')
+    hashes = {}
+    if os.path.exists(hashes_path):
+        with open(hashes_path) as f:
+            hashes = json.load(f)
+    keys = {}
+    for name in order:
+        keys[name] = _node_key(nodes[name], keys, hashes)
+    with open(hashes_path, 'w') as f:
+        json.dump(hashes, f)
+
+    directories = {name: os.path.join(cache_dir, name, keys[name]) for name in order}
+    status = {name: {'key': keys[name], 'path': directories[name], 'status': 'cached', 'seconds': 0.0} for name in order}
+    stale = [name for name in order if name in force or not os.path.exists(os.path.join(directories[name], DONE_FILE))]
+    for name in order:
+        if name not in stale:
+            progress(f'{name}: cached')
+
+    if dry_run:
+        for name in stale:
+            status[name]['status'] = 'stale'
+        return status
+
+    def resolve(name, build_dir):
+        """Arguments of node with markers replaced by paths (upstream return values are loaded in the worker)."""
+        def path(marker):
+            if isinstance(marker, SourceFile):
+                return marker.path
+            if isinstance(marker, Output):
+                output = os.path.join(build_dir, marker.name)
+                if marker.name.endswith('/'):
+                    os.makedirs(output, exist_ok=True)
+                return output
+            if marker.output is None:
+                return Artifact(marker.node, None, os.path.join(directories[marker.node], RESULT_FILE))
+            upstream = nodes[marker.node]['kwargs'].get(marker.output)
+            if not isinstance(upstream, Output):
+                raise ValueError(f'{marker.output!r} is not an Output of node {marker.node!r}')
+            return os.path.join(directories[marker.node], upstream.name, *([marker.path] if marker.path else []))
+
+        return _walk(nodes[name]['kwargs'], path)
+
+    def finish(name, build_dir, seconds):
+        with open(os.path.join(build_dir, DONE_FILE), 'w') as f:
+            json.dump({'node': name, 'key': keys[name], 'seconds': seconds, 'finished': time.strftime('%Y-%m-%dT%H:%M:%S')}, f)
+        if os.path.exists(directories[name]):
+            shutil.rmtree(directories[name])
+        os.replace(build_dir, directories[name])
+        status[name].update({'status': 'built', 'seconds': seconds})
+        progress(f'{name}: built in {seconds:.1f} s')
+
+    builds = {}
+
+    def start(name):
+        os.makedirs(os.path.dirname(directories[name]), exist_ok=True)
+        builds[name] = tempfile.mkdtemp(suffix='.part', dir=os.path.dirname(directories[name]))
+        progress(f'{name}: running')
+        return nodes[name]['function'], resolve(name, builds[name]), builds[name]
+
+    pending = list(stale)
+    running = {}
+
+    def ready():
+        return [name for name in pending if not (_upstream(nodes[name]) & (set(pending) | set(running.values())))]
+
+    try:
+        if workers == 1:
+            for name in stale:
+                job = start(name)
+                finish(name, builds[name], _run_node(*job))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                while pending or running:
+                    for name in ready():
+                        pending.remove(name)
+                        running[executor.submit(_run_node, *start(name))] = name
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name = running.pop(future)
+                        finish(name, builds[name], future.result())
+    finally:
+        # partial builds of failed nodes
+        for build_dir in builds.values():
+            shutil.rmtree(build_dir, ignore_errors=True)
+
+    # copy published outputs if they are not from the current artifacts
+    published_path = os.path.join(cache_dir, 'published.json')
+    published = {}
+    if os.path.exists(published_path):
+        with open(published_path) as f:
+            published = json.load(f)
+    for name in order:
+        for output, destination in nodes[name]['publish'].items():
+            source = os.path.join(directories[name], nodes[name]['kwargs'][output].name)
+            if published.get(os.path.abspath(destination)) != keys[name] or not os.path.exists(destination):
+                _publish(source.rstrip('/'), destination.rstrip('/'))
+                published[os.path.abspath(destination)] = keys[name]
+                progress(f'{name}: published {destination}')
+    with open(published_path, 'w') as f:
+        json.dump(published, f, indent=1)
+
+    return status
@@ -0,0 +1,188 @@
+"""
+Pipeline of the project stages (DEM mosaic -> clipped UTM DEM -> terrain features -> zonal statistics; conditioned
+DEM -> flow routing -> zonal statistics; stream gauges -> elevated stream flow events -> watershed frequencies) as a
+DAG of cached nodes.
+
+Each node's artifacts are keyed on a hash of its inputs, parameters, and code (see run_pipeline), so only nodes
+affected by a change are rerun, independent nodes run in parallel, and the notebooks' manual 'if not
+os.path.exists(output)' guards are no longer needed. Run from the Pipeline directory, e.g.
+
+    python Watersheds_Pipeline.py --dry-run
+    python Watersheds_Pipeline.py --targets zonal_statistics --workers 4 --publish
+"""
+
+
+import argparse
+import glob
+import os
+import sys
+
+import geopandas as gpd
+import pandas as pd
+
+# stage utilities (each stage folder is its own import root, as in the notebooks)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for stage in ['', 'Data', 'TerrainFeatures', 'WatershedClustering', 'StreamFlowEvents']:
+    sys.path.insert(0, os.path.join(ROOT, stage))
+
+from Pipeline_Utils import SourceFile, Output, Artifact, pipeline_node, run_pipeline
+from Instrumentation_Utils import enable_instrumentation, summarize_instrumentation
+from Data_Utils import mosaic_dem_tiles_windowed, clip_reproject_dem
+from TerrainFeatures_Utils import FEATURE_NAMES, FLOW_NAMES, terrain_features, flow_routing
+from WatershedClustering_Utils import zonal_statistics_to_csv
+from StreamFlowEvents_Utils import (NO_DATA_ERRORS, process_gauge_data, get_frequencies, frequency_table, assign_frequencies_bulk,
+                                    watershed_mean_frequencies, stream_gauge_minimum_days)
+
+
+STATISTICS = ['sum', 'majority', 'range', 'mean', 'std', 'min', 'percentile_10', 'percentile_25', 'median',
+              'percentile_75', 'percentile_90', 'max']
+
+# outputs of flow routing used as terrain features
+FLOW_FEATURES = ['flow_accumulation', 'flow_drop', 'twi', 'spi']
+
+
+def gauge_frequencies(gauge, data_type, **kwargs):
+    """Mean annual event frequencies of one gauge (None if the gauge has no data; any other error fails the node)."""
+    try:
+        df = process_gauge_data(gauge, data_type, **kwargs)
+    except NO_DATA_ERRORS:
+        return None
+    return get_frequencies(df, data_type=data_type)
+
+
+def gauge_jobs(gdf_gauges, minimum_days=365):
+    """(gauge, data_type) jobs of gauges with at least minimum_days of measurements, in table order (gauge height first)."""
+    gdf_gauges = gdf_gauges.copy()
+    gdf_gauges[['gh_diff', 'sf_diff']] = gdf_gauges[['gh_diff', 'sf_diff']].apply(pd.to_timedelta)
+    gdf_gauges = stream_gauge_minimum_days(gdf_gauges, ['gh_diff', 'sf_diff'], ['gh', 'sf'], minimum_days)
+    jobs = [(gauge, 'gauge height') for gauge in gdf_gauges.loc[gdf_gauges['gh'] == 1, 'site_no']]
+    jobs += [(gauge, 'streamflow') for gauge in gdf_gauges.loc[gdf_gauges['sf'] == 1, 'site_no']]
+    return jobs
+
+
+def watershed_frequencies(gauges_path, jobs, frequencies, output_path):
+    """Assign gauge frequencies of jobs (see gauge_jobs) to gauge table and save mean frequencies by watershed."""
+    gdf_gauges = gpd.read_file(gauges_path)
+    gdf_gauges = assign_frequencies_bulk(gdf_gauges, frequency_table(list(zip(map(tuple, jobs), frequencies))))
+    watershed_mean_frequencies(gdf_gauges).to_csv(output_path)
+
+
+def build_nodes(args):
+    """Pipeline nodes for the arguments of the command line."""
+    nodes = []
+
+    ##### DEM
+    tiles = sorted(glob.glob(os.path.join(args.dem_tiles_dir, 'USGS*.tif')))
+    nodes.append(pipeline_node('dem_mosaic', mosaic_dem_tiles_windowed,
+                               {'tiles_paths': [SourceFile(path) for path in tiles], 'output_path': Output('dem_10m_mosaic.tif'),
+                                'block_size': args.tile_size},
+                               publish={'output_path': os.path.join(args.dem_tiles_dir, 'dem_10m_mosaic.tif')} if args.publish else None))
+
+    nodes.append(pipeline_node('dem_clip', clip_reproject_dem,
+                               {'dem_path': Artifact('dem_mosaic', 'output_path'), 'polygons': SourceFile(args.watershed_extent),
+                                'output_path': Output(os.path.basename(args.dem)), 'dst_crs': 'EPSG:26916', 'block_size': args.tile_size},
+                               publish={'output_path': args.dem} if args.publish else None))
+
+    ##### terrain features
+    nodes.append(pipeline_node('terrain_features', terrain_features,
+                               {'dem_path': Artifact('dem_clip', 'output_path'), 'output_dir': Output('terrain_features/'), 'radius': args.radius,
+                                'tile_size': args.tile_size, 'workers': args.node_workers},
+                               publish={'output_dir': args.terrain_dir} if args.publish else None))
+
+    nodes.append(pipeline_node('flow_routing', flow_routing,
+                               {'dem_path': SourceFile(args.conditioned_dem), 'output_dir': Output('flow_routing/'),
+                                'tile_size': args.tile_size, 'workers': args.node_workers, 'min_tan_slope': args.min_tan_slope},
+                               publish={'output_dir': os.path.join(args.terrain_dir, 'flow_routing')} if args.publish else None))
+
+    ##### zonal statistics of DEM and every terrain feature
+    rasters = {os.path.splitext(os.path.basename(args.dem))[0]: Artifact('dem_clip', 'output_path')}
+    rasters.update({name.format(radius=args.radius): Artifact('terrain_features', 'output_dir', name.format(radius=args.radius) + '.tif')
+                    for name in FEATURE_NAMES.values()})
+    rasters.update({FLOW_NAMES[output]: Artifact('flow_routing', 'output_dir', FLOW_NAMES[output] + '.tif') for output in FLOW_FEATURES})
+
+    for label, raster in rasters.items():
+        output_name = f'{label}_huc10_zonalstats.csv'
+        nodes.append(pipeline_node(f'zonal_statistics_{label}', zonal_statistics_to_csv,
+                                   {'polygon_path': SourceFile(args.watersheds), 'raster_path': raster, 'statistics': STATISTICS,
+                                    'output_name': Output(output_name), 'index_col': 'huc10', 'drop_cols': ['loaddate', 'name', 'geometry']},
+                                   publish={'output_name': os.path.join(args.zonal_dir, output_name)} if args.publish else None))
+
+    ##### stream flow events (one node per gauge and data type, so new or updated gauge files only rerun their gauge)
+    # only data types with the minimum range of measurements, as in StreamFlowEvents_Pipeline
+    jobs = gauge_jobs(gpd.read_file(args.gauges), args.minimum_days)
+
+    for gauge, data_type in jobs:
+        folder = 'gauge_height' if data_type == 'gauge height' else 'streamflow'
+        nodes.append(pipeline_node(f"events_{folder}_{gauge}", gauge_frequencies,
+                                   {'gauge': gauge, 'data_type': data_type, 'resample': args.resample, 'window': args.window,
+                                    'min_periods': args.min_periods, 'alpha': args.alpha, 'data_dir': args.data_dir},
+                                   depends=[SourceFile(path) for path in glob.glob(f'{args.data_dir}/{folder}/{gauge}*.csv')],
+                                   code_modules=['StreamFlowEvents_Utils']))
+
+    nodes.append(pipeline_node('watershed_frequencies', watershed_frequencies,
+                               {'gauges_path': SourceFile(args.gauges), 'jobs': jobs, 'output_path': Output('KY_WatershedMeanFrequencies.csv'),
+                                'frequencies': [Artifact(f"events_{'gauge_height' if data_type == 'gauge height' else 'streamflow'}_{gauge}")
+                                                for gauge, data_type in jobs]},
+                               publish={'output_path': args.frequencies_output} if args.publish else None, code_modules=['StreamFlowEvents_Utils']))
+
+    return nodes
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Run (or bring up to date) the watershed pipeline, rerunning only stale nodes.')
+    parser.add_argument('--targets', nargs='+', default=None, help='nodes (or node name prefixes, e.g. zonal_statistics) to bring up to date; all if omitted')
+    parser.add_argument('--cache-dir', default='pipeline_cache', help='directory of cached artifacts')
+    parser.add_argument('--workers', type=int, default=None, help='number of nodes run in parallel (1 runs serially)')
+    parser.add_argument('--node-workers', type=int, default=None, help='worker processes within tiled nodes (terrain features, flow routing)')
+    parser.add_argument('--force', nargs='+', default=[], help='nodes to rebuild even if cached')
+    parser.add_argument('--dry-run', action='store_true', help='only list stale nodes')
+    parser.add_argument('--publish', action='store_true', help='copy outputs to the paths used by the notebooks')
+    parser.add_argument('--instrument', default=None, help='JSON lines file to record time, I/O, and memory of each utility function call')
+    parser.add_argument('--dem-tiles-dir', default=os.path.join(ROOT, 'Data', 'dem_10m'))
+    parser.add_argument('--dem', default=os.path.join(ROOT, 'Data', 'dem_10m', 'dem_10m_clipped_26916.tif'), help='published path of the clipped and reprojected DEM')
+    parser.add_argument('--watershed-extent', default=os.path.join(ROOT, 'Data', 'nhd', 'ky_huc10_extent.shp'), help='polygons the DEM mosaic is clipped to')
+    parser.add_argument('--conditioned-dem', default=os.path.join(ROOT, 'TerrainFeatures', 'terrain_features', 'dem_fps_burned_singlecellfill.tif'),
+                        help='smoothed and stream-burned DEM for flow routing')
+    parser.add_argument('--terrain-dir', default=os.path.join(ROOT, 'TerrainFeatures', 'terrain_features'))
+    parser.add_argument('--watersheds', default=os.path.join(ROOT, 'Data', 'nhd', 'ky_huc10_26916.shp'))
+    parser.add_argument('--zonal-dir', default=os.path.join(ROOT, 'WatershedClustering'))
+    parser.add_argument('--gauges', default=os.path.join(ROOT, 'Data', 'stream_gauges', 'KY_StreamGaugeLocations_26916.shp'))
+    parser.add_argument('--data-dir', default=os.path.join(ROOT, 'Data', 'stream_gauges'))
+    parser.add_argument('--frequencies-output', default=os.path.join(ROOT, 'StreamFlowEvents', 'KY_WatershedMeanFrequencies.csv'))
+    parser.add_argument('--radius', type=int, default=3)
+    parser.add_argument('--tile-size', type=int, default=1024)
+    parser.add_argument('--min-tan-slope', type=float, default=0.001)
+    parser.add_argument('--resample', default='1D')
+    parser.add_argument('--window', default='90D')
+    parser.add_argument('--min-periods', type=int, default=30)
+    parser.add_argument('--alpha', type=float, default=0.05)
+    parser.add_argument('--minimum-days', type=int, default=365)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.instrument is not None:
+        enable_instrumentation(args.instrument)
+
+    nodes = build_nodes(args)
+
+    targets = None
+    if args.targets is not None:
+        targets = [node['name'] for node in nodes if any(node['name'].startswith(target) for target in args.targets)]
+
+    status = run_pipeline(nodes, args.cache_dir, targets, args.workers, args.force, args.dry_run)
+
+    if args.dry_run:
+        stale = [name for name, node in status.items() if node['status'] == 'stale']
+        print(f'{len(stale)} of {len(status)} nodes stale:')
+        for name in stale:
+            print(f'    {name}')
+
+    if args.instrument is not None and os.path.exists(args.instrument):
+        with pd.option_context('display.width', 200, 'display.max_columns', None):
+            print(summarize_instrumentation(args.instrument).round(3))
+
+
+if __name__ == '__main__':
+    main()
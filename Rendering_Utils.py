@@ -0,0 +1,416 @@
+"""
+Batch rendering of watershed hydrographs and choropleth maps for the report figures.
+
+Long daily series are decimated before plotting, keeping the minimum and maximum of every bucket (so event peaks
+are never dropped) and the gaps in the data (minmax_decimate), or with largest-triangle-three-buckets (lttb).
+Watershed polygons are simplified once (shared boundaries kept aligned) and cached as GeoParquet. Figures are
+drawn with the Agg canvas directly (no pyplot, so rendering does not change the notebook backend), split across
+worker processes, and every process reuses one figure template per layout: a choropleth template holds the
+watershed polygons as one collection and only its colors change between maps.
+
+The stage notebooks import this module after sys.path.append('..').
+"""
+
+
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import matplotlib
+import matplotlib.dates as mdates
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import PatchCollection
+from matplotlib.figure import Figure
+from matplotlib.patches import PathPatch
+from matplotlib.path import Path
+
+# instrumentation of utility functions (no-op unless enabled)
+from Instrumentation_Utils import instrumented, record_counts
+
+# errors of gauges without data, which skip a hydrograph rather than failing the batch
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'StreamFlowEvents'))
+from StreamFlowEvents_Utils import NO_DATA_ERRORS
+
+
+# figure templates of this process, by layout
+_templates = {}
+
+
+
+
+def minmax_decimate(x, y, n_buckets=1000):
+    """
+    Indices of points of series (x, y) to plot: first, minimum, maximum, and last valid point of each of
+    n_buckets equal buckets of positions, and the first missing value of buckets with gaps (so lines still
+    break at gaps). At most 5 points per bucket; every extreme of the series is kept.
+    """
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n <= 4 * n_buckets:
+        return np.arange(n)
+
+    bucket = (np.arange(n) * n_buckets) // n
+    valid = ~np.isnan(y)
+    starts = np.searchsorted(bucket, np.arange(n_buckets))
+
+    low = np.minimum.reduceat(np.where(valid, y, np.inf), starts)
+    high = np.maximum.reduceat(np.where(valid, y, -np.inf), starts)
+
+    def first(positions):
+        """First of (ascending or descending) positions in each bucket."""
+        return positions[np.unique(bucket[positions], return_index=True)[1]]
+
+    positions = np.flatnonzero(valid)
+    selected = [first(positions[y[positions] == low[bucket[positions]]]), first(positions[y[positions] == high[bucket[positions]]]),
+                first(positions), first(positions[::-1]), first(np.flatnonzero(~valid))]
+
+    return np.unique(np.concatenate(selected))
+
+
+
+def lttb(x, y, n_out=1000):
+    """Indices of n_out points of series (x, y) without missing values selected by largest-triangle-three-buckets."""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # average of next bucket (last point for the last bucket)
+        next_lo, next_hi = hi, edges[i + 2] if i + 2 < len(edges) else n
+        mean_x, mean_y = x[next_lo:next_hi].mean(), y[next_lo:next_hi].mean()
+        a = selected[i]
+        area = np.abs((x[a] - mean_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (mean_y - y[a]))
+        selected[i + 1] = lo + np.argmax(area)
+
+    return selected
+
+
+
+def decimate_series(series, max_points=4000, method='minmax'):
+    """
+    Series decimated to about max_points for plotting with method 'minmax' (see minmax_decimate) or 'lttb'
+    (applied within each run of valid values, keeping a missing value between runs).
+    """
+    if len(series) <= max_points:
+        return series
+    x = series.index.to_numpy().astype('datetime64[ns]').astype(np.int64)
+    y = series.to_numpy(dtype=np.float64)
+
+    if method == 'minmax':
+        return series.iloc[minmax_decimate(x, y, max(max_points // 4, 1))]
+    if method != 'lttb':
+        raise ValueError(f"method must be 'minmax' or 'lttb', not {method!r}")
+
+    valid = ~np.isnan(y)
+    edges = np.flatnonzero(np.diff(np.r_[0, valid.astype(np.int8), 0]))
+    runs = edges.reshape(-1, 2)
+    selected = []
+    for start, stop in runs:
+        n_out = max(int(max_points * (stop - start) / max(valid.sum(), 1)), 3)
+        selected.append(start + lttb(x[start:stop], y[start:stop], n_out))
+        if stop < len(y):
+            selected.append(np.array([stop]))
+    return series.iloc[np.concatenate(selected)] if selected else series.iloc[:0]
+
+
+
+def watershed_geometry_cache(polygon_path, cache_dir='render_cache', tolerance=50, id_col='huc10', columns=None):
+    """
+    Simplify watershed polygons once for maps and cache them as GeoParquet in cache_dir (keyed on the polygon
+    file and options); returns path of cached file. Polygons are simplified as a coverage (shapely
+    coverage_simplify), so neighbouring watersheds keep a common boundary, with tolerance in CRS units.
+    """
+    stat = os.stat(polygon_path)
+    key_source = json.dumps([os.path.abspath(polygon_path), stat.st_size, stat.st_mtime_ns, tolerance, id_col, columns])
+    key = hashlib.sha1(key_source.encode()).hexdigest()[:16]
+
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_path = os.path.join(cache_dir, f'watersheds_{key}.parquet')
+    if os.path.exists(cache_path):
+        return cache_path
+
+    gdf = gpd.read_file(polygon_path, columns=[id_col] + list(columns or []))
+    gdf[id_col] = gdf[id_col].astype(str)
+    if hasattr(shapely, 'coverage_simplify'):
+        gdf['geometry'] = shapely.coverage_simplify(gdf.geometry.values, tolerance)
+    else:
+        gdf['geometry'] = gdf.geometry.simplify(tolerance)
+
+    gdf.to_parquet(cache_path + '.part')
+    os.replace(cache_path + '.part', cache_path)
+
+    return cache_path
+
+
+
+def _geometry_path(geometry):
+    """Matplotlib path of a polygon or multipolygon (holes included)."""
+    vertices, codes = [], []
+    for polygon in shapely.get_parts(geometry):
+        for ring in [polygon.exterior, *polygon.interiors]:
+            coords = np.asarray(ring.coords)[:, :2]
+            ring_codes = np.full(len(coords), Path.LINETO, dtype=Path.code_type)
+            ring_codes[0], ring_codes[-1] = Path.MOVETO, Path.CLOSEPOLY
+            vertices.append(coords)
+            codes.append(ring_codes)
+    if not vertices:
+        return Path(np.empty((0, 2)))
+    return Path(np.concatenate(vertices), np.concatenate(codes))
+
+
+
+def _choropleth_template(geometry_path, id_col, figsize, dpi):
+    """Figure with all watersheds as one collection (built once per process and geometry file)."""
+    key = ('choropleth', geometry_path, id_col, figsize, dpi)
+    if key not in _templates:
+        gdf = gpd.read_parquet(geometry_path)
+        fig = Figure(figsize=figsize, dpi=dpi)
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        collection = PatchCollection([PathPatch(_geometry_path(geometry)) for geometry in gdf.geometry.values],
+                                     linewidths=0.25, edgecolors='k')
+        ax.add_collection(collection)
+        xmin, ymin, xmax, ymax = gdf.total_bounds
+        ax.set_xlim(xmin, xmax)
+        ax.set_ylim(ymin, ymax)
+        ax.set_aspect('equal')
+        ax.set_axis_off()
+        _templates[key] = {'fig': fig, 'ax': ax, 'collection': collection, 'ids': gdf[id_col].to_numpy(), 'colorbar': None}
+    return _templates[key]
+
+
+
+def _render_choropleth(geometry_path, id_col, values, title, output_path, cmap, vmin, vmax, missing_color, colorbar, figsize, dpi):
+    """Draw one choropleth on the template and save it; values is a series indexed by watershed id."""
+    start = time.perf_counter()
+    template = _choropleth_template(geometry_path, id_col, figsize, dpi)
+    fig, ax, collection = template['fig'], template['ax'], template['collection']
+
+    colors = matplotlib.colormaps[cmap].with_extremes(bad=missing_color)
+    collection.set_cmap(colors)
+    collection.set_array(np.ma.masked_invalid(values.reindex(template['ids']).to_numpy(dtype=np.float64)))
+    collection.set_clim(vmin, vmax)
+    ax.set_title(title, style='italic', loc='left')
+
+    if template['colorbar'] is not None:
+        template['colorbar'].remove()
+        template['colorbar'] = None
+    if colorbar:
+        template['colorbar'] = fig.colorbar(collection, ax=ax, shrink=0.6)
+
+    fig.savefig(output_path, bbox_inches='tight')
+    return output_path, time.perf_counter() - start
+
+
+
+@instrumented
+def render_choropleths(geometry_path, table, columns, output_dir, id_col='huc10', titles=None, cmap='bwr', vmin=None, vmax=None,
+                       symmetric=False, missing_color='#F1EEDC', colorbar=True, workers=None, figsize=(8, 6), dpi=150, fmt='png'):
+    """
+    Function to render a choropleth map of watersheds for every column of a watershed table.
+
+    Parameters
+    ----------
+    geometry_path : string
+        Cached simplified watersheds (see watershed_geometry_cache).
+    table : DataFrame
+        Watershed values (e.g., frequencies or cluster labels), indexed by watershed id or with an id_col column.
+    columns : list
+        Columns to map (one figure each, named '{column}.{fmt}').
+    output_dir : string
+        Directory for figures.
+    id_col : string
+        Watershed id column.
+    titles : dict, optional
+        Title of each column (column name if missing).
+    cmap : string
+        Matplotlib colormap name.
+    vmin, vmax : float, optional
+        Color limits of all maps; limits of each column if None.
+    symmetric : bool
+        Color limits symmetric around zero (e.g., standardized frequencies).
+    missing_color : string
+        Color of watersheds without a value.
+    colorbar : bool
+        Draw a colorbar.
+    workers : int, optional
+        Number of worker processes (1 renders serially).
+    figsize : tuple
+        Figure size (inches).
+    dpi : int
+        Resolution of saved figures.
+    fmt : string
+        Figure file format.
+
+    Returns
+    -------
+    DataFrame
+        Path and rendering seconds of each column.
+
+    """
+    table = table.set_index(id_col) if id_col in table.columns else table
+    table.index = table.index.astype(str)
+    os.makedirs(output_dir, exist_ok=True)
+
+    jobs = []
+    for column in columns:
+        values = table[column].astype(np.float64)
+        low, high = (values.min() if vmin is None else vmin), (values.max() if vmax is None else vmax)
+        if symmetric:
+            low, high = -max(abs(low), abs(high)), max(abs(low), abs(high))
+        jobs.append((geometry_path, id_col, values, (titles or {}).get(column, column), os.path.join(output_dir, f'{column}.{fmt}'),
+                     cmap, low, high, missing_color, colorbar, figsize, dpi))
+
+    if workers == 1:
+        results = [_render_choropleth(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_render_choropleth, *zip(*jobs)))
+
+    record_counts(rows=len(jobs))
+
+    return pd.DataFrame(results, columns=['path', 'seconds'], index=pd.Index(list(columns), name='column'))
+
+
+
+def hydrograph_jobs(gdf_gauges, gdf_watersheds=None, watershed_column='huc10', name_column='name'):
+    """
+    Hydrograph jobs (watershed id, title, {'gauge height': gauges, 'streamflow': gauges}) of every watershed with
+    gauges in gauge table (indicator columns 'gh' and 'sf', as after stream_gauge_minimum_days).
+    """
+    names = {} if gdf_watersheds is None else dict(zip(gdf_watersheds[watershed_column], gdf_watersheds[name_column]))
+    jobs = []
+    for watershed, gauges in gdf_gauges.groupby(watershed_column, sort=False):
+        data = {'gauge height': list(gauges.loc[gauges['gh'] == 1, 'site_no']), 'streamflow': list(gauges.loc[gauges['sf'] == 1, 'site_no'])}
+        if data['gauge height'] or data['streamflow']:
+            title = f'{names[watershed]}\n(HUC10 ID={watershed})' if watershed in names else f'HUC10 ID={watershed}'
+            jobs.append((watershed, title, data))
+    return jobs
+
+
+
+def _hydrograph_template(nrows, dpi):
+    """Figure of nrows hydrograph axes sharing the date axis (as create_subplot_axes), built once per process."""
+    key = ('hydrograph', nrows, dpi)
+    if key not in _templates:
+        fig = Figure(figsize=(7, 4 * nrows), dpi=dpi)
+        FigureCanvasAgg(fig)
+        axes = fig.subplots(nrows=nrows, ncols=1, sharex=True, squeeze=False)[:, 0]
+        fig.subplots_adjust(hspace=0)
+        _templates[key] = {'fig': fig, 'axes': axes}
+    return _templates[key]
+
+
+
+HYDROGRAPH_LABELS = {'gauge height': ('Flood Stage (ft)', 'Stream Gauge ID (flood stage)'),
+                     'streamflow': ('Discharge (m$^3$/s)', 'Stream Gauge ID (discharge)')}
+
+
+
+def _render_hydrograph(watershed, title, data, load, output_path, threshold, max_points, method, dpi):
+    """Load, decimate, and draw the gauges of one watershed on the template and save; returns (path, seconds, points, error).
+
+    A gauge without data (NO_DATA_ERRORS raised by load) skips the figure with the error; any other error is raised."""
+    start = time.perf_counter()
+    data_types = [data_type for data_type in ['gauge height', 'streamflow'] if data.get(data_type)]
+    template = _hydrograph_template(len(data_types), dpi)
+    fig, axes = template['fig'], template['axes']
+    points = 0
+
+    try:
+        for ax, data_type in zip(axes, data_types):
+            ax.clear()
+            for gauge in data[data_type]:
+                df = load(gauge, data_type)
+                if df is None:
+                    continue
+                values = decimate_series(df.iloc[:, 0], max_points, method)
+                ax.plot(values.index, values.to_numpy(), linewidth=0.25, label=f'{gauge}')
+                points += len(values)
+                if threshold in df.columns:
+                    values = decimate_series(df[threshold], max_points, method)
+                    ax.plot(values.index, values.to_numpy(), linewidth=1, color='k')
+                    points += len(values)
+            ax.plot([], [], linewidth=1, color='k', label=threshold.replace('percentile', '') + ' Percentile' if 'percentile' in threshold else threshold)
+            ylabel, legend_title = HYDROGRAPH_LABELS[data_type]
+            ax.legend(frameon=False, bbox_to_anchor=(1, 1), loc='upper left', title=legend_title)
+            ax.set_ylim(bottom=0)
+            ax.set_ylabel(ylabel)
+
+        for ax in axes[:-1]:
+            ax.tick_params(labelbottom=False)
+        axes[-1].set_xlabel('Date')
+        axes[-1].xaxis.set_major_formatter(mdates.DateFormatter('%Y'))
+        fig.suptitle(title, y=.93 if len(axes) > 1 else .97, weight='bold')
+        fig.savefig(output_path, bbox_inches='tight')
+        error = None
+    except NO_DATA_ERRORS as exception:
+        output_path, error = None, f'{type(exception).__name__}: {exception}'
+
+    return output_path, time.perf_counter() - start, points, error
+
+
+
+@instrumented
+def render_hydrographs(jobs, load, output_dir, threshold='percentile90', max_points=4000, method='minmax', workers=None, dpi=150, fmt='jpg'):
+    """
+    Function to render the hydrograph figure of every watershed (gauge height and/or streamflow of its gauges
+    with an event threshold) in parallel worker processes.
+
+    Parameters
+    ----------
+    jobs : list
+        (watershed id, title, {'gauge height': gauges, 'streamflow': gauges}) of each figure (see hydrograph_jobs).
+    load : callable
+        load(gauge, data_type) returning a dataframe of values (first column) and threshold column, or None to
+        skip the gauge, e.g., functools.partial(process_gauge_data, window='90D'); must be picklable (module
+        level) with workers.
+    output_dir : string
+        Directory for figures, named '{watershed}_data.{fmt}'.
+    threshold : string
+        Threshold column drawn over each gauge.
+    max_points : int
+        Maximum points per plotted series (see decimate_series).
+    method : string
+        Decimation method, 'minmax' or 'lttb'.
+    workers : int, optional
+        Number of worker processes (1 renders serially).
+    dpi : int
+        Resolution of saved figures.
+    fmt : string
+        Figure file format.
+
+    Returns
+    -------
+    DataFrame
+        Path (None if skipped for a gauge without data), rendering seconds, points plotted, and error of each watershed.
+
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    args = [(watershed, title, data, load, os.path.join(output_dir, f'{watershed}_data.{fmt}'), threshold, max_points, method, dpi)
+            for watershed, title, data in jobs]
+
+    if workers == 1:
+        results = [_render_hydrograph(*job) for job in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_render_hydrograph, *zip(*args))) if args else []
+
+    record_counts(rows=len(args))
+
+    return pd.DataFrame(results, columns=['path', 'seconds', 'points', 'error'],
+                        index=pd.Index([job[0] for job in jobs], name='watershed'))
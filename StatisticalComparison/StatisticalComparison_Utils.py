@@ -0,0 +1,252 @@
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy.stats import f, studentized_range
+
+# instrumentation of utility functions (Instrumentation_Utils.py at the repository root; no-op unless enabled)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Instrumentation_Utils import instrumented, record_counts
+
+
+def standardize_frequencies(df, columns=None, suffix='_std'):
+    """Add standardized (z-score, as StandardScaler; missing values ignored) copies of frequency columns named '{column}{suffix}'."""
+    columns = [col for col in df.columns if 'freq' in col] if columns is None else list(columns)
+    values = df[columns].astype(np.float64)
+    std = values.std(ddof=0).replace(0, 1)
+    df[[f'{col}{suffix}' for col in columns]] = ((values - values.mean()) / std).to_numpy()
+    return df
+
+
+
+def _frequency_values(frequencies):
+    """(rows x columns float64 array, column names) of frequency table, series, or array."""
+    if isinstance(frequencies, pd.Series):
+        frequencies = frequencies.to_frame()
+    if isinstance(frequencies, pd.DataFrame):
+        return frequencies.to_numpy(dtype=np.float64), list(frequencies.columns)
+    values = np.asarray(frequencies, dtype=np.float64)
+    values = values[:, None] if values.ndim == 1 else values
+    return values, list(range(values.shape[1]))
+
+
+
+def _group_codes(labels, index=None):
+    """Integer codes (-1 = missing label) and group names of labels, aligned to index if labels is a series."""
+    if isinstance(labels, pd.Series) and index is not None:
+        labels = labels.reindex(index)
+    codes, groups = pd.factorize(pd.Series(np.asarray(labels)), sort=True)
+    return codes.astype(np.int64), np.asarray(groups)
+
+
+
+def _anova_sums(values, codes, n_groups, rows=None):
+    """
+    Per-group counts, sums, and sums of squares of every column of values (rows x columns, NaN = missing) for
+    each row of codes (resamples x rows, -1 = excluded), shape (resamples, columns, groups). rows (resamples x
+    rows) optionally gives the row of values at each position (bootstrap resamples).
+    """
+    n_resamples, n_rows = codes.shape
+    n_columns = values.shape[1]
+
+    x = np.broadcast_to(values if rows is None else values[rows], (n_resamples, n_rows, n_columns))
+    valid = ~np.isnan(x) & (codes >= 0)[:, :, None]
+    x = np.where(valid, x, 0)
+
+    # one bincount per quantity over all resamples, columns, and groups
+    index = ((np.arange(n_resamples)[:, None, None] * n_columns + np.arange(n_columns)) * n_groups
+             + np.maximum(codes, 0)[:, :, None]).ravel()
+    size = n_resamples * n_columns * n_groups
+    shape = (n_resamples, n_columns, n_groups)
+    counts = np.bincount(index, weights=valid.ravel(), minlength=size).reshape(shape)
+    sums = np.bincount(index, weights=x.ravel(), minlength=size).reshape(shape)
+    squares = np.bincount(index, weights=(x ** 2).ravel(), minlength=size).reshape(shape)
+
+    return counts, sums, squares
+
+
+
+def _anova_statistics(counts, sums, squares):
+    """One-way ANOVA statistics (arrays of shape resamples x columns) from per-group sums of _anova_sums."""
+    n = counts.sum(axis=-1)
+    groups = (counts > 0).sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        correction = sums.sum(axis=-1) ** 2 / n
+        ss_total = squares.sum(axis=-1) - correction
+        ss_between = np.where(counts > 0, sums ** 2 / counts, 0).sum(axis=-1) - correction
+        ss_within = np.maximum(ss_total - ss_between, 0)
+        df_between, df_within = groups - 1, n - groups
+        F = (ss_between / df_between) / (ss_within / df_within)
+        F = np.where((df_between > 0) & (df_within > 0), F, np.nan)
+        eta_squared = ss_between / ss_total
+    return {'groups': groups, 'n': n, 'df_between': df_between, 'df_within': df_within, 'ss_between': ss_between,
+            'ss_within': ss_within, 'F': F, 'eta_squared': eta_squared}
+
+
+
+def anova_oneway(frequencies, labels):
+    """
+    One-way ANOVA of every frequency column by cluster label, all columns at once (same F and p-value as
+    statsmodels ols and anova_lm of each column, rows with missing values dropped per column).
+
+    Parameters
+    ----------
+    frequencies : DataFrame, Series, or array
+        Frequencies (rows x columns, e.g., standardized watershed event frequencies).
+    labels : Series or array
+        Cluster label of each row (aligned on the index of frequencies if a series); missing labels are excluded.
+
+    Returns
+    -------
+    DataFrame
+        Number of groups and rows, degrees of freedom, sums of squares, F, p-value, and eta squared (share of
+        variance explained by clusters) of each column.
+
+    """
+    values, columns = _frequency_values(frequencies)
+    codes, groups = _group_codes(labels, getattr(frequencies, 'index', None))
+
+    # centered so sums of squares do not lose precision
+    values = values - np.nanmean(values, axis=0)
+
+    stats = _anova_statistics(*_anova_sums(values, codes[None, :], len(groups)))
+    table = pd.DataFrame({key: value[0] for key, value in stats.items()}, index=pd.Index(columns, name='column'))
+    table.insert(table.columns.get_loc('F') + 1, 'p_value', f.sf(table['F'], table['df_between'], table['df_within']))
+
+    return table
+
+
+
+def _resampled_f(values, codes, n_groups, method, seed, n_resamples, batch_size):
+    """F statistics (resamples x columns) of n_resamples permutations of codes or bootstrap resamples of rows of values."""
+    rng = np.random.default_rng(seed)
+    results = []
+    for start in range(0, n_resamples, batch_size):
+        size = min(batch_size, n_resamples - start)
+        if method == 'permutation':
+            resampled, rows = rng.permuted(np.broadcast_to(codes, (size, len(codes))), axis=1), None
+        else:
+            resampled, rows = np.broadcast_to(codes, (size, len(codes))), rng.integers(0, len(codes), (size, len(codes)))
+        results.append(_anova_statistics(*_anova_sums(values, resampled, n_groups, rows))['F'])
+    return np.concatenate(results) if results else np.empty((0, values.shape[1]))
+
+
+
+@instrumented
+def compare_clusterings(frequencies, clusterings, n_resamples=9999, method='permutation', workers=None, random_state=0, batch_size=1000):
+    """
+    Function to compare many clusterings against many event frequency columns with one-way ANOVA and
+    resampling significance.
+
+    For every clustering, F statistics of all frequency columns are calculated at once (see anova_oneway), then
+    compared with F of n_resamples resamples under the null hypothesis of no difference between clusters:
+    'permutation' shuffles cluster labels, 'bootstrap' draws rows of frequencies with replacement for the fixed
+    labels. Resamples are calculated in vectorized batches, split across worker processes (with the same
+    random numbers for any number of workers).
+
+    Parameters
+    ----------
+    frequencies : DataFrame, Series, or array
+        Frequencies (rows x columns).
+    clusterings : Series, DataFrame, dict, or array
+        Labels of one clustering (series or 1-D array) or many (columns of a dataframe, dict of name -> labels,
+        or 2-D array of clusterings x rows, e.g., labels of cluster_sweep).
+    n_resamples : int
+        Number of resamples per clustering (0 for the parametric p-value only).
+    method : string
+        'permutation' or 'bootstrap'.
+    workers : int, optional
+        Number of worker processes (1 runs serially).
+    random_state : int
+        Seed of resampling.
+    batch_size : int
+        Resamples per vectorized batch (memory of a batch is about 24 x batch_size x rows x columns bytes).
+
+    Returns
+    -------
+    DataFrame
+        anova_oneway statistics of every (clustering, column) with 'p_resampled', the share of resamples with
+        F at least as large as observed (with one added to both counts).
+
+    """
+    if method not in ('permutation', 'bootstrap'):
+        raise ValueError(f"method must be 'permutation' or 'bootstrap', not {method!r}")
+
+    if isinstance(clusterings, pd.DataFrame):
+        clusterings = {name: clusterings[name] for name in clusterings.columns}
+    elif isinstance(clusterings, pd.Series):
+        clusterings = {clusterings.name: clusterings}
+    elif not isinstance(clusterings, dict):
+        clusterings = np.asarray(clusterings)
+        clusterings = dict(enumerate(clusterings[None, :] if clusterings.ndim == 1 else clusterings))
+
+    values, _ = _frequency_values(frequencies)
+    values = values - np.nanmean(values, axis=0)
+    index = getattr(frequencies, 'index', None)
+
+    tables = {name: anova_oneway(frequencies, labels) for name, labels in clusterings.items()}
+    codes = {name: _group_codes(labels, index) for name, labels in clusterings.items()}
+
+    # jobs of batch_size resamples with independent seeds (results do not depend on workers); only rows with
+    # a cluster label are resampled
+    n_batches = -(-n_resamples // batch_size)
+    seeds = np.random.SeedSequence(random_state).spawn(len(clusterings) * n_batches)
+    jobs = []
+    for i, (name, (code, groups)) in enumerate(codes.items()):
+        labelled = code >= 0
+        jobs += [(name, (values[labelled], code[labelled], len(groups), method, seeds[i * n_batches + b],
+                         min(batch_size, n_resamples - b * batch_size), batch_size)) for b in range(n_batches)]
+
+    if workers == 1 or not jobs:
+        resampled = [_resampled_f(*args) for _, args in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            resampled = list(executor.map(_resampled_f, *zip(*[args for _, args in jobs])))
+
+    for name, table in tables.items():
+        F = np.concatenate([result for (job_name, _), result in zip(jobs, resampled) if job_name == name] or [np.empty((0, len(table)))])
+        with np.errstate(invalid='ignore'):
+            exceed = (F >= table['F'].to_numpy() * (1 - 1e-12)).sum(axis=0)
+        table['p_resampled'] = np.where(table['F'].notna(), (exceed + 1) / (len(F) + 1), np.nan)
+
+    record_counts(rows=len(values) * len(clusterings) * (n_resamples + 1))
+
+    return pd.concat(tables, names=['clustering'])
+
+
+
+def tukey_hsd(frequencies, labels, alpha=0.05):
+    """
+    Tukey HSD pairwise comparison of cluster means of every frequency column, all columns and pairs at once
+    (as pairwise_tukeyhsd of each column, with exact studentized range distribution).
+
+    Returns long DataFrame with column, group1, group2, meandiff (group2 - group1), p_adj, lower, upper, and
+    reject (p_adj < alpha) of every pair of clusters of every column.
+    """
+    values, columns = _frequency_values(frequencies)
+    codes, groups = _group_codes(labels, getattr(frequencies, 'index', None))
+    counts, sums, squares = (a[0] for a in _anova_sums(values - np.nanmean(values, axis=0), codes[None, :], len(groups)))
+    stats = {key: value[0] for key, value in _anova_statistics(counts[None], sums[None], squares[None]).items()}
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts + np.nanmean(values, axis=0)[:, None]
+        mse = stats['ss_within'] / stats['df_within']
+
+    first, second = np.triu_indices(len(groups), k=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        diff = means[:, second] - means[:, first]
+        se = np.sqrt(mse[:, None] / 2 * (1 / counts[:, first] + 1 / counts[:, second]))
+        k, df = stats['groups'][:, None], stats['df_within'][:, None]
+        p_adj = studentized_range.sf(np.abs(diff) / se, k, df)
+        q_crit = np.array([studentized_range.ppf(1 - alpha, ki, dfi) if ki > 1 and dfi > 0 else np.nan
+                           for ki, dfi in zip(stats['groups'], stats['df_within'])])[:, None]
+
+    table = pd.DataFrame({'column': np.repeat(columns, len(first)), 'group1': np.tile(groups[first], len(columns)),
+                          'group2': np.tile(groups[second], len(columns)), 'meandiff': diff.ravel(),
+                          'p_adj': np.minimum(p_adj, 1).ravel(), 'lower': (diff - q_crit * se).ravel(),
+                          'upper': (diff + q_crit * se).ravel()})
+    table['reject'] = table['p_adj'] < alpha
+
+    # pairs with a cluster without data in a column
+    return table.dropna(subset=['meandiff']).reset_index(drop=True)
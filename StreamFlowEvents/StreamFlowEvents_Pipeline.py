@@ -0,0 +1,98 @@
+"""
+Command-line pipeline for stream gauges -> elevated stream flow events -> watershed frequencies.
+
+Gauges are processed in parallel across a process pool, then frequencies are merged into the gauge 
+table and averaged by watershed. Run from the StreamFlowEvents directory, e.g.
+
+    python StreamFlowEvents_Pipeline.py --workers 8 --output KY_WatershedMeanFrequencies.csv
+"""
+
+
+import argparse
+import os
+import sys
+
+import geopandas as gpd
+import pandas as pd
+
+from StreamFlowEvents_Utils import (collect_frequencies, frequency_table, assign_frequencies_bulk, 
+                                    watershed_mean_frequencies, stream_gauge_minimum_days, gauge_segment_durations,
+                                    collect_event_cube, event_frequencies, DATA_TYPE_SUFFIXES)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Identify elevated stream flow events for every gauge and aggregate frequencies by watershed.')
+    parser.add_argument('--gauges', default='../Data/stream_gauges/KY_StreamGaugeLocations_26916.shp', help='gauge location shapefile with site_no, huc10, gh, sf, gh_diff, sf_diff columns')
+    parser.add_argument('--output', default='KY_WatershedMeanFrequencies.csv', help='path for watershed frequency .csv file')
+    parser.add_argument('--gauge-output', default=None, help='optional path for gauge frequency .csv file')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes (1 runs serially)')
+    parser.add_argument('--data-dir', default='../Data/stream_gauges', help='directory with gauge_height/ and streamflow/ .csv files')
+    parser.add_argument('--store-dir', default=None, help='gauge store directory (see build_gauge_store); used instead of --data-dir if given')
+    parser.add_argument('--resample', default='1D')
+    parser.add_argument('--window', default='90D')
+    parser.add_argument('--min-periods', type=int, default=30)
+    parser.add_argument('--alpha', type=float, default=0.05)
+    parser.add_argument('--minimum-days', type=int, default=365, help='exclude data types with a shorter range of measurements')
+    parser.add_argument('--gap-threshold', default=None, help='split gauge data at gaps longer than this (e.g., 10D) and calculate statistics within segments')
+    parser.add_argument('--min-segment-days', type=int, default=None, help='drop segments shorter than this (with --gap-threshold)')
+    parser.add_argument('--interpolate', action='store_true', help='interpolate missing values within segments (with --gap-threshold)')
+    parser.add_argument('--event-cube', default=None, help='save daily events of every gauge as an event cube (.npz) and take frequencies from it')
+    parser.add_argument('--period', default='1YE', help='frequency period with --event-cube (e.g., 1YE, water year, season, ME)')
+    parser.add_argument('--quiet', action='store_true', help='disable progress reporting')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    gdf_gauges = gpd.read_file(args.gauges)
+    gdf_gauges[['gh_diff', 'sf_diff']] = gdf_gauges[['gh_diff', 'sf_diff']].apply(pd.to_timedelta)
+
+    # with gap threshold, minimum days apply to the longest contiguous segment rather than the full range of measurements
+    if args.gap_threshold is not None:
+        for data_type, indicator, column in [('gauge height', 'gh', 'gh_diff'), ('streamflow', 'sf', 'sf_diff')]:
+            gauges = gdf_gauges.loc[gdf_gauges[indicator] == 1, 'site_no']
+            durations = gauge_segment_durations(gauges, data_type, args.gap_threshold, resample=args.resample, 
+                                                store_dir=args.store_dir, data_dir=args.data_dir)
+            gdf_gauges.loc[gauges.index, column] = durations.to_numpy()
+    gdf_gauges = stream_gauge_minimum_days(gdf_gauges, ['gh_diff', 'sf_diff'], ['gh', 'sf'], args.minimum_days)
+
+    # jobs in table order (gauge height first, then streamflow) for deterministic output
+    jobs = [(gauge, 'gauge height') for gauge in gdf_gauges.loc[gdf_gauges['gh'] == 1, 'site_no']]
+    jobs += [(gauge, 'streamflow') for gauge in gdf_gauges.loc[gdf_gauges['sf'] == 1, 'site_no']]
+
+    def progress(completed, total, gauge, data_type):
+        print(f'\r{completed}/{total} gauges processed ({gauge}, {data_type})', end='', file=sys.stderr, flush=True)
+        if completed == total:
+            print(file=sys.stderr)
+
+    kwargs = dict(resample=args.resample, window=args.window, min_periods=args.min_periods, alpha=args.alpha, 
+                  store_dir=args.store_dir, data_dir=args.data_dir, gap_threshold=args.gap_threshold, interpolate=args.interpolate,
+                  min_duration=None if args.min_segment_days is None else pd.Timedelta(days=args.min_segment_days))
+
+    if args.event_cube is not None:
+        cube = collect_event_cube(jobs, args.event_cube, workers=args.workers, progress=None if args.quiet else progress, **kwargs)
+        table = event_frequencies(cube, args.period)
+        processed = {(gauge, definition.split('_')[-1]) for g, gauge in enumerate(cube['gauges']) 
+                     for d, definition in enumerate(cube['definitions']) if cube['first'][g, d] >= 0}
+        failed = [(gauge, data_type) for gauge, data_type in jobs if (gauge, DATA_TYPE_SUFFIXES[data_type]) not in processed]
+    else:
+        results = collect_frequencies(jobs, workers=args.workers, progress=None if args.quiet else progress, **kwargs)
+        table = frequency_table(results)
+        failed = [job for job, series in results if series is None]
+
+    if failed:
+        print(f'{len(failed)} gauge files excluded from analysis (no data):', file=sys.stderr)
+        for gauge, data_type in failed:
+            print(f'    {gauge} ({data_type})', file=sys.stderr)
+
+    gdf_gauges = assign_frequencies_bulk(gdf_gauges, table)
+
+    if args.gauge_output is not None:
+        gdf_gauges.drop(columns='geometry').to_csv(args.gauge_output, index=False)
+
+    watershed_mean_frequencies(gdf_gauges).to_csv(args.output)
+
+
+if __name__ == '__main__':
+    main()
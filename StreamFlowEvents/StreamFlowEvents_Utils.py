@@ -1,17 +1,159 @@
 import glob
+import os
+import sys
+import re
+import json
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pandas as pd
 import numpy as np
 from scipy.stats import t
 import matplotlib.pyplot as plt
 
+# numba is optional; fused rolling kernel falls back to vectorized numpy without it
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 
+# instrumentation of utility functions (Instrumentation_Utils.py at the repository root; no-op unless enabled)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Instrumentation_Utils import instrumented, record_counts
 
 
+# partition (sub-directory) names of the gauge store for each data type
+STORE_PARTITIONS = {'gauge height': 'gauge_height',
+                    'streamflow': 'streamflow'}
 
+# UTC offsets (hours) of the NWIS tz_cd time zone codes
+TZ_OFFSETS = {'UTC': 0, 'GMT': 0, 'EST': -5, 'EDT': -4, 'CST': -6, 'CDT': -5, 'MST': -7, 'MDT': -6,
+              'PST': -8, 'PDT': -7, 'AKST': -9, 'AKDT': -8, 'HST': -10}
+
+# columns of the NWIS RDB layout that are not measurement values or qualifier codes
+RDB_ID_COLUMNS = ('agency_cd', 'site_no', 'datetime', 'tz_cd')
+
+# errors of gauges without data (no file or store partition, empty file); batch runs skip these gauges and raise anything else
+NO_DATA_ERRORS = (FileNotFoundError, pd.errors.EmptyDataError)
+
+
+
+
+def _rdb_layout(file_path):
+    """Delimiter, number of leading comment lines, header fields, and whether a format-spec row (e.g., 5s, 20d) follows the header."""
+    comments, header = 0, None
+    with open(file_path, 'r', newline='') as f:
+        for line in f:
+            if not line.startswith('#'):
+                header = line.rstrip('\r\n')
+                break
+            comments += 1
+        # empty files (written for responses without data) and comment-only responses, as pd.read_csv
+        if not header:
+            raise pd.errors.EmptyDataError(f'no columns to parse from {file_path}')
+        delimiter = '\t' if '\t' in header else ','
+        following = f.readline().rstrip('\r\n').split(delimiter)
+    spec = all(re.fullmatch(r'\d+[a-zA-Z]', field.strip()) for field in following)
+    return delimiter, comments, header.split(delimiter), spec
+
+
+
+@instrumented(key='file_path')
+def read_gauge_rdb(file_path, timezone=None, qualifiers=False, value_dtype='float64'):
+    """
+    Function to parse a gauge data file in the NWIS RDB layout (agency_cd, site_no, datetime, tz_cd, value, qualifier code)
+    with explicit column types in one pass.
+
+    Reads the .csv files written by the scrapers (write_rdb_lines), raw tab-separated RDB responses (comment lines and
+    format-spec row are skipped), and .parquet files, with the pyarrow csv reader: only the needed columns are
+    converted, datetimes are parsed in C, values are read as floats (non-numeric codes such as 'Eqp' or 'Ice' are
+    missing values, as with pd.to_numeric(errors='coerce')), and qualifier and time zone codes are dictionary
+    encoded (pandas categoricals). Same values and index as read_gauge_csv with its default columns.
+
+    Parameters
+    ----------
+    file_path : string
+        Path to gauge data file (.csv, .rdb/.txt, or .parquet).
+    timezone : string, optional
+        None keeps local clock times as recorded (naive, as read_gauge_csv); otherwise datetimes are converted
+        to UTC with the tz_cd column (so the repeated hour at the end of daylight saving time stays in order)
+        and then to this time zone (e.g., 'UTC', 'US/Eastern').
+    qualifiers : bool
+        Also return the qualifier codes (e.g., A, P, A:e) as a categorical column.
+    value_dtype : string
+        dtype of values ('float64', or 'float32' for half the memory).
+
+    Returns
+    -------
+    DataFrame
+        Values (column named as in file, e.g., '12345_00065') indexed by 'datetime', and qualifier column
+        ('{value column}_cd') if qualifiers.
+
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pv
+
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+
+    if file_path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        header, delimiter, comments, spec = pq.read_schema(file_path).names, None, 0, False
+    else:
+        delimiter, comments, header, spec = _rdb_layout(file_path)
+
+    # first measurement column (same as column 4 of read_gauge_csv) and its qualifier codes
+    value_column = next(col for col in header if col not in RDB_ID_COLUMNS and not col.endswith('_cd'))
+    qualifier_column = value_column + '_cd'
+    columns = ['datetime', value_column]
+    if timezone is not None:
+        columns.append('tz_cd')
+    if qualifiers and qualifier_column in header:
+        columns.append(qualifier_column)
+
+    if delimiter is None:
+        table = pq.read_table(file_path, columns=columns)
+    else:
+        read_options = pv.ReadOptions(skip_rows=comments, skip_rows_after_names=int(spec), block_size=16 << 20)
+        parse_options = pv.ParseOptions(delimiter=delimiter)
+
+        def read(value_type):
+            convert_options = pv.ConvertOptions(include_columns=columns, timestamp_parsers=['%Y-%m-%d %H:%M', pv.ISO8601],
+                                                column_types={'datetime': pa.timestamp('ns'), value_column: value_type,
+                                                              'tz_cd': dictionary, qualifier_column: dictionary})
+            return pv.read_csv(file_path, read_options, parse_options, convert_options)
+
+        # values with non-numeric codes are read as strings and coerced (only these files take the slower path)
+        try:
+            table = read(pa.float64())
+        except pa.ArrowInvalid:
+            table = read(pa.string())
+            table = table.set_column(table.schema.get_field_index(value_column), value_column,
+                                     pa.array(pd.to_numeric(table[value_column].to_pandas(), errors='coerce')))
+
+    df = table.to_pandas()
+    df[value_column] = df[value_column].astype(value_dtype)
+    if qualifier_column in df.columns:
+        df[qualifier_column] = df[qualifier_column].astype('category')
+
+    if timezone is not None:
+        codes = df.pop('tz_cd').astype('category')
+        unknown = set(codes.cat.categories) - set(TZ_OFFSETS)
+        if unknown:
+            raise ValueError(f'unknown time zone codes {sorted(unknown)} in {file_path}')
+        offsets = codes.cat.rename_categories(lambda code: TZ_OFFSETS[code]).astype('int64')
+        df['datetime'] = (df['datetime'] - pd.to_timedelta(offsets, unit='h')).dt.tz_localize('UTC').dt.tz_convert(timezone)
+
+    return df.set_index('datetime')
+
+
+
+@instrumented(key='file_path')
+def read_gauge_csv(file_path, columns_to_drop=[0,1,3,5]):
+    """Read CSV file, drop specified columns, set 'datetime' as index, and cast values to numeric."""
+
+    # standard layout (keep datetime and first value column) is parsed with the typed reader
+    if list(columns_to_drop) == [0, 1, 3, 5]:
+        return read_gauge_rdb(file_path)
 
-def read_and_prepare_data(file_path, columns_to_drop=[0,1,3,5], resample='1d'):
-    """Read CSV file, drop specified columns, and set 'datetime' as index."""
-    
     df = pd.read_csv(file_path, parse_dates=['datetime'], low_memory=False, delimiter=',')
 
     df = df.iloc[:, :6]
@@ -23,7 +165,16 @@ def read_and_prepare_data(file_path, columns_to_drop=[0,1,3,5], resample='1d'):
         
     df.set_index('datetime', inplace=True)
     
-    df.iloc[:,0] = pd.to_numeric(df.iloc[:,0], errors='coerce')
+    df[df.columns[0]] = pd.to_numeric(df.iloc[:,0], errors='coerce')
+
+    return df
+
+
+@instrumented(key='file_path')
+def read_and_prepare_data(file_path, columns_to_drop=[0,1,3,5], resample='1d'):
+    """Read CSV file, drop specified columns, and set 'datetime' as index."""
+    
+    df = read_gauge_csv(file_path, columns_to_drop)
 
     df.rename(columns={df.columns[0]:f'mean_{resample}'}, inplace=True)
     
@@ -37,6 +188,90 @@ def read_and_prepare_data(file_path, columns_to_drop=[0,1,3,5], resample='1d'):
     return df
 
 
+def _store_partition_path(gauge, data_type):
+    return os.path.join(STORE_PARTITIONS[data_type], f'{gauge}.arrow')
+
+
+def _write_store_index(store_dir, index):
+    index_path = os.path.join(store_dir, 'index.json')
+    with open(index_path + '.part', 'w') as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    os.replace(index_path + '.part', index_path)
+
+
+def read_store_index(store_dir):
+    """Read index of gauge store mapping data type -> gauge -> partition path (relative to store_dir)."""
+    index_path = os.path.join(store_dir, 'index.json')
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path) as f:
+        return json.load(f)
+
+
+@instrumented(key='gauge')
+def ingest_gauge_data(file_path, store_dir, gauge, data_type, columns_to_drop=[0,1,3,5], update_index=True):
+    """Parse gauge CSV once and write datetime64/float32 columns to an Arrow IPC partition of the gauge store.
+    
+    Partitions are uncompressed Arrow IPC files ({store_dir}/{data type}/{gauge}.arrow) so they can be 
+    memory-mapped by read_gauge_store without parsing. Returns path of the partition."""
+    import pyarrow as pa
+
+    df = read_gauge_csv(file_path, columns_to_drop)
+
+    table = pa.table({'datetime': pa.array(df.index.values.astype('datetime64[ns]')),
+                      'value': pa.array(df.iloc[:,0].to_numpy(dtype=np.float32, na_value=np.nan))})
+
+    relative_path = _store_partition_path(gauge, data_type)
+    partition_path = os.path.join(store_dir, relative_path)
+    os.makedirs(os.path.dirname(partition_path), exist_ok=True)
+
+    with pa.OSFile(partition_path + '.part', 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(partition_path + '.part', partition_path)
+
+    if update_index:
+        index = read_store_index(store_dir)
+        index.setdefault(STORE_PARTITIONS[data_type], {})[str(gauge)] = relative_path
+        _write_store_index(store_dir, index)
+
+    return partition_path
+
+
+def build_gauge_store(source_dir, store_dir, data_type, columns_to_drop=[0,1,3,5]):
+    """Ingest every gauge CSV in source_dir (file names start with gauge id) into the gauge store and write index."""
+    index = read_store_index(store_dir)
+    partitions = index.setdefault(STORE_PARTITIONS[data_type], {})
+
+    for file_path in sorted(glob.glob(os.path.join(source_dir, '*.csv'))):
+        gauge = os.path.basename(file_path).split('_')[0]
+        ingest_gauge_data(file_path, store_dir, gauge, data_type, columns_to_drop, update_index=False)
+        partitions[gauge] = _store_partition_path(gauge, data_type)
+
+    _write_store_index(store_dir, index)
+
+    return index
+
+
+@instrumented(key='gauge')
+def read_gauge_store(store_dir, gauge, data_type, index=None):
+    """Memory-map a gauge partition from the gauge store and return dataframe with 'datetime' index and 'value' column."""
+    import pyarrow as pa
+
+    if index is None:
+        index = read_store_index(store_dir)
+
+    partition_path = os.path.join(store_dir, index[STORE_PARTITIONS[data_type]][str(gauge)])
+
+    with pa.memory_map(partition_path, 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+
+    # columns are converted one at a time without consolidating them into one block, and each column's
+    # Arrow buffers are released as it is converted, so the table is never held twice
+    return table.to_pandas(split_blocks=True, self_destruct=True).set_index('datetime')
+
+
+@instrumented
 def calculate_ci(df, window, min_periods, alpha):
     """Calculate moving average and margin of error envelope."""
     rolling = df.rolling(window, min_periods=min_periods)
@@ -55,6 +290,7 @@ def calculate_ci(df, window, min_periods, alpha):
     return df
 
 
+@instrumented
 def calculate_percentile(df, window, min_periods, percentile):
     rolling = df.iloc[:,0].rolling(window, min_periods=min_periods)
     q = percentile/100
@@ -67,19 +303,397 @@ def calculate_percentile(df, window, min_periods, percentile):
 
 
 
-def process_gauge_data(gauge, data_type, columns_to_drop=[0,1,3,5], resample='1D', window='90D', min_periods='30', alpha=0.05):
-    """Process gauge data based on type ('gh' or 'sf')."""
-    if data_type == 'gauge height':
-        file_path = glob.glob(f'../Data/stream_gauges/gauge_height/{gauge}*.csv')[0]
+@instrumented(key='gauge')
+def load_gauge_data(gauge, data_type, columns_to_drop=[0,1,3,5], resample='1D', store_dir=None, data_dir='../Data/stream_gauges'):
+    """Read and resample gauge data; reads from gauge store if store_dir is given, otherwise from CSV in data_dir.
+    
+    Raises FileNotFoundError if there is no data file (or store partition) for the gauge and EmptyDataError if it has no rows."""
+    if store_dir is not None:
+        index = read_store_index(store_dir)
+        if str(gauge) not in index.get(STORE_PARTITIONS[data_type], {}):
+            raise FileNotFoundError(f'no {data_type} partition for gauge {gauge} in {store_dir}')
+        df = read_gauge_store(store_dir, gauge, data_type, index).astype(np.float64)
+        df.columns = [f'mean_{resample}']
+        df = df.resample(resample).mean()
     else:
-        file_path = glob.glob(f'../Data/stream_gauges/streamflow/{gauge}*.csv')[0]
-    df = read_and_prepare_data(file_path, columns_to_drop, resample)
-    df = calculate_ci(df, window, min_periods, alpha)
-    df = calculate_percentile(df, window, min_periods, 90)
-    df = calculate_percentile(df, window, min_periods, 99)
+        if data_type == 'gauge height':
+            file_paths = glob.glob(f'{data_dir}/gauge_height/{gauge}*.csv')
+        else:
+            file_paths = glob.glob(f'{data_dir}/streamflow/{gauge}*.csv')
+        if not file_paths:
+            raise FileNotFoundError(f'no {data_type} file for gauge {gauge} in {data_dir}')
+        df = read_and_prepare_data(file_paths[0], columns_to_drop, resample)
+    if df.empty:
+        raise pd.errors.EmptyDataError(f'no {data_type} data for gauge {gauge}')
+    return df
+
+
+
+@instrumented(key='gauge')
+def process_gauge_data(gauge, data_type, columns_to_drop=[0,1,3,5], resample='1D', window='90D', min_periods='30', alpha=0.05, store_dir=None, data_dir='../Data/stream_gauges',
+                       gap_threshold=None, min_duration=None, interpolate=False):
+    """Process gauge data based on type ('gh' or 'sf'); reads from gauge store if store_dir is given, otherwise from CSV in data_dir.
+    
+    If gap_threshold is given (e.g., '10D'), rolling statistics are calculated within contiguous segments of data only
+    (see calculate_events_segmented), dropping segments shorter than min_duration."""
+    df = load_gauge_data(gauge, data_type, columns_to_drop, resample, store_dir, data_dir)
+    if gap_threshold is not None:
+        return calculate_events_segmented(df, window, min_periods, alpha, gap_threshold, min_duration, interpolate=interpolate)
+    df = calculate_events(df, window, min_periods, alpha, percentiles=(90, 99))
+    return df
+
+
+
+def align_gauge_series(series_dict, resample='1D'):
+    """Align daily series of many gauges on one date index and return (2-D array of gauges x days, date index, gauge ids)."""
+    gauges = list(series_dict.keys())
+    aligned = pd.concat([series_dict[gauge].iloc[:,0] if isinstance(series_dict[gauge], pd.DataFrame) else series_dict[gauge] 
+                         for gauge in gauges], axis=1, keys=gauges, sort=True)
+    aligned = aligned.asfreq(resample)
+    return aligned.to_numpy(dtype=np.float64).T, aligned.index, gauges
+
+
+def _t_critical_table(window, alpha):
+    """t-critical values indexed by count of observations (NaN for counts < 2)."""
+    t_table = np.full(window + 1, np.nan)
+    t_table[2:] = t.ppf(1 - alpha/2, np.arange(1, window))
+    return t_table
+
+
+def _window_rows(window, index):
+    """Number of rows of regular (resampled) datetime index covered by a time-based window such as '90D'."""
+    if not isinstance(window, str):
+        return int(window)
+    step = index[1] - index[0] if len(index) > 1 else pd.Timedelta(window)
+    return max(int(pd.Timedelta(window) / step), 1)
+
+
+def _rolling_sum(values, window):
+    """Trailing rolling sum along last axis (window includes current position)."""
+    cumulative = np.cumsum(values, axis=-1)
+    out = cumulative.copy()
+    out[..., window:] -= cumulative[..., :-window]
+    return out
+
+
+def rolling_event_statistics(values, window, min_periods, alpha=0.05, percentiles=(90, 99), chunk_days=2048):
+    """Calculate rolling mean, margin of error, and percentiles for 2-D array (gauges x days) in one vectorized pass.
+    
+    window is a number of rows (days). Values match calculate_ci and calculate_percentile: statistics are NaN where a 
+    window has fewer than min_periods non-null values, the t-critical value uses count-1 degrees of freedom, and 
+    percentiles use linear interpolation. Percentile windows are sorted once per chunk of chunk_days and shared by 
+    all percentiles. Returns dict of 2-D arrays with keys 'mean', 'std', 'count', 'moe', and each percentile."""
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    n_gauges, n_days = values.shape
+    window = int(window)
+    min_periods = max(int(min_periods), 1)
+
+    valid = ~np.isnan(values)
+
+    # center each gauge on its own mean so running sums of squares don't lose precision (0 for gauges without values)
+    center = (np.where(valid, values, 0.0).sum(axis=1) / np.maximum(valid.sum(axis=1), 1))[:, None]
+    centered = np.where(valid, values - center, 0.0)
+
+    count = _rolling_sum(valid.astype(np.int64), window)
+    sums = _rolling_sum(centered, window)
+    squares = _rolling_sum(centered ** 2, window)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        enough = count >= min_periods
+        mean = np.where(enough, sums / count + center, np.nan)
+        variance = np.maximum((squares - sums ** 2 / count) / (count - 1), 0.0)
+        std = np.where(enough & (count > 1), np.sqrt(variance), np.nan)
+
+        # at most window distinct degrees of freedom, so look up t-critical values from a table
+        t_table = _t_critical_table(window, alpha)
+        moe = np.where(enough & (count > 1), t_table[count] * std / np.sqrt(count), np.nan)
+
+    results = {'mean': mean, 'std': std, 'count': np.where(enough, count, np.nan), 'moe': moe}
+    quantiles = {p: np.full((n_gauges, n_days), np.nan) for p in percentiles}
+
+    # rolling percentiles: sort each window once (NaN sorts last) and interpolate at every requested quantile
+    padded = np.concatenate([np.full((n_gauges, window - 1), np.nan), values], axis=1)
+    windows = np.lib.stride_tricks.sliding_window_view(padded, window, axis=1)
+
+    for start in range(0, n_days, chunk_days):
+        stop = min(start + chunk_days, n_days)
+        chunk = windows[:, start:stop]
+        n = count[:, start:stop]
+        sorted_windows = np.sort(chunk, axis=-1)
+        has_enough = n >= min_periods
+        for p in percentiles:
+            position = p / 100 * np.maximum(n - 1, 0)
+            lower = np.floor(position).astype(np.int64)
+            upper = np.minimum(lower + 1, np.maximum(n - 1, 0))
+            lower_value = np.take_along_axis(sorted_windows, lower[..., None], axis=-1)[..., 0]
+            upper_value = np.take_along_axis(sorted_windows, upper[..., None], axis=-1)[..., 0]
+            fraction = position - lower
+            interpolated = np.where(fraction > 0, lower_value + (upper_value - lower_value) * fraction, lower_value)
+            quantiles[p][:, start:stop] = np.where(has_enough, interpolated, np.nan)
+
+    results.update(quantiles)
+
+    return results
+
+
+def _fused_rolling_kernel(values, window, min_periods, quantiles, t_table, center, mean, moe, percentile_values):
+    """Single pass over series keeping running sums and a sorted buffer of the non-null values in the window."""
+    buffer = np.empty(window)
+    k = 0
+    sums = 0.0
+    squares = 0.0
+
+    for i in range(values.shape[0]):
+
+        # remove value leaving the window from running sums and sorted buffer
+        if i >= window:
+            old = values[i - window]
+            if not np.isnan(old):
+                j = np.searchsorted(buffer[:k], old)
+                for m in range(j, k - 1):
+                    buffer[m] = buffer[m + 1]
+                k -= 1
+                sums -= old - center
+                squares -= (old - center) ** 2
+
+        # insert value entering the window
+        new = values[i]
+        if not np.isnan(new):
+            j = np.searchsorted(buffer[:k], new)
+            for m in range(k, j, -1):
+                buffer[m] = buffer[m - 1]
+            buffer[j] = new
+            k += 1
+            sums += new - center
+            squares += (new - center) ** 2
+
+        if k < min_periods or k == 0:
+            continue
+
+        mean[i] = sums / k + center
+
+        if k > 1:
+            variance = max((squares - sums * sums / k) / (k - 1), 0.0)
+            moe[i] = t_table[k] * np.sqrt(variance) / np.sqrt(k)
+
+        # linear interpolation between order statistics (same as pandas rolling quantile)
+        for q in range(quantiles.shape[0]):
+            position = quantiles[q] * (k - 1)
+            lower = int(np.floor(position))
+            fraction = position - lower
+            if fraction > 0:
+                percentile_values[q, i] = buffer[lower] + (buffer[lower + 1] - buffer[lower]) * fraction
+            else:
+                percentile_values[q, i] = buffer[lower]
+
+
+_fused_rolling_kernel_jit = njit(cache=True)(_fused_rolling_kernel) if njit is not None else None
+
+
+def fused_rolling_statistics(values, window, min_periods, alpha=0.05, percentiles=(90, 99), engine='auto'):
+    """Calculate rolling mean, margin of error, and percentiles of 1-D series with shared window state.
+    
+    engine is 'numba' (compiled single-pass kernel), 'numpy' (vectorized, see rolling_event_statistics), or 'auto' 
+    (numba if installed). Returns dict of arrays with keys 'mean', 'moe', and each percentile."""
+    values = np.asarray(values, dtype=np.float64)
+    window = int(window)
+    min_periods = int(min_periods)
+
+    if engine == 'auto':
+        engine = 'numba' if _fused_rolling_kernel_jit is not None else 'numpy'
+
+    if engine == 'numpy':
+        stats = rolling_event_statistics(values[None, :], window, min_periods, alpha, percentiles)
+        return {key: value[0] for key, value in stats.items() if key in ['mean', 'moe', *percentiles]}
+
+    if engine != 'numba':
+        raise ValueError(f"engine must be 'auto', 'numba', or 'numpy', not {engine!r}")
+    if _fused_rolling_kernel_jit is None:
+        raise ImportError("engine='numba' requires numba")
+
+    valid = ~np.isnan(values)
+    center = float(values[valid].mean()) if valid.any() else 0.0
+    mean = np.full(values.shape[0], np.nan)
+    moe = np.full(values.shape[0], np.nan)
+    percentile_values = np.full((len(percentiles), values.shape[0]), np.nan)
+
+    _fused_rolling_kernel_jit(values, window, min_periods, np.asarray(percentiles, dtype=np.float64) / 100, 
+                              _t_critical_table(window, alpha), center, mean, moe, percentile_values)
+
+    stats = {'mean': mean, 'moe': moe}
+    stats.update({p: percentile_values[i] for i, p in enumerate(percentiles)})
+
+    return stats
+
+
+@instrumented
+def calculate_events(df, window, min_periods, alpha, percentiles=(90, 99), engine='auto'):
+    """Calculate moving average, margin of error envelope, and rolling percentiles in one pass (fused calculate_ci and calculate_percentile).
+    
+    Adds the same columns as calculate_ci followed by calculate_percentile for each percentile. Index must be regular 
+    (e.g., resampled) so a time-based window maps to a fixed number of rows."""
+    window_rows = _window_rows(window, df.index)
+
+    value = df.iloc[:,0].to_numpy(dtype=np.float64)
+    stats = fused_rolling_statistics(value, window_rows, min_periods, alpha, percentiles, engine)
+
+    label = f'moe{int((1-alpha) * 100)}'
+    df[f'ma_{window}'] = stats['mean']
+    df[label] = stats['moe']
+    with np.errstate(invalid='ignore'):
+        df[f'{label}_bool'] = value > stats['mean'] + stats['moe']
+        for p in percentiles:
+            df[f'percentile{p}'] = stats[p]
+            df[f'percentile{p}_bool'] = value > stats[p]
+    return df
+
+
+def find_gauge_segments(data, gap_threshold='10D'):
+    """Contiguous segments of gauge data separated by gaps longer than gap_threshold between valid observations.
+    
+    data is a series or dataframe (rows with missing values are not observations, since resampling keeps empty 
+    intervals). Returns dataframe with start, end, number of observations, and duration (end - start) of each segment."""
+    valid = data.notna().all(axis=1) if isinstance(data, pd.DataFrame) else data.notna()
+    times = data.index[valid.to_numpy()]
+
+    breaks = np.flatnonzero(np.diff(times.to_numpy()) > pd.Timedelta(gap_threshold).to_timedelta64()) + 1
+    first = np.r_[0, breaks] if len(times) else np.array([], dtype=np.int64)
+    last = np.r_[breaks, len(times)] - 1 if len(times) else np.array([], dtype=np.int64)
+
+    segments = pd.DataFrame({'start': times[first], 'end': times[last], 'observations': last - first + 1})
+    segments['duration'] = segments['end'] - segments['start']
+    return segments
+
+
+def drop_short_segments(segments, min_duration=None, min_observations=None):
+    """Keep segments (from find_gauge_segments) lasting at least min_duration (e.g., '180D') with at least min_observations."""
+    keep = np.ones(len(segments), dtype=bool)
+    if min_duration is not None:
+        keep &= (segments['duration'] >= pd.Timedelta(min_duration)).to_numpy()
+    if min_observations is not None:
+        keep &= (segments['observations'] >= int(min_observations)).to_numpy()
+    return segments[keep]
+
+
+def segment_labels(index, segments):
+    """Label of the segment (segments index) containing each row of datetime index, or -1 for rows outside segments."""
+    labels = np.full(len(index), -1, dtype=np.int64)
+    lo = index.searchsorted(segments['start'].to_numpy())
+    hi = index.searchsorted(segments['end'].to_numpy(), side='right')
+    lengths = hi - lo
+    positions = np.arange(lengths.sum()) + np.repeat(lo - np.r_[0, np.cumsum(lengths)[:-1]], lengths)
+    labels[positions] = np.repeat(segments.index.to_numpy(), lengths)
+    return labels
+
+
+@instrumented
+def calculate_events_segmented(df, window, min_periods, alpha, gap_threshold='10D', min_duration=None, min_observations=None, 
+                               interpolate=False, percentiles=(90, 99), engine='auto'):
+    """
+    Calculate moving average, margin of error envelope, and rolling percentiles within contiguous segments of data.
+    
+    Rolling windows do not reach across gaps longer than gap_threshold, so statistics after a gap are not based on 
+    data from before it. Segments shorter than min_duration or with fewer than min_observations are dropped before 
+    any statistics are calculated. All remaining segments are processed in one pass: they are packed into one array 
+    separated by a window of missing values and passed to fused_rolling_statistics, so the cost does not depend on 
+    the number of segments.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Regular (resampled) gauge data with values in the first column (e.g., from read_and_prepare_data).
+    window : string or int
+        Rolling window (e.g., '90D') or number of rows.
+    min_periods : int
+        Minimum number of observations in window required for a value.
+    alpha : float
+        Significance level of margin of error.
+    gap_threshold : string
+        Time between observations (e.g., '10D') longer than which data is split into separate segments.
+    min_duration : string or Timedelta, optional
+        Minimum duration of segments (e.g., '180D').
+    min_observations : int, optional
+        Minimum number of observations of segments.
+    interpolate : bool
+        Linearly interpolate missing values within segments before calculating statistics (events are only flagged 
+        for observed values).
+    percentiles : tuple of int
+        Rolling percentiles to calculate.
+    engine : string
+        'numba', 'numpy', or 'auto' (see fused_rolling_statistics).
+
+    Returns
+    -------
+    DataFrame
+        df with the same columns added as calculate_events (missing outside of kept segments) and 'segment', the 
+        label of the segment of each row (-1 outside of kept segments).
+
+    """
+    window_rows = _window_rows(window, df.index)
+    series = df.iloc[:,0].astype(np.float64)
+
+    segments = drop_short_segments(find_gauge_segments(series, gap_threshold), min_duration, min_observations)
+    labels = segment_labels(df.index, segments)
+    inside = labels >= 0
+
+    value = series.to_numpy()
+    if interpolate:
+        series = series.interpolate(method='linear', limit_area='inside').where(inside)
+
+    # pack rows of kept segments into one array with window_rows missing values between segments
+    order = np.searchsorted(segments.index.to_numpy(), labels[inside])
+    packed_positions = np.arange(order.size) + order * window_rows
+    packed = np.full(order.size + len(segments) * window_rows, np.nan)
+    packed[packed_positions] = series.to_numpy()[inside]
+
+    stats = {key: np.full(len(df), np.nan) for key in ['mean', 'moe', *percentiles]}
+    if len(segments):
+        packed_stats = fused_rolling_statistics(packed, window_rows, min_periods, alpha, percentiles, engine)
+        for key in stats:
+            stats[key][inside] = packed_stats[key][packed_positions]
+
+    label = f'moe{int((1-alpha) * 100)}'
+    df[f'ma_{window}'] = stats['mean']
+    df[label] = stats['moe']
+    with np.errstate(invalid='ignore'):
+        df[f'{label}_bool'] = value > stats['mean'] + stats['moe']
+        for p in percentiles:
+            df[f'percentile{p}'] = stats[p]
+            df[f'percentile{p}_bool'] = value > stats[p]
+    df['segment'] = labels
     return df
 
 
+@instrumented
+def process_gauges_batch(series_dict, resample='1D', window='90D', min_periods=30, alpha=0.05, percentiles=(90, 99)):
+    """Process many gauges at once; series_dict maps gauge id -> resampled dataframe (e.g., from read_and_prepare_data).
+    
+    Returns dict of gauge id -> dataframe with same columns as process_gauge_data (including '*_bool' event flags 
+    used by get_frequencies), trimmed to each gauge's own date range."""
+    values, index, gauges = align_gauge_series(series_dict, resample)
+    window_rows = _window_rows(window, index)
+    stats = rolling_event_statistics(values, window_rows, min_periods, alpha, percentiles)
+
+    label = f'moe{int((1-alpha) * 100)}'
+    results = {}
+
+    for i, gauge in enumerate(gauges):
+        source = series_dict[gauge]
+        name = source.columns[0] if isinstance(source, pd.DataFrame) else source.name
+        value = values[i]
+        with np.errstate(invalid='ignore'):
+            df = pd.DataFrame({name: value,
+                               f'ma_{window}': stats['mean'][i],
+                               label: stats['moe'][i],
+                               f'{label}_bool': value > stats['mean'][i] + stats['moe'][i]}, index=index)
+            for p in percentiles:
+                df[f'percentile{p}'] = stats[p][i]
+                df[f'percentile{p}_bool'] = value > stats[p][i]
+        results[gauge] = df.loc[source.index[0]:source.index[-1]]
+
+    return results
+
+
 
 def create_subplot_axes(nrows):
     """Dynamically create subplot axes based on the number of rows."""
@@ -92,6 +706,7 @@ def create_subplot_axes(nrows):
 
 
 
+@instrumented
 def get_frequencies(df, resample='1YE', data_type='gauge height'):
     count_columns = [col for col in df.columns.values if 'bool' in col]
     df_counts = df[count_columns].resample(resample).sum()
@@ -111,7 +726,330 @@ def assign_frequencies(df, series, gauge_id):
 
 
 
+def _gauge_job(function, gauge, data_type, kwargs):
+    """Worker returning (gauge, data_type, function(process_gauge_data result, data_type=data_type), error); result is None and error 
+    the message for gauges without data (NO_DATA_ERRORS), other errors are raised."""
+    try:
+        df = process_gauge_data(gauge, data_type, **kwargs)
+    except NO_DATA_ERRORS as error:
+        return gauge, data_type, None, f'{type(error).__name__}: {error}'
+    return gauge, data_type, function(df, data_type=data_type), None
+
+
+def _run_gauge_jobs(function, jobs, workers, progress, kwargs):
+    """Run _gauge_job for each (gauge, data_type) job (serially if workers is 1) and return dict of job -> result; warns for gauges without data."""
+    results = {}
+
+    if workers == 1:
+        outputs = (_gauge_job(function, gauge, data_type, kwargs) for gauge, data_type in jobs)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        outputs = (future.result() for future in as_completed([executor.submit(_gauge_job, function, gauge, data_type, kwargs) 
+                                                               for gauge, data_type in jobs]))
+    try:
+        for i, (gauge, data_type, result, error) in enumerate(outputs, 1):
+            results[(gauge, data_type)] = result
+            if error is not None:
+                warnings.warn(f'gauge {gauge} ({data_type}) excluded: {error}')
+            if progress is not None:
+                progress(i, len(jobs), gauge, data_type)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    return results
+
+
+@instrumented
+def collect_frequencies(jobs, workers=None, progress=None, **kwargs):
+    """Run process_gauge_data and get_frequencies for each (gauge, data_type) job across a process pool.
+    
+    kwargs are passed to process_gauge_data. progress is an optional callable(completed, total, gauge, data_type). 
+    Returns list of ((gauge, data_type), series) in the order of jobs, so results do not depend on the number of 
+    workers. Series is None for gauges without data (see NO_DATA_ERRORS; a warning gives the reason); any other 
+    error of a gauge is raised."""
+    jobs = list(jobs)
+    results = _run_gauge_jobs(get_frequencies, jobs, workers, progress, kwargs)
+    return [(job, results[job]) for job in jobs]
+
+
+def frequency_table(results):
+    """Combine frequency series from collect_frequencies into dataframe with one row per gauge (site_no index)."""
+    records = {}
+    for (gauge, data_type), series in results:
+        if series is not None:
+            records.setdefault(gauge, {}).update(series.to_dict())
+    table = pd.DataFrame.from_dict(records, orient='index')
+    table.index.name = 'site_no'
+    return table.reindex(columns=sorted(table.columns))
+
+
+def assign_frequencies_bulk(df, table):
+    """Assign all gauge frequencies from frequency_table to dataframe of gauges with one merge on 'site_no' (vectorized assign_frequencies)."""
+    merged = df[['site_no']].merge(table, left_on='site_no', right_index=True, how='left')
+    for col in table.columns:
+        if col in df.columns:
+            df[col] = merged[col].where(merged[col].notna(), df[col])
+        else:
+            df[col] = merged[col]
+    return df
+
+
+def watershed_mean_frequencies(df, watershed_column='huc10'):
+    """Rename gauge '*_bool_*' columns to '{threshold}_freq_{data type}' and average frequencies of gauges in each watershed."""
+    rename = {col: col.split('_')[0] + '_freq_' + col.split('_')[-1] for col in df.columns if 'bool' in col}
+    frequencies = df.rename(columns=rename).groupby(watershed_column)[sorted(rename.values())].mean()
+    return frequencies.dropna(axis=0, how='all')
+
+
+def watershed_gauge_counts(df, watershed_ids, watershed_column='huc10'):
+    """Number of gauges in each watershed of watershed_ids, including watersheds without gauges (count 0)."""
+    return df[watershed_column].value_counts().reindex(pd.Index(watershed_ids).unique(), fill_value=0)
+
+
+
+# data type suffix of event definitions (as in get_frequencies) and named periods of event cube queries
+DATA_TYPE_SUFFIXES = {'gauge height': 'gh', 'streamflow': 'sf'}
+PERIOD_ALIASES = {'water year': 'Y-SEP', 'season': 'Q-FEB'}
+
+
+def _pack_days(flags):
+    """Pack boolean array (..., days) into uint64 words of 64 days (day i of a word is bit i), plus one empty word."""
+    days = flags.shape[-1]
+    padded = np.zeros(flags.shape[:-1] + (64 * (days // 64 + 1),), dtype=bool)
+    padded[..., :days] = flags
+    return np.packbits(padded, axis=-1, bitorder='little').view('<u8')
+
+
+def _popcount(words):
+    """Number of set bits of each uint64 word."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    table = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+    return table[words.view(np.uint8)].reshape(words.shape + (8,)).sum(axis=-1)
+
+
+def gauge_event_days(df, data_type):
+    """Daily event and observed (value and threshold available) flags of processed gauge data (see process_gauge_data).
+    
+    Returns (daily index, dict of definition -> event flags, dict of definition -> observed flags); definitions 
+    are '*_bool' columns with data type suffix (e.g., 'percentile90_bool_gh', as in get_frequencies). Days with 
+    any event (for data finer than daily) are event days."""
+    value = df.iloc[:,0]
+    events, observed = {}, {}
+    for col in [col for col in df.columns if 'bool' in col]:
+        threshold = col[:-len('_bool')]
+        valid = value.notna() & (df[threshold].notna() if threshold in df.columns else True)
+        name = f'{col}_{DATA_TYPE_SUFFIXES.get(data_type, data_type)}'
+        events[name] = (df[col].astype(bool) & valid).resample('1D').max()
+        observed[name] = valid.resample('1D').max()
+    index = next(iter(events.values())).index if events else df.index[:0]
+    return index, {name: flags.to_numpy(dtype=bool) for name, flags in events.items()}, {name: flags.to_numpy(dtype=bool) for name, flags in observed.items()}
+
+
+@instrumented
+def build_event_cube(results, cube_path=None):
+    """
+    Build a compact event cube indexed by gauge, event definition, and day from processed gauge data.
+
+    Event and observed days of every (gauge, definition) are stored as bitsets (one bit per day) with prefix 
+    counts per 64-day word, so the number of events (or observed days) between any two days is two prefix 
+    lookups and two popcounts (see event_counts). Frequencies over years, water years, seasons, months, or 
+    custom windows are then answered without reprocessing gauge data.
+
+    Parameters
+    ----------
+    results : dict or list
+        (gauge, data_type) -> processed dataframe (e.g., from process_gauge_data) or gauge_event_days result.
+    cube_path : string, optional
+        Path for saving the cube as .npz file (see open_event_cube).
+
+    Returns
+    -------
+    dict
+        Event cube: 'gauges', 'definitions', daily 'index', 'first' and 'last' day of data of each (gauge, 
+        definition) (-1 if none), and 'events' and 'observed' bitsets with prefix counts.
+
+    """
+    items = results.items() if isinstance(results, dict) else results
+    days = {}
+    for (gauge, data_type), data in items:
+        if data is not None:
+            days[(gauge, data_type)] = gauge_event_days(data, data_type) if isinstance(data, pd.DataFrame) else data
+
+    gauges = sorted({gauge for gauge, _ in days})
+    definitions = sorted({name for _, events, _ in days.values() for name in events})
+    starts = [index[0] for index, _, _ in days.values() if len(index)]
+    ends = [index[-1] for index, _, _ in days.values() if len(index)]
+    index = pd.date_range(min(starts), max(ends), freq='D') if starts else pd.DatetimeIndex([])
+
+    shape = (len(gauges), len(definitions), len(index))
+    events, observed = np.zeros(shape, dtype=bool), np.zeros(shape, dtype=bool)
+    first, last = np.full(shape[:2], -1, dtype=np.int64), np.full(shape[:2], -1, dtype=np.int64)
+
+    for (gauge, _), (gauge_index, gauge_events, gauge_observed) in days.items():
+        if not len(gauge_index):
+            continue
+        g = gauges.index(gauge)
+        offset = index.get_loc(gauge_index[0])
+        for name in gauge_events:
+            d = definitions.index(name)
+            events[g, d, offset:offset + len(gauge_index)] = gauge_events[name]
+            observed[g, d, offset:offset + len(gauge_index)] = gauge_observed[name]
+            first[g, d], last[g, d] = offset, offset + len(gauge_index) - 1
+
+    cube = {'gauges': gauges, 'definitions': definitions, 'index': index, 'first': first, 'last': last, 
+            'events': _pack_days(events), 'observed': _pack_days(observed)}
+
+    if cube_path is not None:
+        np.savez_compressed(cube_path, gauges=np.asarray(gauges, dtype=str), definitions=np.asarray(definitions, dtype=str), 
+                            start=np.datetime64(index[0], 'D') if len(index) else np.datetime64('NaT', 'D'), days=len(index), 
+                            first=first, last=last, events=cube['events'], observed=cube['observed'])
+
+    record_counts(rows=len(days))
+
+    return _event_cube_prefix(cube)
+
+
+def _event_cube_prefix(cube):
+    """Add prefix counts (events before each 64-day word) of event and observed bitsets to cube."""
+    for name in ['events', 'observed']:
+        prefix = np.zeros(cube[name].shape[:-1] + (cube[name].shape[-1] + 1,), dtype=np.int64)
+        np.cumsum(_popcount(cube[name]), axis=-1, out=prefix[..., 1:])
+        cube[f'{name}_prefix'] = prefix
+    return cube
+
+
+def open_event_cube(cube_path):
+    """Open event cube saved by build_event_cube (cube_path)."""
+    with np.load(cube_path) as saved:
+        cube = {'gauges': list(saved['gauges']), 'definitions': list(saved['definitions']), 
+                'index': pd.date_range(saved['start'][()], periods=int(saved['days']), freq='D') if int(saved['days']) else pd.DatetimeIndex([]),
+                'first': saved['first'], 'last': saved['last'], 'events': saved['events'], 'observed': saved['observed']}
+    return _event_cube_prefix(cube)
+
+
+@instrumented
+def collect_event_cube(jobs, cube_path=None, workers=None, progress=None, **kwargs):
+    """Run process_gauge_data for each (gauge, data_type) job across a process pool and build an event cube (see build_event_cube).
+    
+    kwargs are passed to process_gauge_data; progress is an optional callable(completed, total, gauge, data_type). 
+    Workers return daily event bits only, not processed dataframes. Gauges without data are left out of the cube (see 
+    NO_DATA_ERRORS; a warning gives the reason); any other error of a gauge is raised."""
+    jobs = list(jobs)
+    results = _run_gauge_jobs(gauge_event_days, jobs, workers, progress, kwargs)
+    return build_event_cube([(job, results[job]) for job in jobs], cube_path)
+
+
+def _event_rank(cube, name, positions):
+    """Number of set days before each day position (array) of event or observed bitsets, shape (gauges, definitions, positions)."""
+    positions = np.asarray(positions, dtype=np.int64)
+    word, bit = positions // 64, (positions % 64).astype(np.uint64)
+    mask = (np.left_shift(np.uint64(1), bit) - np.uint64(1)).astype(np.uint64)
+    return cube[f'{name}_prefix'][..., word] + _popcount(cube[name][..., word] & mask).astype(np.int64)
+
+
+def _day_position(cube, day):
+    """Position of day in cube index, clipped to the index (0 to number of days)."""
+    return int(np.clip(cube['index'].searchsorted(pd.Timestamp(day).normalize()), 0, len(cube['index'])))
+
+
+def event_counts(cube, start=None, end=None, observed=False):
+    """Number of event days (or observed days) of every gauge and definition from start to end (inclusive dates; whole record if None)."""
+    lo = 0 if start is None else _day_position(cube, start)
+    hi = len(cube['index']) if end is None else _day_position(cube, pd.Timestamp(end) + pd.Timedelta(days=1))
+    counts = np.diff(_event_rank(cube, 'observed' if observed else 'events', [lo, max(lo, hi)]), axis=-1)[..., 0]
+    return pd.DataFrame(counts, index=pd.Index(cube['gauges'], name='site_no'), columns=cube['definitions'])
+
+
+def _period_bounds(cube, period):
+    """Start positions (plus end) and labels of periods (pandas period frequency such as 'Y', 'Y-SEP', 'Q-FEB', 'M') of cube index."""
+    period = PERIOD_ALIASES.get(period, period)
+    # offset aliases of get_frequencies (e.g., '1YE', 'QE-FEB') as period frequencies
+    period = period.lstrip('0123456789')
+    head, _, anchor = period.partition('-')
+    period = (head[:-1] if head.endswith('E') and len(head) > 1 else head) + (f'-{anchor}' if anchor else '')
+
+    labels = cube['index'].to_period(period)
+    if not len(labels):
+        return np.zeros(1, dtype=np.int64), labels
+    starts = np.r_[0, np.flatnonzero(labels[1:] != labels[:-1]) + 1]
+    return np.r_[starts, len(labels)], labels[starts]
+
+
+def event_period_counts(cube, period='Y', observed=False):
+    """
+    Number of event days (or observed days) of every gauge, definition, and period ('Y' calendar year, 'Y-SEP' 
+    or 'water year', 'Q-FEB' or 'season' (DJF, MAM, JJA, SON), 'M' month, or another pandas period frequency).
+
+    Returns (array of counts (gauges x definitions x periods) with NaN for periods outside the data of a gauge, 
+    period labels).
+    """
+    bounds, labels = _period_bounds(cube, period)
+    counts = np.diff(_event_rank(cube, 'observed' if observed else 'events', bounds), axis=-1).astype(np.float64)
+    # periods overlapping the range of data of each (gauge, definition), as resample of the gauge dataframe
+    overlap = ((bounds[1:] > cube['first'][..., None]) & (bounds[:-1] <= cube['last'][..., None]))
+    counts[~overlap] = np.nan
+    return counts, labels
+
+
+@instrumented
+def event_frequencies(cube, period='YE', drop_first=True, by=None):
+    """
+    Mean number of event days per period of every gauge and definition from the event cube.
+
+    With the default annual periods, this is the same as get_frequencies of each gauge (first year of data 
+    dropped), with columns like frequency_table, so results can be used with assign_frequencies_bulk and 
+    watershed_mean_frequencies. by groups periods by an attribute of their labels before averaging (e.g., 
+    'quarter' with period='season' for mean counts of each season (1 = MAM, 2 = JJA, 3 = SON, 4 = DJF), 'month' 
+    with period='M'); the result then has (definition, group) columns.
+    """
+    counts, labels = event_period_counts(cube, period)
+    if drop_first:
+        available = ~np.isnan(counts)
+        first_period = available & (np.cumsum(available, axis=-1) == 1)
+        counts[first_period] = np.nan
+
+    index = pd.Index(cube['gauges'], name='site_no')
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        if by is None:
+            return pd.DataFrame(np.nanmean(counts, axis=-1), index=index, columns=cube['definitions'])
+        groups = np.asarray(getattr(labels, by))
+        means = {(definition, group): np.nanmean(counts[:, d][:, groups == group], axis=-1)
+                 for d, definition in enumerate(cube['definitions']) for group in np.unique(groups)}
+    return pd.DataFrame(means, index=index)
+
+
+def watershed_event_frequencies(cube, df_gauges, period='YE', watershed_column='huc10', drop_first=True):
+    """Mean event frequencies per period of gauges in each watershed (event_frequencies aggregated as watershed_mean_frequencies)."""
+    table = event_frequencies(cube, period, drop_first)
+    gauges = assign_frequencies_bulk(df_gauges[['site_no', watershed_column]].copy(), table)
+    return watershed_mean_frequencies(gauges, watershed_column)
+
+
+
+def gauge_segment_durations(gauges, data_type, gap_threshold='10D', columns_to_drop=[0,1,3,5], resample='1D', store_dir=None, 
+                            data_dir='../Data/stream_gauges'):
+    """Duration of the longest contiguous segment of data (see find_gauge_segments) of each gauge (NaT if the gauge has no data).
+    
+    Can be used as a datetime column of stream_gauge_minimum_days to exclude gauges without a long enough segment 
+    before processing them. Gauges without a data file or rows (NO_DATA_ERRORS) are NaT; other errors are raised."""
+    durations = {}
+    for gauge in gauges:
+        try:
+            df = load_gauge_data(gauge, data_type, columns_to_drop, resample, store_dir, data_dir)
+        except NO_DATA_ERRORS:
+            durations[gauge] = pd.NaT
+            continue
+        durations[gauge] = find_gauge_segments(df.iloc[:,0], gap_threshold)['duration'].max()
+    return pd.Series(durations, index=pd.Index(list(gauges)), dtype='timedelta64[ns]')
+
+
+
 def stream_gauge_minimum_days(df, datetime_columns, indicator_columns, minimum_days_range):
+    """Set indicator columns to 0 for gauges whose duration (timedelta) columns are shorter than minimum_days_range days."""
     for dt, ind in zip(datetime_columns, indicator_columns):
         min_dt_mask = df[dt].dt.days < minimum_days_range
         df.loc[min_dt_mask, ind] = 0
@@ -119,6 +1057,14 @@ def stream_gauge_minimum_days(df, datetime_columns, indicator_columns, minimum_d
 
 
 
-def gauge_data_minimum_measurments(series, window, min_measurements):
-    counts = series.rolling(window).count()
+def gauge_data_minimum_measurments(series, window, min_measurements, gap_threshold=None):
+    """Whether series has min_measurements within a rolling window; counted within each contiguous segment of data if gap_threshold is given."""
+    if gap_threshold is None:
+        counts = series.rolling(window).count()
+        return counts.max().item() >= min_measurements
+    labels = segment_labels(series.index, find_gauge_segments(series, gap_threshold))
+    inside = labels >= 0
+    if not inside.any():
+        return False
+    counts = series[inside].groupby(labels[inside]).rolling(window).count()
     return counts.max().item() >= min_measurements
\ No newline at end of file
@@ -0,0 +1,117 @@
+"""
+Validation of tiled flow routing (flow_routing) on a clipped test DEM.
+
+Clips a window of the DEM, runs flow_routing with small tiles in parallel and as a single tile, and reports
+whether the tiled outputs are identical to the single-tile outputs. The clip is compared with Whitebox
+(fill_depressions, d8_pointer, d8_flow_accumulation run on the same clip) if whitebox is installed, and with
+existing reference rasters (e.g., the original ArcGIS Pro outputs) read for the same window. Note the reference
+rasters were calculated on the full DEM, so flow accumulation only agrees for cells with catchments in the clip.
+Run from the TerrainFeatures directory, e.g.
+
+    python FlowRouting_Validation.py --window 20000 20000 2000 2000 --workers 4
+"""
+
+
+import argparse
+import json
+import os
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window, from_bounds
+
+from TerrainFeatures_Utils import FLOW_NAMES, flow_routing
+
+
+def clip_dem(dem_path, output_path, window):
+    with rasterio.open(dem_path) as src:
+        profile = src.profile.copy()
+        profile.update({'height': window.height, 'width': window.width, 'transform': src.window_transform(window)})
+        with rasterio.open(output_path, 'w', **profile) as dst:
+            dst.write(src.read(1, window=window), 1)
+
+
+def read_masked(path, bounds=None):
+    """Raster values as float64 (NaN for nodata), optionally only within bounds."""
+    with rasterio.open(path) as src:
+        window = None if bounds is None else from_bounds(*bounds, transform=src.transform).round_offsets().round_lengths()
+        values = src.read(1, window=window).astype('float64')
+        if src.nodata is not None:
+            values[values == src.nodata] = np.nan
+    return values
+
+
+def compare(values, reference):
+    valid = ~np.isnan(values) & ~np.isnan(reference)
+    difference = np.abs(values[valid] - reference[valid])
+    return {'cells': int(valid.sum()), 'fraction_equal': float(np.mean(difference == 0)),
+            'max_abs_difference': float(difference.max()), 'mean_abs_difference': float(difference.mean())}
+
+
+def run_whitebox(dem_path, output_dir):
+    """Filled DEM, D8 pointer (ESRI codes), and flow accumulation (upstream cells) from Whitebox."""
+    import whitebox
+    wbt = whitebox.WhiteboxTools()
+    wbt.verbose = False
+
+    # whitebox does NOT like relative paths
+    dem_path, output_dir = os.path.abspath(dem_path), os.path.abspath(output_dir)
+    paths = {output: os.path.join(output_dir, f'whitebox_{output}.tif') for output in ['filled_dem', 'flow_direction', 'flow_accumulation']}
+    wbt.fill_depressions(dem=dem_path, output=paths['filled_dem'], fix_flats=False)
+    wbt.d8_pointer(dem=paths['filled_dem'], output=paths['flow_direction'], esri_pntr=True)
+    wbt.d8_flow_accumulation(i=paths['flow_direction'], output=paths['flow_accumulation'], out_type='cells', pntr=True, esri_pntr=True)
+
+    results = {output: read_masked(path) for output, path in paths.items()}
+    results['flow_accumulation'] -= 1  # whitebox counts cell itself
+    return results
+
+
+def validate(dem_path, window, output_dir, tile_size=256, workers=None, reference_dir=None, whitebox=True):
+    os.makedirs(output_dir, exist_ok=True)
+    clip_path = os.path.join(output_dir, 'dem_clip.tif')
+    clip_dem(dem_path, clip_path, window)
+
+    tiled = flow_routing(clip_path, os.path.join(output_dir, 'tiled'), tile_size=tile_size, workers=workers)
+    single = flow_routing(clip_path, os.path.join(output_dir, 'single'), tile_size=16 * int(np.ceil(max(window.height, window.width) / 16)), workers=1)
+    results = {'tiled_identical_to_single': {output: bool(np.array_equal(read_masked(tiled[output]), read_masked(single[output]), equal_nan=True))
+                                             for output in tiled}}
+
+    if whitebox:
+        try:
+            reference = run_whitebox(clip_path, output_dir)
+        except ImportError:
+            print('whitebox not installed, skipping comparison with Whitebox...')
+        else:
+            results['whitebox'] = {output: compare(read_masked(tiled[output]), values) for output, values in reference.items()}
+
+    if reference_dir is not None:
+        with rasterio.open(clip_path) as src:
+            bounds = src.bounds
+        results['reference'] = {}
+        for output, name in FLOW_NAMES.items():
+            reference_path = os.path.join(reference_dir, name + '.tif')
+            if os.path.exists(reference_path):
+                results['reference'][output] = compare(read_masked(tiled[output]), read_masked(reference_path, bounds))
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Validate tiled flow routing on a clipped DEM.')
+    parser.add_argument('--dem', default='terrain_features/dem_fps_burned_singlecellfill.tif')
+    parser.add_argument('--window', type=int, nargs=4, metavar=('COL_OFF', 'ROW_OFF', 'WIDTH', 'HEIGHT'), default=[20000, 20000, 2000, 2000])
+    parser.add_argument('--output-dir', default='terrain_features/flow_routing_validation')
+    parser.add_argument('--tile-size', type=int, default=256)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--reference-dir', default='terrain_features/arcgis_pro_original')
+    parser.add_argument('--no-whitebox', action='store_true')
+    parser.add_argument('--output', default=None, help='optional path for json results')
+    args = parser.parse_args()
+
+    results = validate(args.dem, Window(*args.window), args.output_dir, args.tile_size, args.workers, args.reference_dir, not args.no_whitebox)
+
+    print(json.dumps(results, indent=1))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
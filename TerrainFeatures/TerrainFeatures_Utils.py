@@ -0,0 +1,867 @@
+import os
+import sys
+import shutil
+import heapq
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+# numba is optional; flow routing kernels run as (slow) plain python without it
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# instrumentation of utility functions (Instrumentation_Utils.py at the repository root; no-op unless enabled)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Instrumentation_Utils import instrumented, record_counts
+
+
+# default output file names (same names as terrain features calculated in ArcGIS Pro)
+FEATURE_NAMES = {'slope': 'slope_26916',
+                 'aspect': 'aspect_26916',
+                 'profile_curvature': 'profilecurv_26916',
+                 'tangential_curvature': 'tangentialcurv_26916',
+                 'roughness': 'roughnessindex_radius{radius}',
+                 'std_elevation': 'stdelev_radius{radius}'}
+
+# default output file names of flow routing outputs
+FLOW_NAMES = {'filled_dem': 'dem_filled_26916',
+              'flow_direction': 'flowdir_filled_26916',
+              'flow_drop': 'flowdrop_filled_26916',
+              'flow_accumulation': 'flowacc_filled_26916',
+              'twi': 'twi_filled_26916',
+              'spi': 'spi_26916'}
+
+OUTPUT_NODATA = -9999.0
+
+# D8 neighbor offsets in order of ESRI flow direction codes (E, SE, S, SW, W, NW, N, NE); 0 = no downslope neighbor
+D8_ROWS = np.array([0, 1, 1, 1, 0, -1, -1, -1])
+D8_COLS = np.array([1, 1, 0, -1, -1, -1, 0, 1])
+D8_CODES = np.array([1, 2, 4, 8, 16, 32, 64, 128])
+D8_NODATA = 255
+
+# position in D8_CODES of each direction code (-1 for 0 and nodata)
+_D8_INDEX = np.full(256, -1, dtype=np.int64)
+_D8_INDEX[D8_CODES] = np.arange(8)
+
+# distance of unresolved cells in flat resolution
+_FLAT_UNKNOWN = np.iinfo(np.int32).max
+
+
+def read_dem_tile(src, window, halo):
+    """Read DEM window expanded by halo pixels on every side (NaN outside raster and for nodata)."""
+    expanded = Window(window.col_off - halo, window.row_off - halo, window.width + 2 * halo, window.height + 2 * halo)
+    dem = src.read(1, window=expanded, boundless=True, fill_value=np.nan, out_dtype='float64')
+    if src.nodata is not None:
+        dem[dem == src.nodata] = np.nan
+    return dem
+
+
+def neighborhood(dem):
+    """3x3 neighbors z1..z9 (row-major, z5 center) of interior of dem; missing neighbors replaced by center value."""
+    rows, cols = dem.shape
+    z = [dem[i:rows - 2 + i, j:cols - 2 + j] for i in range(3) for j in range(3)]
+    center = z[4]
+    return [np.where(np.isnan(zi), center, zi) for zi in z]
+
+
+def slope_aspect(z, xres, yres, zfactor=1.0):
+    """Slope (degrees) and aspect (compass degrees, -1 for flat) using Horn's method (same as ArcGIS/Whitebox)."""
+    z1, z2, z3, z4, z5, z6, z7, z8, z9 = z
+    dzdx = ((z3 + 2 * z6 + z9) - (z1 + 2 * z4 + z7)) / (8 * xres) * zfactor
+    dzdy = ((z7 + 2 * z8 + z9) - (z1 + 2 * z2 + z3)) / (8 * yres) * zfactor
+
+    slope = np.degrees(np.arctan(np.hypot(dzdx, dzdy)))
+
+    aspect = np.degrees(np.arctan2(dzdy, -dzdx))
+    aspect = np.where(aspect < 0, 90 - aspect, np.where(aspect > 90, 450 - aspect, 90 - aspect))
+    aspect = np.where((dzdx == 0) & (dzdy == 0), -1.0, aspect)
+
+    return slope, aspect
+
+
+def curvatures(z, xres, yres, zfactor=1.0):
+    """Profile and tangential curvature (1/m) from Evans-Young partial derivatives (Florinsky formulas, as in Whitebox)."""
+    z1, z2, z3, z4, z5, z6, z7, z8, z9 = [zi * zfactor for zi in z]
+    p = ((z3 + z6 + z9) - (z1 + z4 + z7)) / (6 * xres)
+    q = ((z1 + z2 + z3) - (z7 + z8 + z9)) / (6 * yres)
+    r = ((z1 + z3 + z4 + z6 + z7 + z9) - 2 * (z2 + z5 + z8)) / (3 * xres ** 2)
+    t = ((z1 + z2 + z3 + z7 + z8 + z9) - 2 * (z4 + z5 + z6)) / (3 * yres ** 2)
+    s = ((z3 + z7) - (z1 + z9)) / (4 * xres * yres)
+
+    gradient = p ** 2 + q ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        profile = np.where(gradient > 0, -(p ** 2 * r + 2 * p * q * s + q ** 2 * t) / (gradient * (1 + gradient) ** 1.5), 0.0)
+        tangential = np.where(gradient > 0, -(q ** 2 * r - 2 * p * q * s + p ** 2 * t) / (gradient * np.sqrt(1 + gradient)), 0.0)
+
+    return profile, tangential
+
+
+def neighborhood_statistics(dem, radius):
+    """Standard deviation of elevation and roughness (root mean square difference from center) in window of radius.
+    
+    Differences from the center cell are summed over shifted slices, so results don't depend on tiling and
+    sums of squares keep their precision. Output shrinks by radius on each side."""
+    rows, cols = dem.shape
+    center = dem[radius:rows - radius, radius:cols - radius]
+    count = np.zeros(center.shape)
+    sums = np.zeros(center.shape)
+    squares = np.zeros(center.shape)
+
+    for i in range(2 * radius + 1):
+        for j in range(2 * radius + 1):
+            difference = dem[i:rows - 2 * radius + i, j:cols - 2 * radius + j] - center
+            valid = ~np.isnan(difference)
+            count += valid
+            sums += np.where(valid, difference, 0.0)
+            squares += np.where(valid, difference ** 2, 0.0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_square = squares / count
+        std = np.sqrt(np.maximum(mean_square - (sums / count) ** 2, 0.0))
+        roughness = np.sqrt(mean_square)
+
+    return std, roughness
+
+
+def compute_tile_features(dem, halo, features, radius, xres, yres, zfactor=1.0):
+    """Calculate all requested features from one DEM tile read with halo pixels (halo >= max(1, radius)).
+    
+    Returns dict of feature name -> array of the tile interior (NaN where DEM is missing)."""
+    rows, cols = dem.shape
+    interior = dem[halo:rows - halo, halo:cols - halo]
+    missing = np.isnan(interior)
+    results = {}
+
+    if {'slope', 'aspect', 'profile_curvature', 'tangential_curvature'} & set(features):
+        # 3x3 stencils only need a 1 pixel halo
+        z = neighborhood(dem[halo - 1:rows - halo + 1, halo - 1:cols - halo + 1])
+        if {'slope', 'aspect'} & set(features):
+            results['slope'], results['aspect'] = slope_aspect(z, xres, yres, zfactor)
+        if {'profile_curvature', 'tangential_curvature'} & set(features):
+            results['profile_curvature'], results['tangential_curvature'] = curvatures(z, xres, yres, zfactor)
+
+    if {'std_elevation', 'roughness'} & set(features):
+        window_dem = dem[halo - radius:rows - halo + radius, halo - radius:cols - halo + radius] * zfactor
+        results['std_elevation'], results['roughness'] = neighborhood_statistics(window_dem, radius)
+
+    return {feature: np.where(missing, np.nan, results[feature]) for feature in features}
+
+
+def _map_tiles(function, jobs, workers=None):
+    """Yield function(*job) for each job (in order of completion) from worker processes, or serially if workers == 1."""
+    if workers == 1:
+        for job in jobs:
+            yield function(*job)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+
+        # keep a bounded number of tiles in flight so finished tiles don't pile up in memory
+        max_pending = 2 * (workers or os.cpu_count())
+        pending = set()
+        for job in jobs:
+            pending.add(executor.submit(function, *job))
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in pending:
+            yield future.result()
+
+
+def _tile_job(dem_path, window, halo, features, radius, zfactor):
+    with rasterio.open(dem_path) as src:
+        dem = read_dem_tile(src, window, halo)
+        xres, yres = src.res
+    return window, compute_tile_features(dem, halo, features, radius, xres, yres, zfactor)
+
+
+@instrumented(key='dem_path')
+def terrain_features(dem_path, output_dir, features=tuple(FEATURE_NAMES), radius=3, zfactor=1.0, tile_size=1024, workers=None, output_names=None):
+    """
+    Function to calculate local-neighborhood terrain features from a DEM in one tiled pass.
+
+    The DEM is read once, tile by tile with a halo sized to the largest neighborhood (radius), and every
+    requested feature is calculated from the same in-memory tile with vectorized stencils. Tiles are
+    processed in parallel worker processes and each output GeoTIFF is written block by block, so no
+    full-raster array is ever held in memory and the DEM does not need to be copied anywhere.
+
+    Features
+    --------
+    slope : degrees (Horn's method).
+    aspect : compass degrees clockwise from north, -1 for flat cells.
+    profile_curvature, tangential_curvature : 1/m (Evans-Young derivatives, Florinsky formulas).
+    std_elevation : standard deviation of elevation in (2*radius+1)^2 window.
+    roughness : root mean square elevation difference from center cell in (2*radius+1)^2 window.
+
+    Parameters
+    ----------
+    dem_path : string
+        Path to DEM in projected coordinates (e.g., UTM meters).
+    output_dir : string
+        Directory for output GeoTIFFs.
+    features : list
+        Features to calculate (keys of FEATURE_NAMES).
+    radius : int
+        Radius (pixels) of std_elevation and roughness windows.
+    zfactor : float
+        Multiplier converting elevation units to horizontal units.
+    tile_size : int
+        Tile size (pixels) for reading, processing, and writing (multiple of 16).
+    workers : int, optional
+        Number of worker processes (1 runs serially).
+    output_names : dict, optional
+        Output file names (without extension) by feature; defaults to FEATURE_NAMES.
+
+    Returns
+    -------
+    dict
+        Paths of output GeoTIFFs by feature.
+
+    """
+    features = list(features)
+    unknown = [feature for feature in features if feature not in FEATURE_NAMES]
+    if unknown:
+        raise ValueError(f'unknown terrain features: {unknown}')
+
+    names = dict(FEATURE_NAMES, **(output_names or {}))
+    halo = max(1, radius)
+    os.makedirs(output_dir, exist_ok=True)
+    output_paths = {feature: os.path.join(output_dir, names[feature].format(radius=radius) + '.tif') for feature in features}
+
+    with rasterio.open(dem_path) as src:
+        profile = src.profile.copy()
+        height, width = src.height, src.width
+    record_counts(pixels=height * width)
+
+    profile.update({'driver': 'GTiff', 'count': 1, 'dtype': 'float32', 'nodata': OUTPUT_NODATA, 'tiled': True,
+                    'blockxsize': tile_size, 'blockysize': tile_size, 'compress': 'deflate', 'BIGTIFF': 'IF_SAFER'})
+
+    windows = [Window(col_off, row_off, min(tile_size, width - col_off), min(tile_size, height - row_off))
+               for row_off in range(0, height, tile_size) for col_off in range(0, width, tile_size)]
+
+    outputs = {feature: rasterio.open(path, 'w', **profile) for feature, path in output_paths.items()}
+
+    def write(window, results):
+        for feature, values in results.items():
+            outputs[feature].write(np.where(np.isnan(values), OUTPUT_NODATA, values).astype('float32'), 1, window=window)
+
+    try:
+        jobs = [(dem_path, window, halo, features, radius, zfactor) for window in windows]
+        for window, results in _map_tiles(_tile_job, jobs, workers):
+            write(window, results)
+    finally:
+        for dst in outputs.values():
+            dst.close()
+
+    return output_paths
+
+
+
+
+##### flow routing (priority-flood fill, D8 flow direction, flow accumulation) in parallel tiles
+# Tiles are processed independently and stitched together through small graphs of tile perimeter cells
+# (Barnes 2016, Parallel priority-flood depression filling; Barnes 2017, Parallel non-divergent flow accumulation).
+
+
+def _compile(kernel):
+    return njit(cache=True)(kernel) if njit is not None else kernel
+
+
+def _flood_tile_kernel(dem):
+    """Priority-flood of one tile (with 1 pixel halo, NaN = nodata) seeded from its perimeter and nodata edges.
+
+    Every seed starts a new label (1, 2, ...). Returns labels and filled elevations of the tile interior, number
+    of labels, and the lowest spill elevation between each pair of touching labels (label 0 = off-map)."""
+    rows, cols = dem.shape
+    labels = np.zeros((rows, cols), dtype=np.int32)
+    filled = dem.copy()
+    heap = [(0.0, 0)]
+    heap.pop()
+    pit = [0]
+    pit.pop()
+    spill = {(0, 0): 0.0}
+    spill.pop((0, 0))
+    n_labels = 0
+
+    for r in range(1, rows - 1):
+        for c in range(1, cols - 1):
+            if np.isnan(dem[r, c]):
+                continue
+            off_map = False
+            for k in range(8):
+                if np.isnan(dem[r + D8_ROWS[k], c + D8_COLS[k]]):
+                    off_map = True
+            if off_map or r == 1 or r == rows - 2 or c == 1 or c == cols - 2:
+                n_labels += 1
+                labels[r, c] = n_labels
+                heapq.heappush(heap, (dem[r, c], r * cols + c))
+                if off_map:
+                    spill[(0, n_labels)] = -np.inf
+
+    # cells raised to the level of a depression skip the priority queue (Barnes et al. 2014)
+    while len(heap) > 0 or len(pit) > 0:
+        if len(pit) > 0:
+            index = pit.pop()
+            z = filled[index // cols, index % cols]
+        else:
+            z, index = heapq.heappop(heap)
+        r = index // cols
+        c = index % cols
+        label = labels[r, c]
+        for k in range(8):
+            rn = r + D8_ROWS[k]
+            cn = c + D8_COLS[k]
+            if rn < 1 or rn > rows - 2 or cn < 1 or cn > cols - 2 or np.isnan(dem[rn, cn]):
+                continue
+            if labels[rn, cn] == 0:
+                labels[rn, cn] = label
+                if dem[rn, cn] <= z:
+                    filled[rn, cn] = z
+                    pit.append(rn * cols + cn)
+                else:
+                    heapq.heappush(heap, (filled[rn, cn], rn * cols + cn))
+            elif labels[rn, cn] != label:
+                key = (min(label, labels[rn, cn]), max(label, labels[rn, cn]))
+                elevation = max(z, filled[rn, cn])
+                if key not in spill or elevation < spill[key]:
+                    spill[key] = elevation
+
+    edge_a = np.empty(len(spill), dtype=np.int64)
+    edge_b = np.empty(len(spill), dtype=np.int64)
+    edge_z = np.empty(len(spill), dtype=np.float64)
+    i = 0
+    for key, elevation in spill.items():
+        edge_a[i], edge_b[i] = key
+        edge_z[i] = elevation
+        i += 1
+
+    return labels[1:-1, 1:-1].copy(), filled[1:-1, 1:-1].copy(), n_labels, edge_a, edge_b, edge_z
+
+
+def _spill_kernel(indptr, indices, weights, source):
+    """Lowest elevation at which each node of a graph (CSR arrays, edge weights = spill elevations) drains to source."""
+    spill = np.full(len(indptr) - 1, np.inf)
+    done = np.zeros(len(indptr) - 1, dtype=np.bool_)
+    spill[source] = -np.inf
+    heap = [(-np.inf, source)]
+
+    while len(heap) > 0:
+        z, node = heapq.heappop(heap)
+        if done[node]:
+            continue
+        done[node] = True
+        for e in range(indptr[node], indptr[node + 1]):
+            elevation = max(z, weights[e])
+            if elevation < spill[indices[e]]:
+                spill[indices[e]] = elevation
+                heapq.heappush(heap, (elevation, indices[e]))
+
+    return spill
+
+
+def _flat_distance_kernel(filled, distance, resume):
+    """Steps to the nearest cell with a lower (or off-map) neighbor through cells of equal elevation.
+
+    Both arrays include a 1 pixel halo; halo distances (from neighboring tiles) seed the search. With resume,
+    interior distances are from a previous sweep and only cells next to the halo are searched from again."""
+    rows, cols = filled.shape
+    result = distance.copy() if resume else np.full((rows, cols), _FLAT_UNKNOWN, dtype=np.int32)
+    heap = [(0, 0)]
+    heap.pop()
+
+    for r in range(1, rows - 1):
+        for c in range(1, cols - 1):
+            if resume and r != 1 and r != rows - 2 and c != 1 and c != cols - 2:
+                continue
+            z = filled[r, c]
+            if np.isnan(z):
+                continue
+            # only outlets next to cells of equal elevation start a search
+            outlet = False
+            equal = False
+            best = _FLAT_UNKNOWN
+            for k in range(8):
+                rn = r + D8_ROWS[k]
+                cn = c + D8_COLS[k]
+                zn = filled[rn, cn]
+                if np.isnan(zn) or zn < z:
+                    outlet = True
+                elif zn == z:
+                    equal = True
+                    halo = rn == 0 or rn == rows - 1 or cn == 0 or cn == cols - 1
+                    if halo and distance[rn, cn] < _FLAT_UNKNOWN and distance[rn, cn] + 1 < best:
+                        best = distance[rn, cn] + 1
+            if outlet:
+                result[r, c] = 0
+                if equal and not resume:
+                    heapq.heappush(heap, (0, r * cols + c))
+            elif best < result[r, c]:
+                result[r, c] = best
+                heapq.heappush(heap, (best, r * cols + c))
+
+    while len(heap) > 0:
+        d, index = heapq.heappop(heap)
+        r = index // cols
+        c = index % cols
+        if d > result[r, c]:
+            continue
+        for k in range(8):
+            rn = r + D8_ROWS[k]
+            cn = c + D8_COLS[k]
+            if rn < 1 or rn > rows - 2 or cn < 1 or cn > cols - 2 or filled[rn, cn] != filled[r, c]:
+                continue
+            if d + 1 < result[rn, cn]:
+                result[rn, cn] = d + 1
+                heapq.heappush(heap, (d + 1, rn * cols + cn))
+
+    return result[1:-1, 1:-1].copy()
+
+
+def _d8_kernel(filled, distance, xres, yres):
+    """D8 flow direction (ESRI codes) and drop (percent) from filled DEM and flat distances (both with 1 pixel halo).
+
+    Cells drain to their steepest downslope neighbor; cells on flats drain one step closer to the flat outlet."""
+    rows, cols = filled.shape
+    codes = np.full((rows - 2, cols - 2), D8_NODATA, dtype=np.uint8)
+    drop = np.full((rows - 2, cols - 2), np.nan)
+    diagonal = np.sqrt(xres ** 2 + yres ** 2)
+
+    for r in range(1, rows - 1):
+        for c in range(1, cols - 1):
+            z = filled[r, c]
+            if np.isnan(z):
+                continue
+            code = 0
+            steepest = 0.0
+            for k in range(8):
+                zn = filled[r + D8_ROWS[k], c + D8_COLS[k]]
+                if np.isnan(zn):
+                    continue
+                length = diagonal if D8_ROWS[k] != 0 and D8_COLS[k] != 0 else (xres if D8_ROWS[k] == 0 else yres)
+                if (z - zn) / length > steepest:
+                    steepest = (z - zn) / length
+                    code = D8_CODES[k]
+            if code == 0 and distance[r, c] > 0 and distance[r, c] < _FLAT_UNKNOWN:
+                for k in range(8):
+                    rn = r + D8_ROWS[k]
+                    cn = c + D8_COLS[k]
+                    if filled[rn, cn] == z and distance[rn, cn] == distance[r, c] - 1:
+                        code = D8_CODES[k]
+                        break
+            codes[r - 1, c - 1] = code
+            drop[r - 1, c - 1] = 100 * steepest
+
+    return codes, drop
+
+
+def _accumulate_kernel(codes, weights):
+    """Sum of weights of each cell and all cells draining to it within the tile."""
+    rows, cols = codes.shape
+    accumulation = weights.copy()
+    inflow = np.zeros((rows, cols), dtype=np.int32)
+
+    for r in range(rows):
+        for c in range(cols):
+            k = _D8_INDEX[codes[r, c]]
+            if k >= 0 and 0 <= r + D8_ROWS[k] < rows and 0 <= c + D8_COLS[k] < cols:
+                inflow[r + D8_ROWS[k], c + D8_COLS[k]] += 1
+
+    stack = [0]
+    stack.pop()
+    for r in range(rows):
+        for c in range(cols):
+            if codes[r, c] != D8_NODATA and inflow[r, c] == 0:
+                stack.append(r * cols + c)
+
+    while len(stack) > 0:
+        index = stack.pop()
+        r = index // cols
+        c = index % cols
+        k = _D8_INDEX[codes[r, c]]
+        if k < 0:
+            continue
+        rn = r + D8_ROWS[k]
+        cn = c + D8_COLS[k]
+        if 0 <= rn < rows and 0 <= cn < cols:
+            accumulation[rn, cn] += accumulation[r, c]
+            inflow[rn, cn] -= 1
+            if inflow[rn, cn] == 0:
+                stack.append(rn * cols + cn)
+
+    return accumulation
+
+
+def _perimeter_targets_kernel(codes, perimeter_rows, perimeter_cols):
+    """Follow flow from each perimeter cell to the next perimeter cell of the tile (kind 1) or the first cell outside 
+    the tile (kind 2); kind 0 if flow ends inside the tile. Returns target rows, columns (tile coordinates), and kind."""
+    rows, cols = codes.shape
+    n = len(perimeter_rows)
+    target_rows = np.zeros(n, dtype=np.int64)
+    target_cols = np.zeros(n, dtype=np.int64)
+    kind = np.zeros(n, dtype=np.int8)
+
+    for i in range(n):
+        r = perimeter_rows[i]
+        c = perimeter_cols[i]
+        while True:
+            k = _D8_INDEX[codes[r, c]]
+            if k < 0:
+                break
+            r = r + D8_ROWS[k]
+            c = c + D8_COLS[k]
+            if r < 0 or r >= rows or c < 0 or c >= cols:
+                kind[i] = 2
+                break
+            if r == 0 or r == rows - 1 or c == 0 or c == cols - 1:
+                kind[i] = 1
+                break
+        target_rows[i] = r
+        target_cols[i] = c
+
+    return target_rows, target_cols, kind
+
+
+def _perimeter_inflow_kernel(target, cross, local):
+    """Inflow from neighboring tiles into each perimeter cell, solved over the forest of perimeter cells.
+
+    target is the index of the downstream perimeter cell (-1 for none), cross flags targets in another tile, and 
+    local is accumulation from within each cell's own tile."""
+    n = len(target)
+    upstream = np.zeros(n)
+    inflow = np.zeros(n)
+    count = np.zeros(n, dtype=np.int64)
+    for i in range(n):
+        if target[i] >= 0:
+            count[target[i]] += 1
+
+    stack = [0]
+    stack.pop()
+    for i in range(n):
+        if count[i] == 0:
+            stack.append(i)
+
+    while len(stack) > 0:
+        i = stack.pop()
+        j = target[i]
+        if j < 0:
+            continue
+        if cross[i]:
+            inflow[j] += local[i] + upstream[i]
+            upstream[j] += local[i] + upstream[i]
+        else:
+            upstream[j] += upstream[i]
+        count[j] -= 1
+        if count[j] == 0:
+            stack.append(j)
+
+    return inflow
+
+
+_flood_tile = _compile(_flood_tile_kernel)
+_spill = _compile(_spill_kernel)
+_flat_distance = _compile(_flat_distance_kernel)
+_d8 = _compile(_d8_kernel)
+_accumulate = _compile(_accumulate_kernel)
+_perimeter_targets = _compile(_perimeter_targets_kernel)
+_perimeter_inflow = _compile(_perimeter_inflow_kernel)
+
+
+def _perimeter(rows, cols):
+    """Row and column indices of perimeter cells of a rows x cols tile."""
+    mask = np.zeros((rows, cols), dtype=bool)
+    mask[[0, -1], :] = True
+    mask[:, [0, -1]] = True
+    return np.nonzero(mask)
+
+
+def _distance_halo(paths, rows, cols):
+    """Flat distances of a tile with 1 pixel halo, assembled from the saved tiles around it ({(di, dj): path})."""
+    distance = np.full((rows + 2, cols + 2), _FLAT_UNKNOWN, dtype=np.int32)
+    parts = {-1: (slice(0, 1), slice(-1, None)), 0: (slice(1, -1), slice(None)), 1: (slice(-1, None), slice(0, 1))}
+    for (di, dj), path in paths.items():
+        if path is not None:
+            tile = np.load(path, mmap_mode='r')
+            distance[parts[di][0], parts[dj][0]] = tile[parts[di][1], parts[dj][1]]
+    return distance
+
+
+def _fill_tile_job(dem_path, work_dir, tile, window):
+    with rasterio.open(dem_path) as src:
+        dem = read_dem_tile(src, window, 1)
+        width = src.width
+
+    labels, filled, n_labels, edge_a, edge_b, edge_z = _flood_tile(dem)
+    np.save(os.path.join(work_dir, 'labels_{}_{}.npy'.format(*tile)), labels)
+    np.save(os.path.join(work_dir, 'filled_{}_{}.npy'.format(*tile)), filled)
+
+    # perimeter cells (labeled seeds with unchanged elevations) and their valid neighbors in other tiles
+    rows, cols = labels.shape
+    r, c = _perimeter(rows, cols)
+    r, c = r[labels[r, c] > 0], c[labels[r, c] > 0]
+    perimeter = ((window.row_off + r) * width + window.col_off + c, labels[r, c])
+
+    cross = []
+    for dr, dc in zip(D8_ROWS, D8_COLS):
+        outside = (r + dr < 0) | (r + dr >= rows) | (c + dc < 0) | (c + dc >= cols)
+        rn, cn = r[outside] + dr, c[outside] + dc
+        valid = ~np.isnan(dem[rn + 1, cn + 1])
+        cross.append((labels[r[outside], c[outside]][valid], 
+                      (window.row_off + rn[valid]) * width + window.col_off + cn[valid],
+                      np.maximum(dem[r[outside] + 1, c[outside] + 1][valid], dem[rn[valid] + 1, cn[valid] + 1])))
+    cross = tuple(np.concatenate(part) for part in zip(*cross))
+
+    return tile, n_labels, (edge_a, edge_b, edge_z), perimeter, cross
+
+
+def _raise_tile_job(work_dir, tile, window, spill):
+    labels = np.load(os.path.join(work_dir, 'labels_{}_{}.npy'.format(*tile)))
+    filled = np.load(os.path.join(work_dir, 'filled_{}_{}.npy'.format(*tile)))
+    os.remove(os.path.join(work_dir, 'labels_{}_{}.npy'.format(*tile)))
+    os.remove(os.path.join(work_dir, 'filled_{}_{}.npy'.format(*tile)))
+    filled[labels > 0] = np.maximum(filled[labels > 0], spill[labels[labels > 0] - 1])
+    return window, filled
+
+
+def _flat_tile_job(filled_path, work_dir, tile, window, sweep, paths):
+    # filled DEM tile with halo is kept for later sweeps and flow directions
+    halo_path = os.path.join(work_dir, 'halo_{}_{}.npy'.format(*tile))
+    if sweep == 0:
+        with rasterio.open(filled_path) as src:
+            filled = read_dem_tile(src, window, 1)
+        np.save(halo_path, filled)
+    else:
+        filled = np.load(halo_path)
+
+    distance = _flat_distance(filled, _distance_halo(paths, window.height, window.width), paths[(0, 0)] is not None)
+    path = os.path.join(work_dir, 'flats_{}_{}_{}.npy'.format(sweep, *tile))
+    np.save(path, distance)
+
+    # neighbors only need to rerun if the distances they see in their halo changed
+    changed = distance != (np.load(paths[(0, 0)]) if paths[(0, 0)] is not None else _FLAT_UNKNOWN)
+    sides = {-1: slice(0, 1), 0: slice(None), 1: slice(-1, None)}
+    changed_sides = {(di, dj) for di in sides for dj in sides if (di, dj) != (0, 0) and changed[sides[di], sides[dj]].any()}
+    r, c = _perimeter(window.height, window.width)
+    flat_perimeter = bool(np.any(distance[r, c] != 0))
+
+    return tile, path, changed_sides, flat_perimeter
+
+
+def _direction_tile_job(work_dir, tile, window, paths, xres, yres):
+    filled = np.load(os.path.join(work_dir, 'halo_{}_{}.npy'.format(*tile)))
+    return window, _d8(filled, _distance_halo(paths, window.height, window.width), xres, yres)
+
+
+def _accumulation_tile_job(direction_path, tile, window, width):
+    with rasterio.open(direction_path) as src:
+        codes = src.read(1, window=window)
+
+    local = _accumulate(codes, (codes != D8_NODATA).astype('float64'))
+
+    r, c = _perimeter(*codes.shape)
+    r, c = r[codes[r, c] != D8_NODATA], c[codes[r, c] != D8_NODATA]
+    target_rows, target_cols, kind = _perimeter_targets(codes, r, c)
+    target = np.where(kind > 0, (window.row_off + target_rows) * width + window.col_off + target_cols, -1)
+
+    return tile, (window.row_off + r) * width + window.col_off + c, local[r, c], target, kind == 2
+
+
+def _final_tile_job(direction_path, filled_path, window, inflow_index, inflow, width, min_tan_slope):
+    with rasterio.open(direction_path) as src:
+        codes = src.read(1, window=window)
+    with rasterio.open(filled_path) as src:
+        filled = read_dem_tile(src, window, 1)
+        xres, yres = src.res
+
+    # cells draining in from other tiles enter as extra weight on the perimeter cells they flow into
+    weights = (codes != D8_NODATA).astype('float64')
+    r, c = inflow_index // width - window.row_off, inflow_index % width - window.col_off
+    weights[r, c] += inflow
+    accumulation = np.where(codes != D8_NODATA, _accumulate(codes, weights) - 1, np.nan)
+
+    # specific catchment area (contributing area per unit contour width) and local slope of filled DEM
+    slope, _ = slope_aspect(neighborhood(filled), xres, yres)
+    tan_slope = np.maximum(np.tan(np.radians(slope)), min_tan_slope)
+    area = (accumulation + 1) * np.sqrt(xres * yres)
+
+    return window, {'flow_accumulation': accumulation, 'twi': np.log(area / tan_slope), 'spi': area * tan_slope}
+
+
+@instrumented(key='dem_path')
+def flow_routing(dem_path, output_dir, tile_size=1024, workers=None, min_tan_slope=0.001, output_names=None, work_dir=None):
+    """
+    Function to fill depressions, route flow (D8), and calculate flow accumulation, TWI, and SPI in parallel tiles.
+
+    The DEM is never held in memory as a whole. Each pass works on independent tiles in worker processes, and
+    the steps that need information from the whole DEM are resolved on small graphs of tile perimeter cells:
+
+    1. Priority-flood fill of each tile from its perimeter; the spill elevation of every perimeter-seeded 
+       region is then solved on the graph of regions, and each tile is raised to its spill elevations.
+    2. Flats are resolved toward their outlets with distances passed between neighboring tiles until stable.
+    3. D8 flow direction (ESRI codes) and drop (percent) from the filled DEM.
+    4. Flow accumulation within each tile; inflow between tiles is solved on the forest of perimeter cells,
+       and each tile is accumulated again with that inflow.
+
+    Results are identical for any tile size.
+
+    Outputs
+    -------
+    filled_dem : depression-filled DEM.
+    flow_direction : D8 flow direction (1=E, 2=SE, 4=S, 8=SW, 16=W, 32=NW, 64=N, 128=NE, 0=none).
+    flow_drop : percent drop to downstream cell.
+    flow_accumulation : number of upstream cells (excluding cell itself, as ArcGIS).
+    twi : topographic wetness index, ln(a / tan(slope)).
+    spi : stream power index, a * tan(slope).
+    where a is the specific catchment area, (flow_accumulation + 1) * cell size.
+
+    Parameters
+    ----------
+    dem_path : string
+        Path to DEM in projected coordinates (e.g., smoothed and stream-burned DEM).
+    output_dir : string
+        Directory for output GeoTIFFs.
+    tile_size : int
+        Tile size (pixels) for processing and writing (multiple of 16).
+    workers : int, optional
+        Number of worker processes (1 runs serially).
+    min_tan_slope : float
+        Lower limit of tan(slope) in TWI and SPI (avoids division by zero on flats).
+    output_names : dict, optional
+        Output file names (without extension) by output; defaults to FLOW_NAMES.
+    work_dir : string, optional
+        Directory for intermediate tile files (temporary directory in output_dir by default, removed when done).
+
+    Returns
+    -------
+    dict
+        Paths of output GeoTIFFs by output.
+
+    """
+    names = dict(FLOW_NAMES, **(output_names or {}))
+    os.makedirs(output_dir, exist_ok=True)
+    output_paths = {output: os.path.join(output_dir, name + '.tif') for output, name in names.items()}
+    temporary = work_dir is None
+    work_dir = tempfile.mkdtemp(dir=output_dir) if temporary else work_dir
+    os.makedirs(work_dir, exist_ok=True)
+
+    with rasterio.open(dem_path) as src:
+        profile = src.profile.copy()
+        height, width = src.height, src.width
+        xres, yres = src.res
+    record_counts(pixels=height * width)
+
+    profile.update({'driver': 'GTiff', 'count': 1, 'dtype': 'float32', 'nodata': OUTPUT_NODATA, 'tiled': True,
+                    'blockxsize': tile_size, 'blockysize': tile_size, 'compress': 'deflate', 'BIGTIFF': 'IF_SAFER'})
+
+    tiles = {(i, j): Window(col_off, row_off, min(tile_size, width - col_off), min(tile_size, height - row_off))
+             for i, row_off in enumerate(range(0, height, tile_size)) for j, col_off in enumerate(range(0, width, tile_size))}
+
+    def neighbors(tile):
+        return [(tile[0] + di, tile[1] + dj) for di in (-1, 0, 1) for dj in (-1, 0, 1) if (tile[0] + di, tile[1] + dj) in tiles]
+
+    try:
+        ##### 1. depression filling
+        results = {tile: result for tile, *result in 
+                   _map_tiles(_fill_tile_job, [(dem_path, work_dir, tile, window) for tile, window in tiles.items()], workers)}
+
+        # graph nodes are labels of all tiles (offset per tile) plus off-map node
+        offsets = dict(zip(tiles, np.cumsum([0] + [results[tile][0] for tile in tiles])))
+        off_map = sum(results[tile][0] for tile in tiles)
+
+        perimeter_index = np.concatenate([results[tile][2][0] for tile in tiles])
+        perimeter_node = np.concatenate([results[tile][2][1] + offsets[tile] - 1 for tile in tiles])
+        order = np.argsort(perimeter_index)
+        perimeter_index, perimeter_node = perimeter_index[order], perimeter_node[order]
+
+        edges = []
+        for tile in tiles:
+            (edge_a, edge_b, edge_z), _, (cross_label, cross_index, cross_z) = results[tile][1:]
+            edges.append((np.where(edge_a > 0, edge_a + offsets[tile] - 1, off_map), edge_b + offsets[tile] - 1, edge_z))
+            edges.append((cross_label + offsets[tile] - 1, perimeter_node[np.searchsorted(perimeter_index, cross_index)], cross_z))
+        edge_a, edge_b, edge_z = (np.concatenate(part) for part in zip(*edges))
+        n_labels = {tile: results[tile][0] for tile in tiles}
+        del results, edges
+
+        # both directions of each edge in CSR order
+        source, target, weight = np.concatenate([edge_a, edge_b]), np.concatenate([edge_b, edge_a]), np.concatenate([edge_z, edge_z])
+        order = np.argsort(source, kind='stable')
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(source, minlength=off_map + 1))])
+        spill = _spill(indptr, target[order], weight[order], off_map)
+        spill[~np.isfinite(spill)] = -np.inf
+
+        jobs = [(work_dir, tile, window, spill[offsets[tile]:offsets[tile] + n_labels[tile]]) for tile, window in tiles.items()]
+        with rasterio.open(output_paths['filled_dem'], 'w', **profile) as dst:
+            for window, filled in _map_tiles(_raise_tile_job, jobs, workers):
+                dst.write(np.where(np.isnan(filled), OUTPUT_NODATA, filled).astype('float32'), 1, window=window)
+        del spill
+
+        ##### 2. flat resolution
+        # sweeps rerun only tiles next to tiles whose perimeter distances changed (and that have flats on their perimeter)
+        latest = dict.fromkeys(tiles)
+        flat_perimeter = {}
+        pending, sweep = set(tiles), 0
+
+        def distance_paths(tile):
+            return {(other[0] - tile[0], other[1] - tile[1]): latest[other] for other in neighbors(tile)}
+
+        while pending:
+            jobs = [(output_paths['filled_dem'], work_dir, tile, tiles[tile], sweep, distance_paths(tile)) for tile in sorted(pending)]
+            updated, changed = {}, set()
+            for tile, path, changed_sides, flat_perimeter[tile] in _map_tiles(_flat_tile_job, jobs, workers):
+                updated[tile] = path
+                changed.update((tile[0] + di, tile[1] + dj) for di, dj in changed_sides)
+            for tile, path in updated.items():
+                if latest[tile] is not None:
+                    os.remove(latest[tile])
+                latest[tile] = path
+            pending = {tile for tile in changed if tile in tiles and flat_perimeter[tile]}
+            sweep += 1
+
+        ##### 3. flow direction and drop
+        jobs = [(work_dir, tile, window, distance_paths(tile), xres, yres) for tile, window in tiles.items()]
+        with rasterio.open(output_paths['flow_direction'], 'w', **dict(profile, dtype='uint8', nodata=D8_NODATA)) as directions, \
+             rasterio.open(output_paths['flow_drop'], 'w', **profile) as drops:
+            for window, (codes, drop) in _map_tiles(_direction_tile_job, jobs, workers):
+                directions.write(codes, 1, window=window)
+                drops.write(np.where(np.isnan(drop), OUTPUT_NODATA, drop).astype('float32'), 1, window=window)
+
+        ##### 4. flow accumulation
+        jobs = [(output_paths['flow_direction'], tile, window, width) for tile, window in tiles.items()]
+        results = {tile: result for tile, *result in _map_tiles(_accumulation_tile_job, jobs, workers)}
+
+        tile_order = list(tiles)
+        tile_ids = np.concatenate([np.full(len(results[tile][0]), k) for k, tile in enumerate(tile_order)])
+        perimeter_index, local, target, cross = (np.concatenate(part) for part in zip(*(results[tile] for tile in tile_order)))
+        del results
+
+        order = np.argsort(perimeter_index)
+        tile_ids, perimeter_index, local, target, cross = tile_ids[order], perimeter_index[order], local[order], target[order], cross[order]
+        target = np.where(target >= 0, np.searchsorted(perimeter_index, target), -1)
+        inflow = _perimeter_inflow(target, cross, local)
+
+        # inflow of each tile's perimeter cells (only those receiving flow from other tiles)
+        receiving = np.nonzero(inflow > 0)[0]
+        receiving = receiving[np.argsort(tile_ids[receiving], kind='stable')]
+        splits = np.searchsorted(tile_ids[receiving], np.arange(len(tile_order) + 1))
+        jobs = [(output_paths['flow_direction'], output_paths['filled_dem'], tiles[tile], 
+                 perimeter_index[receiving[splits[k]:splits[k + 1]]], inflow[receiving[splits[k]:splits[k + 1]]], width, min_tan_slope)
+                for k, tile in enumerate(tile_order)]
+
+        outputs = {output: rasterio.open(output_paths[output], 'w', **profile) for output in ['flow_accumulation', 'twi', 'spi']}
+        try:
+            for window, values in _map_tiles(_final_tile_job, jobs, workers):
+                for output, value in values.items():
+                    outputs[output].write(np.where(np.isnan(value), OUTPUT_NODATA, value).astype('float32'), 1, window=window)
+        finally:
+            for dst in outputs.values():
+                dst.close()
+
+    finally:
+        if temporary:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return output_paths
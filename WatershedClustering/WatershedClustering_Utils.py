@@ -1,6 +1,32 @@
+import os
+import sys
+import json
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
 import geopandas as gpd
+import rasterio
+from rasterio import features
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window, from_bounds
+from shapely.geometry import box
 from rasterstats import zonal_stats
+from sklearn.cluster import KMeans, MiniBatchKMeans, DBSCAN, HDBSCAN
+from sklearn.decomposition import PCA, IncrementalPCA
+from sklearn.metrics import silhouette_score
+from sklearn.model_selection import ParameterGrid
 
+# instrumentation of utility functions (Instrumentation_Utils.py at the repository root; no-op unless enabled)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Instrumentation_Utils import instrumented, record_counts
+
+
+@instrumented(key='raster_path')
 def zonal_statistics_to_csv(polygon_path, raster_path, statistics, output_name, index_col=None, drop_cols=None):
     
     gdf = gpd.read_file(polygon_path)
@@ -16,4 +42,1096 @@ def zonal_statistics_to_csv(polygon_path, raster_path, statistics, output_name,
     if drop_cols != None:
         gdf.drop(columns=drop_cols, inplace=True)
 
-    gdf.to_csv(output_name)
\ No newline at end of file
+    gdf.to_csv(output_name)
+    record_counts(rows=len(gdf))
+
+
+
+def _block_windows(height, width, block_size):
+    for row_off in range(0, height, block_size):
+        for col_off in range(0, width, block_size):
+            yield Window(col_off, row_off, min(block_size, width - col_off), min(block_size, height - row_off))
+
+
+
+@instrumented(key='polygon_path')
+def rasterize_zones(polygon_path, reference_raster, cache_dir='zone_cache', index_col=None, all_touched=True, block_size=1024):
+    """
+    Function to rasterize zone polygons once into a label grid aligned to a reference raster (e.g., the DEM).
+
+    Each pixel is labelled with the zone containing its center (1..n, 0 = no zone). Because all_touched
+    pixels on shared boundaries belong to more than one zone (as in rasterstats), boundary pixels touched
+    by a zone but labelled with another are stored separately as (pixel, zone) pairs. Results are cached
+    in cache_dir keyed on the polygon file, the reference grid, and the rasterization options.
+
+    Parameters
+    ----------
+    polygon_path : string
+        Path to polygon shapefile defining zones (same CRS as reference raster).
+    reference_raster : string
+        Path to raster defining the grid (shape and transform) of all rasters used with the zones.
+    cache_dir : string
+        Directory for cached label grid (.tif) and zone information (.npz).
+    index_col : string, optional
+        Column of zone ids; polygon index is used if None.
+    all_touched : bool
+        Include every pixel touched by a zone (rasterstats all_touched).
+    block_size : int
+        Block size (pixels) for writing the label grid.
+
+    Returns
+    -------
+    dict
+        'labels_path' and 'zones_path' of cached files.
+
+    """
+    with rasterio.open(reference_raster) as ref:
+        height, width, transform, crs = ref.height, ref.width, ref.transform, ref.crs
+
+    # cache key from polygon file, reference grid, and options
+    stat = os.stat(polygon_path)
+    key_source = json.dumps([os.path.abspath(polygon_path), stat.st_size, stat.st_mtime_ns, height, width,
+                             list(transform)[:6], str(crs), index_col, all_touched])
+    key = hashlib.sha1(key_source.encode()).hexdigest()[:16]
+
+    os.makedirs(cache_dir, exist_ok=True)
+    labels_path = os.path.join(cache_dir, f'zones_{key}.tif')
+    zones_path = os.path.join(cache_dir, f'zones_{key}.npz')
+    zones = {'labels_path': labels_path, 'zones_path': zones_path}
+
+    if os.path.exists(labels_path) and os.path.exists(zones_path):
+        return zones
+
+    gdf = gpd.read_file(polygon_path)
+    if index_col is not None:
+        gdf.set_index(index_col, drop=True, inplace=True)
+
+    geometries = gdf.geometry.values
+    tree = gdf.sindex
+
+    profile = {'driver': 'GTiff', 'height': height, 'width': width, 'count': 1, 'dtype': 'int32', 'crs': crs,
+               'transform': transform, 'nodata': 0, 'tiled': True, 'blockxsize': block_size,
+               'blockysize': block_size, 'compress': 'deflate', 'BIGTIFF': 'IF_SAFER'}
+
+    # label grid (pixel centers), block by block using only polygons intersecting each block
+    with rasterio.open(labels_path + '.part.tif', 'w', **profile) as dst:
+        for window in _block_windows(height, width, block_size):
+            window_transform = rasterio.windows.transform(window, transform)
+            candidates = tree.query(box(*rasterio.windows.bounds(window, transform)))
+            labels = np.zeros((window.height, window.width), dtype='int32')
+            if len(candidates):
+                labels = features.rasterize([(geometries[i], i + 1) for i in candidates], out=labels,
+                                            transform=window_transform, all_touched=False)
+            dst.write(labels, 1, window=window)
+
+    # boundary pixels touched by a zone but labelled with a different zone (or none)
+    extra_index = []
+    extra_zone = []
+
+    if all_touched:
+        with rasterio.open(labels_path + '.part.tif') as src:
+            for i, geometry in enumerate(geometries):
+                bounds_window = from_bounds(*geometry.bounds, transform=transform)
+                row_off, col_off = int(np.floor(bounds_window.row_off)), int(np.floor(bounds_window.col_off))
+                window = Window(col_off, row_off, int(np.ceil(bounds_window.col_off + bounds_window.width)) - col_off,
+                                int(np.ceil(bounds_window.row_off + bounds_window.height)) - row_off)
+                window = window.intersection(Window(0, 0, width, height))
+                touched = features.rasterize([(geometry, 1)], out_shape=(window.height, window.width),
+                                             transform=rasterio.windows.transform(window, transform),
+                                             all_touched=True, dtype='uint8').astype(bool)
+                rows, cols = np.nonzero(touched & (src.read(1, window=window) != i + 1))
+                extra_index.append((rows + window.row_off).astype(np.int64) * width + (cols + window.col_off))
+                extra_zone.append(np.full(len(rows), i, dtype=np.int32))
+
+    np.savez(zones_path,
+             zone_ids=np.asarray(gdf.index.astype(str), dtype=str),
+             extra_index=np.concatenate(extra_index) if extra_index else np.empty(0, dtype=np.int64),
+             extra_zone=np.concatenate(extra_zone) if extra_zone else np.empty(0, dtype=np.int32))
+
+    os.replace(labels_path + '.part.tif', labels_path)
+
+    return zones
+
+
+
+def _merge_value_counts(zone, value, count):
+    """Combine (zone, value, count) triples with same zone and value; output sorted by zone then value."""
+    order = np.lexsort((value, zone))
+    zone, value, count = zone[order], value[order], count[order]
+    new = np.ones(len(zone), dtype=bool)
+    new[1:] = (zone[1:] != zone[:-1]) | (value[1:] != value[:-1])
+    starts = np.flatnonzero(new)
+    return zone[starts], value[starts], np.add.reduceat(count, starts) if len(starts) else count[:0]
+
+
+
+def _value_count_statistics(zone, value, count, n_zones, statistics):
+    """Percentiles, median, majority, minority, and unique from merged per-zone value counts."""
+    results = {}
+    zone_counts = np.bincount(zone, weights=count, minlength=n_zones).astype(np.int64)
+    starts = np.searchsorted(zone, np.arange(n_zones))
+    has_data = zone_counts > 0
+    cumulative = np.cumsum(count)
+    base = np.concatenate([[0], cumulative])[starts]
+
+    def value_at_rank(rank):
+        index = np.searchsorted(cumulative, base + rank, side='right')
+        return value[np.minimum(index, len(value) - 1)] if len(value) else np.full(n_zones, np.nan)
+
+    for stat in statistics:
+        if stat == 'median' or stat.startswith('percentile_'):
+            q = 50.0 if stat == 'median' else float(stat.split('_')[1])
+            position = q / 100 * np.maximum(zone_counts - 1, 0)
+            lower = np.floor(position).astype(np.int64)
+            upper = np.minimum(lower + 1, np.maximum(zone_counts - 1, 0))
+            lower_value = value_at_rank(lower)
+            upper_value = value_at_rank(upper)
+            results[stat] = np.where(has_data, lower_value + (upper_value - lower_value) * (position - lower), np.nan)
+
+        elif stat in ('majority', 'minority'):
+            # ties go to smallest value (first in sorted order), same as rasterstats
+            reduce = np.maximum if stat == 'majority' else np.minimum
+            extreme = np.full(n_zones, 0 if stat == 'majority' else np.iinfo(np.int64).max, dtype=np.int64)
+            reduce.at(extreme, zone, count)
+            candidates = np.flatnonzero(count == extreme[zone])
+            first_zone, first = np.unique(zone[candidates], return_index=True)
+            out = np.full(n_zones, np.nan)
+            out[first_zone] = value[candidates[first]]
+            results[stat] = out
+
+        elif stat == 'unique':
+            results[stat] = np.bincount(zone, minlength=n_zones).astype(float)
+
+    return results
+
+
+
+def sketch_values(values, relative_error=0.001, min_magnitude=1e-6):
+    """
+    Function to snap values to log-spaced histogram bins with a relative error bound (DDSketch-style bins).
+
+    Each value is replaced by the representative of its bin, which is within relative_error of the value;
+    magnitudes below min_magnitude are snapped to 0. The number of distinct bins depends only on the range
+    of magnitudes and relative_error, not on the number of values.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        Values to snap.
+    relative_error : float
+        Relative error bound of bin representatives.
+    min_magnitude : float
+        Magnitudes smaller than this are treated as 0.
+
+    Returns
+    -------
+    numpy.ndarray
+        Bin representative of each value.
+
+    """
+    gamma = (1 + relative_error) / (1 - relative_error)
+    magnitude = np.abs(values)
+    nonzero = magnitude >= min_magnitude
+    k = np.ceil(np.log(np.where(nonzero, magnitude, 1.0)) / np.log(gamma))
+    return np.where(nonzero, np.sign(values) * 2 * gamma ** k / (gamma + 1), 0.0)
+
+
+
+@instrumented(key='raster_path')
+def zonal_statistics_raster(raster_path, zones, statistics, block_size=1024, merge_threshold=5_000_000, quantile_mode='exact', relative_error=0.001, min_magnitude=1e-6):
+    """
+    Function to calculate zonal statistics of all zones for one raster in a single windowed pass.
+
+    Uses the cached label grid from rasterize_zones; count/sum/mean/std/min/max are accumulated with
+    bincount-style reductions and percentiles/median/majority/minority/unique from per-zone value counts
+    (exact, same definitions as rasterstats). With quantile_mode='sketch', values are first snapped to
+    log-spaced bins (see sketch_values), so memory per zone is bounded by the number of bins instead of
+    the number of pixels; percentiles are then within relative_error of the exact values, and majority,
+    minority and unique are calculated on the binned values. count/sum/mean/std/min/max are always exact.
+
+    Parameters
+    ----------
+    raster_path : string
+        Path to raster aligned with the zone label grid.
+    zones : dict
+        Output of rasterize_zones.
+    statistics : list
+        Statistics to calculate (rasterstats names, e.g., 'mean', 'std', 'majority', 'percentile_90').
+    block_size : int
+        Window size (pixels) for reading raster blocks.
+    merge_threshold : int
+        Number of buffered (zone, value, count) triples before they are merged.
+    quantile_mode : string
+        'exact' or 'sketch' (approximate, bounded memory).
+    relative_error : float
+        Relative error bound of percentiles in 'sketch' mode.
+    min_magnitude : float
+        Magnitudes smaller than this are treated as 0 in 'sketch' mode.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per zone (index of zone ids), one column per statistic.
+
+    """
+    zone_info = np.load(zones['zones_path'])
+    zone_ids = zone_info['zone_ids']
+    n_zones = len(zone_ids)
+    needs_counts = any(stat in ('median', 'majority', 'minority', 'unique') or stat.startswith('percentile_') for stat in statistics)
+
+    if quantile_mode not in ('exact', 'sketch'):
+        raise ValueError(f"quantile_mode must be 'exact' or 'sketch', not {quantile_mode!r}")
+
+    count = np.zeros(n_zones, dtype=np.int64)
+    mean = np.zeros(n_zones)
+    m2 = np.zeros(n_zones)
+    total = np.zeros(n_zones)
+    minimum = np.full(n_zones, np.inf)
+    maximum = np.full(n_zones, -np.inf)
+    buffered = []
+    buffered_size = 0
+
+    with rasterio.open(raster_path) as src, rasterio.open(zones['labels_path']) as labels_src:
+
+        if (src.height, src.width) != (labels_src.height, labels_src.width) or not src.transform.almost_equals(labels_src.transform):
+            raise ValueError(f'{raster_path} is not aligned with the zone label grid')
+
+        width = src.width
+        nodata = src.nodata
+        record_counts(pixels=src.height * width)
+
+        # group boundary (extra) pixels by block so each window only looks at its own
+        extra_index = zone_info['extra_index']
+        extra_zone = zone_info['extra_zone']
+        extra_rows, extra_cols = extra_index // width, extra_index % width
+        extra_block = (extra_rows // block_size) * (width // block_size + 1) + extra_cols // block_size
+        order = np.argsort(extra_block, kind='stable')
+        block_ids, block_starts = np.unique(extra_block[order], return_index=True)
+        block_slices = dict(zip(block_ids.tolist(), np.split(order, block_starts[1:]))) if len(order) else {}
+
+        for window in _block_windows(src.height, width, block_size):
+
+            data = src.read(1, window=window)
+            labels = labels_src.read(1, window=window)
+
+            invalid = np.isnan(data) if np.issubdtype(data.dtype, np.floating) else np.zeros(data.shape, dtype=bool)
+            if nodata is not None:
+                invalid |= data == nodata
+
+            selected = (labels > 0) & ~invalid
+            z = labels[selected] - 1
+            v = data[selected].astype(np.float64)
+
+            block_id = (window.row_off // block_size) * (width // block_size + 1) + window.col_off // block_size
+            if block_id in block_slices:
+                extras = block_slices[block_id]
+                rows = extra_rows[extras] - window.row_off
+                cols = extra_cols[extras] - window.col_off
+                valid = ~invalid[rows, cols]
+                z = np.concatenate([z, extra_zone[extras][valid]])
+                v = np.concatenate([v, data[rows[valid], cols[valid]].astype(np.float64)])
+
+            if len(z) == 0:
+                continue
+
+            # combine per-window count/mean/m2 with running totals (parallel variance algorithm)
+            window_count = np.bincount(z, minlength=n_zones)
+            window_sum = np.bincount(z, weights=v, minlength=n_zones)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                window_mean = np.where(window_count > 0, window_sum / window_count, 0.0)
+            window_m2 = np.bincount(z, weights=(v - window_mean[z]) ** 2, minlength=n_zones)
+
+            combined = count + window_count
+            with np.errstate(invalid='ignore', divide='ignore'):
+                delta = window_mean - mean
+                mean = np.where(combined > 0, mean + delta * window_count / combined, 0.0)
+                m2 = m2 + window_m2 + np.where(combined > 0, delta ** 2 * count * window_count / combined, 0.0)
+            count = combined
+            total += window_sum
+            np.minimum.at(minimum, z, v)
+            np.maximum.at(maximum, z, v)
+
+            if needs_counts:
+                counted = sketch_values(v, relative_error, min_magnitude) if quantile_mode == 'sketch' else v
+                buffered.append(_merge_value_counts(z, counted, np.ones(len(z), dtype=np.int64)))
+                buffered_size += len(buffered[-1][0])
+                if buffered_size > merge_threshold:
+                    buffered = [_merge_value_counts(*[np.concatenate(part) for part in zip(*buffered)])]
+                    buffered_size = len(buffered[0][0])
+
+    has_data = count > 0
+    results = {'count': count,
+               'sum': np.where(has_data, total, np.nan),
+               'mean': np.where(has_data, mean, np.nan),
+               'std': np.where(has_data, np.sqrt(np.maximum(m2, 0) / np.maximum(count, 1)), np.nan),
+               'min': np.where(has_data, minimum, np.nan),
+               'max': np.where(has_data, maximum, np.nan)}
+    results['range'] = results['max'] - results['min']
+
+    if needs_counts:
+        if buffered:
+            zone, value, value_count = _merge_value_counts(*[np.concatenate(part) for part in zip(*buffered)])
+        else:
+            zone, value, value_count = np.empty(0, dtype=np.int64), np.empty(0), np.empty(0, dtype=np.int64)
+        results.update(_value_count_statistics(zone, value, value_count, n_zones, statistics))
+
+    unsupported = [stat for stat in statistics if stat not in results]
+    if unsupported:
+        raise ValueError(f'unsupported statistics: {unsupported}')
+
+    return pd.DataFrame({stat: results[stat] for stat in statistics}, index=pd.Index(zone_ids, name='zone'))
+
+
+
+def _zonal_statistics_job(raster_path, zones, statistics, block_size, quantile_mode, relative_error):
+    label = os.path.splitext(os.path.basename(raster_path))[0]
+    return zonal_statistics_raster(raster_path, zones, statistics, block_size, quantile_mode=quantile_mode, 
+                                   relative_error=relative_error).add_prefix(f'{label}_')
+
+
+
+@instrumented
+def zonal_statistics_table(polygon_path, raster_paths, statistics, output_name=None, index_col=None, cache_dir='zone_cache', all_touched=True, block_size=1024, workers=None, quantile_mode='exact', relative_error=0.001):
+    """
+    Function to calculate zonal statistics for many rasters and combine them into a single wide feature table.
+
+    Zones are rasterized once (cached, see rasterize_zones) on the grid of the first raster, then rasters
+    are processed in parallel worker processes. Columns are named '{raster name}_{statistic}'.
+
+    Parameters
+    ----------
+    polygon_path : string
+        Path to polygon shapefile defining zones.
+    raster_paths : list
+        Paths to rasters on the same grid (e.g., DEM and terrain features).
+    statistics : list
+        Statistics to calculate for every raster (rasterstats names).
+    output_name : string, optional
+        Path for saving the table as .csv file.
+    index_col : string, optional
+        Column of zone ids (e.g., 'huc10').
+    cache_dir : string
+        Directory for the cached zone label grid.
+    all_touched : bool
+        Include every pixel touched by a zone (same as zonal_statistics_to_csv).
+    block_size : int
+        Window size (pixels) for reading raster blocks.
+    workers : int, optional
+        Number of worker processes (1 runs serially).
+    quantile_mode : string
+        'exact' or 'sketch' (approximate percentiles with bounded memory per zone, see zonal_statistics_raster).
+    relative_error : float
+        Relative error bound of percentiles in 'sketch' mode.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Wide feature table with one row per zone.
+
+    """
+    zones = rasterize_zones(polygon_path, raster_paths[0], cache_dir, index_col, all_touched, block_size)
+
+    n = len(raster_paths)
+    job_args = (raster_paths, [zones] * n, [statistics] * n, [block_size] * n, [quantile_mode] * n, [relative_error] * n)
+
+    if workers == 1:
+        tables = list(map(_zonal_statistics_job, *job_args))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            tables = list(executor.map(_zonal_statistics_job, *job_args))
+
+    table = pd.concat(tables, axis=1)
+    table.index.name = index_col if index_col is not None else table.index.name
+
+    if output_name is not None:
+        table.to_csv(output_name)
+
+    return table
+
+
+
+
+def _cube_sources(raster_paths):
+    return [{'path': os.path.abspath(path), 'size': os.stat(path).st_size, 'mtime_ns': os.stat(path).st_mtime_ns} for path in raster_paths]
+
+
+
+@contextmanager
+def _on_grid(src, grid, resampling):
+    """Context of raster src as is if it is on grid, otherwise of a WarpedVRT resampling it onto grid on the fly (closed on exit)."""
+    aligned = (src.crs == grid['crs'] and src.transform == grid['transform'] 
+               and (src.height, src.width) == (grid['height'], grid['width']))
+    if aligned:
+        yield src
+        return
+    # rasters on other grids (e.g., 20 m curvature) are resampled onto the cube grid on the fly
+    with WarpedVRT(src, crs=grid['crs'], transform=grid['transform'], height=grid['height'],
+                   width=grid['width'], resampling=Resampling[resampling]) as vrt:
+        yield vrt
+
+
+
+def _cube_feature_job(cube_path, band, raster_path, grid, block_size, resampling):
+    data = np.load(cube_path, mmap_mode='r+')
+
+    with rasterio.open(raster_path) as src, _on_grid(src, grid, resampling) as dataset:
+        for window in _block_windows(grid['height'], grid['width'], block_size):
+            rows, cols = window.toslices()
+            data[band, rows, cols] = dataset.read(1, window=window, masked=True).astype('float32').filled(np.nan)
+
+    data.flush()
+
+
+
+@instrumented
+def build_feature_cube(raster_paths, cube_dir, reference_raster=None, block_size=1024, resampling='nearest', workers=None):
+    """
+    Function to stack the DEM and terrain feature rasters into one memory-mapped feature cube on a shared grid.
+
+    Every raster is read block by block (resampled onto the grid of the reference raster if needed) into a 
+    single float32 .npy array of shape (features, rows, columns), nodata as NaN, with a JSON sidecar 
+    describing features, grid, and source files. Downstream stages open the cube with open_feature_cube 
+    (memory-mapped, no decoding) instead of reopening each GeoTIFF. The cube is only rebuilt if the list 
+    of rasters or any source file changed.
+
+    Parameters
+    ----------
+    raster_paths : list
+        Paths to rasters; feature names are file names without extension.
+    cube_dir : string
+        Directory for cube array (cube.npy) and sidecar (cube.json).
+    reference_raster : string, optional
+        Raster defining the grid of the cube; first raster if None.
+    block_size : int
+        Window size (pixels) for reading rasters.
+    resampling : string
+        Resampling method (rasterio.enums.Resampling name) for rasters not on the reference grid.
+    workers : int, optional
+        Number of worker processes, each filling features of the cube (1 runs serially).
+
+    Returns
+    -------
+    dict
+        Opened cube (see open_feature_cube).
+
+    """
+    with rasterio.open(reference_raster or raster_paths[0]) as ref:
+        grid = {'height': ref.height, 'width': ref.width, 'transform': ref.transform, 'crs': ref.crs}
+
+    names = [os.path.splitext(os.path.basename(path))[0] for path in raster_paths]
+    if len(set(names)) < len(names):
+        raise ValueError('raster file names must be unique feature names')
+
+    metadata = {'features': names, 'sources': _cube_sources(raster_paths), 'height': grid['height'], 'width': grid['width'],
+                'transform': list(grid['transform'])[:6], 'crs': grid['crs'].to_wkt() if grid['crs'] else None,
+                'dtype': 'float32', 'resampling': resampling}
+
+    cube_path = os.path.join(cube_dir, 'cube.npy')
+    metadata_path = os.path.join(cube_dir, 'cube.json')
+    if os.path.exists(cube_path) and os.path.exists(metadata_path):
+        with open(metadata_path) as f:
+            if json.load(f) == metadata:
+                return open_feature_cube(cube_dir)
+
+    os.makedirs(cube_dir, exist_ok=True)
+    part_path = cube_path + '.part.npy'
+    np.lib.format.open_memmap(part_path, mode='w+', dtype='float32', shape=(len(names), grid['height'], grid['width'])).flush()
+
+    n = len(raster_paths)
+    job_args = ([part_path] * n, range(n), raster_paths, [grid] * n, [block_size] * n, [resampling] * n)
+
+    if workers == 1:
+        list(map(_cube_feature_job, *job_args))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(_cube_feature_job, *job_args))
+
+    os.replace(part_path, cube_path)
+    with open(metadata_path, 'w') as f:
+        json.dump(metadata, f, indent=1)
+
+    return open_feature_cube(cube_dir)
+
+
+
+def open_feature_cube(cube_dir):
+    """Open feature cube (see build_feature_cube) as dict of its metadata, grid, and memory-mapped 'data' array."""
+    with open(os.path.join(cube_dir, 'cube.json')) as f:
+        cube = json.load(f)
+    cube['transform'] = rasterio.Affine(*cube['transform'])
+    cube['data'] = np.load(os.path.join(cube_dir, 'cube.npy'), mmap_mode='r')
+    return cube
+
+
+
+def _feature_index(cube, features):
+    """Index of features in cube; a slice (so windows are views of the memory-mapped array) where possible."""
+    if features is None:
+        return slice(None)
+    if isinstance(features, str):
+        features = [features]
+    positions = [cube['features'].index(feature) for feature in features]
+    if positions == list(range(positions[0], positions[0] + len(positions))):
+        return slice(positions[0], positions[0] + len(positions))
+    return np.array(positions)
+
+
+
+def cube_window(cube, window, features=None):
+    """
+    Values of a window of the feature cube for all or some features, shape (features, rows, columns).
+
+    The result is a view of the memory-mapped cube (nothing read until used) if features are all features,
+    a single feature, or features stored next to each other; otherwise it is a copy.
+    """
+    rows, cols = window.toslices()
+    return cube['data'][_feature_index(cube, features), rows, cols]
+
+
+
+def zone_windows(zones, block_size=1024):
+    """
+    Bounding window of every zone in a cached zone label grid (see rasterize_zones), cached next to it.
+
+    Returns int64 array of (row_start, row_stop, col_start, col_stop) per zone (zeros for empty zones).
+    """
+    windows_path = zones['zones_path'].replace('.npz', '_windows.npy')
+    if os.path.exists(windows_path):
+        return np.load(windows_path)
+
+    with np.load(zones['zones_path']) as z:
+        n_zones = len(z['zone_ids'])
+        extra_index, extra_zone = z['extra_index'], z['extra_zone']
+
+    with rasterio.open(zones['labels_path']) as src:
+        width = src.width
+        bounds = np.zeros((n_zones, 4), dtype=np.int64)
+        bounds[:, [0, 2]] = np.iinfo(np.int64).max
+
+        def update(zone, rows, cols):
+            np.minimum.at(bounds[:, 0], zone, rows)
+            np.maximum.at(bounds[:, 1], zone, rows + 1)
+            np.minimum.at(bounds[:, 2], zone, cols)
+            np.maximum.at(bounds[:, 3], zone, cols + 1)
+
+        for window in _block_windows(src.height, src.width, block_size):
+            labels = src.read(1, window=window)
+            rows, cols = np.nonzero(labels)
+            update(labels[rows, cols] - 1, rows + window.row_off, cols + window.col_off)
+
+    update(extra_zone, extra_index // width, extra_index % width)
+    bounds[bounds[:, 0] > bounds[:, 1]] = 0
+
+    np.save(windows_path, bounds)
+    return bounds
+
+
+
+def cube_zone_pixels(cube, zones, zone, features=None):
+    """
+    Values of all pixels of one zone (same pixels as zonal statistics, see rasterize_zones) for all or some
+    features of the feature cube, shape (pixels, features).
+
+    Only the zone's bounding window of the label grid is decoded and only that window of the cube is read.
+    """
+    with np.load(zones['zones_path']) as z:
+        i = list(z['zone_ids']).index(str(zone))
+        extra = z['extra_index'][z['extra_zone'] == i]
+
+    row_start, row_stop, col_start, col_stop = zone_windows(zones)[i]
+    window = Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+
+    with rasterio.open(zones['labels_path']) as src:
+        if (src.height, src.width) != (cube['height'], cube['width']) or src.transform != cube['transform']:
+            raise ValueError('zones must be rasterized on the grid of the feature cube')
+        if row_stop == row_start:
+            return cube_window(cube, Window(0, 0, 0, 0), features).reshape(-1, 0).T
+        mask = src.read(1, window=window) == i + 1
+    mask[extra // cube['width'] - row_start, extra % cube['width'] - col_start] = True
+
+    return cube_window(cube, window, features)[:, mask].T
+
+
+
+def _feature_table_name(path, index_col):
+    """Feature name of a zonal statistics .csv file (e.g., 'slope_26916' for 'slope_26916_huc10_zonalstats.csv')."""
+    return os.path.splitext(os.path.basename(path))[0].split(f'_{index_col}_zonal')[0]
+
+
+
+def _chunks(n_rows, batch_size, min_rows=1):
+    """(start, stop) row ranges of batch_size rows; a last range shorter than min_rows is merged into the one before."""
+    bounds = list(range(0, n_rows, batch_size)) + [n_rows]
+    if len(bounds) > 2 and bounds[-1] - bounds[-2] < min_rows:
+        del bounds[-2]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+
+def _merge_moments(moments, chunk):
+    """Merge rows of chunk into (count, mean, sum of squared deviations) of each column, in float64 (stable for large sums)."""
+    count, mean, squares = moments
+    if len(chunk) == 0:
+        return moments
+    chunk = np.asarray(chunk, dtype=np.float64)
+    chunk_mean = chunk.mean(axis=0)
+    delta = chunk_mean - mean
+    total = count + len(chunk)
+    return total, mean + delta * len(chunk) / total, squares + ((chunk - chunk_mean) ** 2).sum(axis=0) + delta ** 2 * count * len(chunk) / total
+
+
+
+def _moments_scaler(moments):
+    """Mean and standard deviation (1 for constant columns) of merged moments."""
+    count, mean, squares = moments
+    scale = np.sqrt(squares / max(count, 1))
+    scale[scale == 0] = 1
+    return mean, scale
+
+
+
+@instrumented
+def build_feature_matrix(table_paths, matrix_dir, index_col='huc10', drop_cols=['areasqkm'], drop_features=None, batch_size=65536):
+    """
+    Function to join zonal statistics tables into one feature matrix saved for clustering.
+
+    Tables (e.g., the '*_huc10_zonalstats.csv' files of zonal_statistics_to_csv) are joined on index_col, keeping 
+    zones present in every table, and zones with any missing value are dropped. HUC ids (index_col 'huc{digits}')
+    are zero-padded to their number of digits, since tables edited in spreadsheets lose leading zeros. The matrix is saved as a 
+    C-contiguous float32 .npy array of shape (zones, features) with a JSON sidecar describing zone ids, feature 
+    names, the standard scaler (mean and standard deviation of each feature), and source files. Downstream steps 
+    open it with open_feature_matrix (memory-mapped) and cache their state (see fit_feature_pca) next to it. The 
+    matrix is only rebuilt if the list of tables, any table file, or the options changed.
+
+    Parameters
+    ----------
+    table_paths : list
+        Paths to zonal statistics .csv files; features are named '{table name}_{column}' where table name is the 
+        file name up to '_{index_col}_zonal'.
+    matrix_dir : string
+        Directory for matrix array (matrix.npy), sidecar (matrix.json), and cached PCA state.
+    index_col : string
+        Column of zone ids in every table.
+    drop_cols : list, optional
+        Columns dropped from every table (e.g., watershed area, which is not a terrain feature).
+    drop_features : list, optional
+        Features dropped after joining (e.g., 'aspect_26916_sum').
+    batch_size : int
+        Rows per batch when computing the scaler.
+
+    Returns
+    -------
+    dict
+        Opened matrix (see open_feature_matrix).
+
+    """
+    names = [_feature_table_name(path, index_col) for path in table_paths]
+    if len(set(names)) < len(names):
+        raise ValueError('zonal statistics table names must be unique feature names')
+
+    metadata = {'sources': _cube_sources(table_paths), 'index_col': index_col, 'drop_cols': list(drop_cols or []), 
+                'drop_features': list(drop_features or []), 'dtype': 'float32'}
+
+    matrix_path = os.path.join(matrix_dir, 'matrix.npy')
+    metadata_path = os.path.join(matrix_dir, 'matrix.json')
+    if os.path.exists(matrix_path) and os.path.exists(metadata_path):
+        with open(metadata_path) as f:
+            if {key: value for key, value in json.load(f).items() if key in metadata} == metadata:
+                return open_feature_matrix(matrix_dir)
+
+    tables = []
+    for name, path in zip(names, table_paths):
+        table = pd.read_csv(path, dtype={index_col: str}).set_index(index_col)
+        if index_col.lower().startswith('huc') and index_col[3:].isdigit():
+            table.index = table.index.str.zfill(int(index_col[3:]))
+        table = table.drop(columns=[col for col in metadata['drop_cols'] if col in table.columns])
+        tables.append(table.select_dtypes(include='number').add_prefix(f'{name}_'))
+
+    table = pd.concat(tables, axis=1, join='inner').drop(columns=metadata['drop_features'])
+    missing = table.isna().any(axis=1)
+    table = table[~missing]
+
+    os.makedirs(matrix_dir, exist_ok=True)
+    for file_name in os.listdir(matrix_dir):
+        if file_name.startswith('pca_') and file_name.endswith('.npz'):
+            os.remove(os.path.join(matrix_dir, file_name))
+
+    data = np.ascontiguousarray(table.to_numpy(dtype=np.float32))
+
+    # scaler merged batch by batch (as for rows read from the memory-mapped matrix)
+    moments = (0, np.zeros(data.shape[1]), np.zeros(data.shape[1]))
+    for start, stop in _chunks(len(data), batch_size):
+        moments = _merge_moments(moments, data[start:stop])
+    mean, scale = _moments_scaler(moments)
+
+    part_path = matrix_path + '.part.npy'
+    np.save(part_path, data)
+    os.replace(part_path, matrix_path)
+
+    metadata.update({'ids': list(table.index), 'features': list(table.columns), 'dropped_ids': list(missing.index[missing]),
+                     'mean': mean.tolist(), 'scale': scale.tolist()})
+    with open(metadata_path, 'w') as f:
+        json.dump(metadata, f, indent=1)
+
+    record_counts(rows=len(data))
+
+    return open_feature_matrix(matrix_dir)
+
+
+
+def open_feature_matrix(matrix_dir, mmap_mode='r'):
+    """Open feature matrix (see build_feature_matrix) as dict of its metadata, scaler, and memory-mapped 'data' array."""
+    with open(os.path.join(matrix_dir, 'matrix.json')) as f:
+        matrix = json.load(f)
+    matrix['mean'] = np.asarray(matrix['mean'])
+    matrix['scale'] = np.asarray(matrix['scale'])
+    matrix['data'] = np.load(os.path.join(matrix_dir, 'matrix.npy'), mmap_mode=mmap_mode)
+    matrix['matrix_dir'] = matrix_dir
+    return matrix
+
+
+
+def scaled_features(matrix, start=0, stop=None):
+    """Standardized rows start:stop of feature matrix (float64)."""
+    return (matrix['data'][start:stop].astype(np.float64) - matrix['mean']) / matrix['scale']
+
+
+
+@instrumented
+def fit_feature_pca(matrix, n_components=None, batch_size=None, whiten=False, random_state=0):
+    """
+    Function to fit PCA of the standardized feature matrix, cached next to the matrix.
+
+    With batch_size, IncrementalPCA is fit batch by batch from the memory-mapped matrix, so only one batch of 
+    rows is in memory at a time (for HUC12-scale inputs); otherwise PCA is fit on all rows at once. The fitted 
+    state is saved as 'pca_{key}.npz' in the matrix directory (key from the options) and reused until the 
+    matrix is rebuilt.
+
+    Parameters
+    ----------
+    matrix : dict
+        Opened feature matrix (see build_feature_matrix).
+    n_components : int or float, optional
+        Number of components, or fraction of variance to explain (all rows at once only); all if None.
+    batch_size : int, optional
+        Rows per batch of IncrementalPCA; PCA of all rows at once if None.
+    whiten : bool
+        Scale component scores to unit variance.
+    random_state : int
+        Seed of randomized solvers.
+
+    Returns
+    -------
+    dict
+        'components' (components x features), 'mean', 'explained_variance', 'explained_variance_ratio', 
+        'whiten', and 'features'.
+
+    """
+    key_source = json.dumps([n_components, batch_size, whiten, random_state])
+    key = hashlib.sha1(key_source.encode()).hexdigest()[:16]
+    state_path = os.path.join(matrix['matrix_dir'], f'pca_{key}.npz')
+
+    if not os.path.exists(state_path):
+        n_rows = len(matrix['data'])
+        if batch_size is None:
+            pca = PCA(n_components=n_components, whiten=whiten, random_state=random_state).fit(scaled_features(matrix))
+        else:
+            pca = IncrementalPCA(n_components=n_components, whiten=whiten)
+            for start, stop in _chunks(n_rows, batch_size, min_rows=pca.n_components or matrix['data'].shape[1]):
+                pca.partial_fit(scaled_features(matrix, start, stop))
+
+        np.savez(state_path + '.part.npz', components=pca.components_, mean=pca.mean_, explained_variance=pca.explained_variance_,
+                 explained_variance_ratio=pca.explained_variance_ratio_, whiten=whiten)
+        os.replace(state_path + '.part.npz', state_path)
+
+    with np.load(state_path) as state:
+        pca = {name: state[name] for name in state.files}
+    pca['whiten'] = bool(pca['whiten'])
+    pca['features'] = matrix['features']
+
+    return pca
+
+
+
+def pca_scores(matrix, pca, n_components=None, batch_size=65536):
+    """Component scores of every row of feature matrix (float32, C-contiguous, rows x components), transformed batch by batch."""
+    components = pca['components'][:n_components]
+    scores = np.empty((len(matrix['data']), len(components)), dtype=np.float32)
+    for start, stop in _chunks(len(matrix['data']), batch_size):
+        chunk = (scaled_features(matrix, start, stop) - pca['mean']) @ components.T
+        if pca['whiten']:
+            chunk /= np.sqrt(pca['explained_variance'][:len(components)])
+        scores[start:stop] = chunk
+    return scores
+
+
+
+def _cluster_model(method, params, batch_size=None, random_state=0):
+    """Clustering estimator for method 'kmeans' (MiniBatchKMeans with batch_size), 'dbscan', or 'hdbscan' with params."""
+    if method == 'kmeans':
+        if batch_size is not None:
+            return MiniBatchKMeans(batch_size=batch_size, random_state=random_state, n_init='auto', **params)
+        return KMeans(random_state=random_state, n_init='auto', **params)
+    if method == 'dbscan':
+        return DBSCAN(**params)
+    if method == 'hdbscan':
+        # copy so X (shared by all settings of a sweep) is not modified in place
+        return HDBSCAN(**dict({'copy': True}, **params))
+    raise ValueError(f"method must be 'kmeans', 'dbscan', or 'hdbscan', not {method!r}")
+
+
+
+def cluster_features(X, method='kmeans', batch_size=None, random_state=0, **params):
+    """Cluster labels of rows of X (e.g., pca_scores) with method (see _cluster_model) and params (e.g., n_clusters=6); -1 = noise."""
+    return _cluster_model(method, params, batch_size, random_state).fit_predict(X).astype(np.int32)
+
+
+
+def _cluster_sweep_job(X, method, params, batch_size, random_state, silhouette_sample):
+    """Fit one parameter setting of cluster_sweep; X is an array or (shared memory name, shape, dtype) of one."""
+    memory = None
+    if isinstance(X, tuple):
+        name, shape, dtype = X
+        memory = shared_memory.SharedMemory(name=name)
+        X = np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+
+    try:
+        start = time.perf_counter()
+        model = _cluster_model(method, params, batch_size, random_state)
+        labels = model.fit_predict(X).astype(np.int32)
+        result = dict(params, seconds=time.perf_counter() - start, n_clusters=len(np.unique(labels[labels >= 0])),
+                      noise_fraction=float(np.mean(labels < 0)), inertia=getattr(model, 'inertia_', np.nan), silhouette=np.nan)
+
+        clustered = labels >= 0
+        if 1 < result['n_clusters'] < clustered.sum():
+            result['silhouette'] = float(silhouette_score(X[clustered], labels[clustered], random_state=random_state,
+                                                          sample_size=min(silhouette_sample, int(clustered.sum()))))
+    finally:
+        del X
+        if memory is not None:
+            memory.close()
+
+    return result, labels
+
+
+
+@instrumented
+def cluster_sweep(X, method, param_grid, workers=None, batch_size=None, random_state=0, silhouette_sample=10000):
+    """
+    Function to cluster rows of X for every combination of parameters in parallel worker processes.
+
+    X is copied once into shared memory that every worker reads in place (not pickled to each worker), so a 
+    sweep over many settings (e.g., k for KMeans, eps for DBSCAN, min_cluster_size for HDBSCAN) costs one 
+    copy of the matrix.
+
+    Parameters
+    ----------
+    X : numpy.ndarray
+        Rows to cluster (e.g., pca_scores of the feature matrix).
+    method : string
+        'kmeans', 'dbscan', or 'hdbscan'.
+    param_grid : dict
+        Lists of values of estimator parameters (e.g., {'n_clusters': range(2, 13)} or {'eps': [0.5, 1.0], 
+        'min_samples': [5, 10]}).
+    workers : int, optional
+        Number of worker processes (1 runs serially).
+    batch_size : int, optional
+        Batch size of MiniBatchKMeans (KMeans if None).
+    random_state : int
+        Seed of KMeans initialization and silhouette sampling.
+    silhouette_sample : int
+        Maximum rows sampled for silhouette scores.
+
+    Returns
+    -------
+    tuple
+        (DataFrame with parameters, seconds, number of clusters, noise fraction, inertia, and silhouette score of 
+        each setting; int32 array of labels of each setting, settings x rows).
+
+    """
+    settings = list(ParameterGrid(param_grid))
+    X = np.ascontiguousarray(X)
+    job_args = ([method] * len(settings), settings, [batch_size] * len(settings), [random_state] * len(settings), 
+                [silhouette_sample] * len(settings))
+
+    if workers == 1:
+        results = list(map(_cluster_sweep_job, [X] * len(settings), *job_args))
+    else:
+        memory = shared_memory.SharedMemory(create=True, size=max(X.nbytes, 1))
+        try:
+            np.ndarray(X.shape, dtype=X.dtype, buffer=memory.buf)[:] = X
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_cluster_sweep_job, [(memory.name, X.shape, X.dtype.str)] * len(settings), *job_args))
+        finally:
+            memory.close()
+            memory.unlink()
+
+    record_counts(rows=len(X) * len(settings))
+
+    return pd.DataFrame([result for result, _ in results]), np.stack([labels for _, labels in results]) if results else np.empty((0, len(X)), dtype=np.int32)
+
+
+
+def cluster_labels_table(matrix, labels, column='Clusters', output_name=None):
+    """Dataframe of zone ids (index_col of the feature matrix) and cluster labels, optionally saved as .csv file (without index)."""
+    table = pd.DataFrame({matrix['index_col']: matrix['ids'], column: labels})
+    if output_name is not None:
+        table.to_csv(output_name, index=False)
+    return table
+
+
+
+def _pixel_grid(reference_raster, aggregate=1):
+    """Grid of reference raster, coarsened by aggregate (pixels of aggregate x aggregate reference pixels) for superpixels."""
+    with rasterio.open(reference_raster) as ref:
+        return {'height': -(-ref.height // aggregate), 'width': -(-ref.width // aggregate), 
+                'transform': ref.transform * rasterio.Affine.scale(aggregate), 'crs': ref.crs}
+
+
+
+def _read_pixel_features(datasets, window):
+    """Values of window of every dataset as (pixels, features) float64 array (nodata as NaN) and mask of pixels valid in all."""
+    values = np.stack([dataset.read(1, window=window, masked=True).astype(np.float64).filled(np.nan).ravel() for dataset in datasets], axis=1)
+    return values, np.isfinite(values).all(axis=1)
+
+
+
+def _nearest_center(values, centers):
+    """Index of nearest center of each row of values (squared euclidean distance)."""
+    distances = (centers ** 2).sum(axis=1) - 2 * values @ centers.T
+    return distances.argmin(axis=1)
+
+
+
+@instrumented
+def fit_pixel_clusters(raster_paths, n_clusters, sample_size=200_000, reference_raster=None, aggregate=1, block_size=1024, resampling='nearest', 
+                       batch_size=4096, random_state=0, model_path=None):
+    """
+    Function to fit a clustering of pixels (or superpixels) of terrain feature rasters from a streamed sample.
+
+    Rasters (e.g., the DEM and terrain features used with zonal_statistics_to_csv) are read window by window, 
+    one window of every raster at a time, so the full multi-band stack is never in memory. Pixels valid in 
+    every raster are added to a uniform reservoir sample of sample_size pixels (random priorities, smallest 
+    kept) while mean and standard deviation of every feature are accumulated over all valid pixels. 
+    MiniBatchKMeans is fit on the standardized sample; label_pixels then labels every pixel with its nearest 
+    cluster center in a second pass.
+
+    Parameters
+    ----------
+    raster_paths : list
+        Paths to feature rasters; feature names are file names without extension.
+    n_clusters : int
+        Number of clusters.
+    sample_size : int
+        Number of pixels sampled to fit the clustering.
+    reference_raster : string, optional
+        Raster defining the grid; first raster if None. Rasters on other grids are resampled onto it.
+    aggregate : int
+        Cluster superpixels of aggregate x aggregate pixels of the reference grid (features averaged) instead of 
+        pixels.
+    block_size : int
+        Window size (pixels) for reading rasters.
+    resampling : string
+        Resampling method (rasterio.enums.Resampling name) for rasters not on the grid ('average' is used for 
+        superpixels).
+    batch_size : int
+        Batch size of MiniBatchKMeans.
+    random_state : int
+        Seed of sampling and clustering.
+    model_path : string, optional
+        Path for saving the fitted model as .npz file (see load_pixel_clusters).
+
+    Returns
+    -------
+    dict
+        'features', scaler 'mean' and 'scale', cluster 'centers' (standardized), 'inertia' of the sample, 
+        'sampled' and 'valid' pixel counts, 'aggregate', and 'resampling'.
+
+    """
+    rng = np.random.default_rng(random_state)
+    grid = _pixel_grid(reference_raster or raster_paths[0], aggregate)
+    resampling = 'average' if aggregate > 1 else resampling
+
+    moments = (0, np.zeros(len(raster_paths)), np.zeros(len(raster_paths)))
+    sample = np.empty((0, len(raster_paths)))
+    priorities = np.empty(0)
+
+    with ExitStack() as stack:
+        datasets = [stack.enter_context(_on_grid(stack.enter_context(rasterio.open(path)), grid, resampling)) for path in raster_paths]
+        for window in _block_windows(grid['height'], grid['width'], block_size):
+            values, valid = _read_pixel_features(datasets, window)
+            values = values[valid]
+            moments = _merge_moments(moments, values)
+
+            # reservoir of the pixels with the smallest random priorities (uniform sample of all valid pixels so far)
+            sample = np.concatenate([sample, values])
+            priorities = np.concatenate([priorities, rng.random(len(values))])
+            if len(sample) > sample_size:
+                keep = np.argpartition(priorities, sample_size)[:sample_size]
+                sample, priorities = sample[keep], priorities[keep]
+
+    if len(sample) < n_clusters:
+        raise ValueError(f'only {len(sample)} valid pixels for {n_clusters} clusters')
+
+    mean, scale = _moments_scaler(moments)
+    kmeans = MiniBatchKMeans(n_clusters=n_clusters, batch_size=batch_size, random_state=random_state, n_init='auto')
+    kmeans.fit((sample - mean) / scale)
+
+    model = {'features': [os.path.splitext(os.path.basename(path))[0] for path in raster_paths], 'mean': mean, 'scale': scale,
+             'centers': kmeans.cluster_centers_, 'inertia': float(kmeans.inertia_), 'sampled': len(sample), 
+             'valid': int(moments[0]), 'aggregate': aggregate, 'resampling': resampling}
+
+    if model_path is not None:
+        np.savez(model_path, **model)
+
+    record_counts(pixels=grid['height'] * grid['width'])
+
+    return model
+
+
+
+def load_pixel_clusters(model_path):
+    """Fitted pixel clustering saved by fit_pixel_clusters (model_path)."""
+    with np.load(model_path) as saved:
+        model = {name: saved[name] for name in saved.files}
+    model['features'] = list(model['features'])
+    model['inertia'] = float(model['inertia'])
+    model.update({name: int(model[name]) for name in ['sampled', 'valid', 'aggregate']})
+    model['resampling'] = str(model['resampling'])
+    return model
+
+
+
+@instrumented
+def label_pixels(raster_paths, model, output_path, reference_raster=None, block_size=1024):
+    """
+    Function to write the cluster label of every pixel (or superpixel) of feature rasters as a GeoTIFF.
+
+    Rasters are read window by window (in the order of model features) and each valid pixel is labelled with 
+    the nearest cluster center of model (see fit_pixel_clusters); pixels missing in any raster are nodata (-1). 
+    Returns the number of pixels in each cluster.
+    """
+    if len(raster_paths) != len(model['features']):
+        raise ValueError(f"model was fit on {len(model['features'])} features, not {len(raster_paths)}")
+
+    grid = _pixel_grid(reference_raster or raster_paths[0], model['aggregate'])
+    counts = np.zeros(len(model['centers']), dtype=np.int64)
+
+    profile = {'driver': 'GTiff', 'height': grid['height'], 'width': grid['width'], 'count': 1, 'dtype': 'int16', 
+               'crs': grid['crs'], 'transform': grid['transform'], 'nodata': -1, 'tiled': True, 'blockxsize': block_size, 
+               'blockysize': block_size, 'compress': 'deflate', 'BIGTIFF': 'IF_SAFER'}
+
+    with ExitStack() as stack:
+        datasets = [stack.enter_context(_on_grid(stack.enter_context(rasterio.open(path)), grid, model['resampling'])) for path in raster_paths]
+        with rasterio.open(output_path + '.part.tif', 'w', **profile) as dst:
+            for window in _block_windows(grid['height'], grid['width'], block_size):
+                values, valid = _read_pixel_features(datasets, window)
+                labels = np.full(len(values), -1, dtype=np.int16)
+                labels[valid] = _nearest_center((values[valid] - model['mean']) / model['scale'], model['centers'])
+                counts += np.bincount(labels[valid], minlength=len(counts))
+                dst.write(labels.reshape(window.height, window.width), 1, window=window)
+
+    os.replace(output_path + '.part.tif', output_path)
+    record_counts(pixels=grid['height'] * grid['width'])
+
+    return pd.Series(counts, index=pd.RangeIndex(len(counts), name='cluster'), name='pixels')
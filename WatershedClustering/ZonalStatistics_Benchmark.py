@@ -0,0 +1,66 @@
+"""
+Benchmark of exact vs. sketch (approximate) percentiles for zonal statistics.
+
+Runs zonal_statistics_raster on the same raster and zones in both quantile modes, and reports run time 
+and the relative error of each order statistic in sketch mode. Defaults to the project DEM and HUC10 
+watersheds; run from the WatershedClustering directory, e.g.
+
+    python ZonalStatistics_Benchmark.py --relative-error 0.001 0.01
+"""
+
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from WatershedClustering_Utils import rasterize_zones, zonal_statistics_raster
+
+
+STATISTICS = ['majority', 'percentile_10', 'percentile_25', 'median', 'percentile_75', 'percentile_90']
+
+
+def benchmark(polygon_path, raster_path, relative_errors, index_col='huc10', cache_dir='zone_cache', block_size=1024):
+
+    # zones rasterized (and cached) before timing so both modes only time the statistics pass
+    zones = rasterize_zones(polygon_path, raster_path, cache_dir, index_col, block_size=block_size)
+
+    start = time.perf_counter()
+    exact = zonal_statistics_raster(raster_path, zones, STATISTICS, block_size)
+    results = [{'mode': 'exact', 'seconds': time.perf_counter() - start}]
+
+    for relative_error in relative_errors:
+        start = time.perf_counter()
+        sketch = zonal_statistics_raster(raster_path, zones, STATISTICS, block_size, quantile_mode='sketch', 
+                                         relative_error=relative_error)
+        result = {'mode': 'sketch', 'relative_error': relative_error, 'seconds': time.perf_counter() - start}
+
+        for stat in STATISTICS:
+            error = np.abs(sketch[stat] - exact[stat]) / np.maximum(np.abs(exact[stat]), np.finfo(float).tiny)
+            result[f'{stat}_max_relative_error'] = float(np.nanmax(error))
+            result[f'{stat}_mean_relative_error'] = float(np.nanmean(error))
+
+        results.append(result)
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare accuracy and speed of exact and sketch zonal percentiles.')
+    parser.add_argument('--polygons', default='../Data/nhd/ky_huc10_26916.shp')
+    parser.add_argument('--raster', default='../Data/dem_10m/dem_10m_clipped_26916.tif')
+    parser.add_argument('--index-col', default='huc10')
+    parser.add_argument('--relative-error', type=float, nargs='+', default=[0.0001, 0.001, 0.01])
+    parser.add_argument('--block-size', type=int, default=1024)
+    parser.add_argument('--output', default=None, help='optional path for json results')
+    args = parser.parse_args()
+
+    results = benchmark(args.polygons, args.raster, args.relative_error, args.index_col, block_size=args.block_size)
+
+    for result in results:
+        print(json.dumps(result))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# stage utilities (each stage folder is its own import root, as in the notebooks)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for stage in ['', 'Data', 'StreamFlowEvents', 'TerrainFeatures', 'WatershedClustering', 'StatisticalComparison', 'Pipeline', 'Benchmarks']:
+    sys.path.insert(0, os.path.join(ROOT, stage))
@@ -0,0 +1,91 @@
+"""Bulk gauge downloads against a local stub of the NWIS instantaneous values service: transient errors are retried
+with exponential backoff, and finished downloads are recorded in the manifest so a second run skips them."""
+
+import http.server
+import json
+import os
+import threading
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import Data_Utils
+from Data_Utils import get_stream_gage_data_bulk
+
+
+RDB = ('# US Geological Survey\n'
+       'agency_cd\tsite_no\tdatetime\ttz_cd\t86429_00065\t86429_00065_cd\n'
+       '5s\t15s\t20d\t6s\t14n\t10s\n'
+       'USGS\t{site}\t2020-01-01 00:00\tEST\t1.25\tA\n'
+       'USGS\t{site}\t2020-01-01 00:15\tEST\t1.50\tA\n')
+
+# number of 503 responses before each site succeeds (sites not listed succeed at once)
+FAILURES = {'03210001': 2, '03210009': 99}
+
+
+@pytest.fixture
+def nwis_stub():
+    requests = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            site = query['sites'][0]
+            requests.append((site, query['parameterCd'][0]))
+            if sum(request[0] == site for request in requests) <= FAILURES.get(site, 0):
+                self.send_response(503)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            body = RDB.format(site=site).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}/nwis/iv/', requests
+    server.shutdown()
+    server.server_close()
+
+
+def test_bulk_download_retries_and_resumes(tmp_path, nwis_stub, monkeypatch):
+    base_url, requests = nwis_stub
+    sleeps = []
+    monkeypatch.setattr(Data_Utils.time, 'sleep', sleeps.append)
+    gauges = ['03210001', '03210002', '03210009']
+    kwargs = dict(begin_date='2020-01-01', end_date='2020-01-02', max_workers=2, retries=3, backoff=0.5, timeout=10, base_url=base_url)
+
+    results = get_stream_gage_data_bulk(gauges, str(tmp_path), **kwargs)
+
+    # transient failure retried until it succeeds, persistent failure gives up after the retries
+    assert [site for site, _ in requests].count('03210001') == 3
+    assert [site for site, _ in requests].count('03210009') == 4
+    assert {code for _, code in requests} == {'00065'}
+    assert sorted(sleeps) == sorted([0.5, 1.0] + [0.5, 1.0, 2.0])
+    assert results['03210009_gageheight'] is None
+    for gauge in ['03210001', '03210002']:
+        with open(results[f'{gauge}_gageheight']) as f:
+            assert f.read().splitlines() == ['agency_cd,site_no,datetime,tz_cd,86429_00065,86429_00065_cd',
+                                             f'USGS,{gauge},2020-01-01 00:00,EST,1.25,A', f'USGS,{gauge},2020-01-01 00:15,EST,1.50,A']
+    assert not any(file.endswith('.part') for file in os.listdir(tmp_path))
+
+    with open(tmp_path / 'download_manifest.json') as f:
+        manifest = json.load(f)
+    assert manifest == {f'{gauge}_gageheight_2020-01-01_2020-01-02': results[f'{gauge}_gageheight'] for gauge in ['03210001', '03210002']}
+
+    # second run only requests the gauge that didn't finish
+    requests.clear()
+    rerun = get_stream_gage_data_bulk(gauges, str(tmp_path), **kwargs)
+    assert {site for site, _ in requests} == {'03210009'}
+    assert rerun == results
+
+    # another date range is a different download
+    requests.clear()
+    get_stream_gage_data_bulk(['03210002'], str(tmp_path), **dict(kwargs, end_date='2020-01-03'))
+    assert requests == [('03210002', '00065')]
@@ -0,0 +1,74 @@
+"""Vectorized and fused event detection match calculate_ci followed by calculate_percentile(90) and (99)."""
+
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from StreamFlowEvents_Utils import calculate_ci, calculate_percentile, calculate_events, process_gauges_batch, _fused_rolling_kernel_jit
+
+
+WINDOW, MIN_PERIODS, ALPHA = '90D', 30, 0.05
+
+ENGINES = ['numpy', pytest.param('numba', marks=pytest.mark.skipif(_fused_rolling_kernel_jit is None, reason='numba not installed'))]
+
+
+def synthetic_gauge(seed, start, days, gaps=6):
+    """Daily (resampled) gauge series with seasonal signal, noise, and runs of missing days."""
+    rng = np.random.default_rng(seed)
+    index = pd.date_range(start, periods=days, freq='D')
+    values = 2 + np.sin(np.arange(days) * 2 * np.pi / 365) + rng.gamma(2, 0.3, days)
+    for gap_start in rng.integers(0, days - 60, gaps):
+        values[gap_start:gap_start + rng.integers(1, 60)] = np.nan
+    return pd.DataFrame({'value': values}, index=index)
+
+
+def reference_events(df):
+    df = calculate_ci(df.copy(), WINDOW, MIN_PERIODS, ALPHA)
+    for percentile in (90, 99):
+        df = calculate_percentile(df, WINDOW, MIN_PERIODS, percentile)
+    return df
+
+
+def assert_events_equal(result, expected):
+    assert list(result.columns) == list(expected.columns)
+    pd.testing.assert_index_equal(result.index, expected.index)
+    for column in expected.columns:
+        if column.endswith('_bool'):
+            np.testing.assert_array_equal(result[column].to_numpy(bool), expected[column].to_numpy(bool), err_msg=column)
+        else:
+            np.testing.assert_allclose(result[column].to_numpy(float), expected[column].to_numpy(float), rtol=1e-9, atol=1e-12, 
+                                       equal_nan=True, err_msg=column)
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_calculate_events_matches_per_gauge_functions(engine):
+    df = synthetic_gauge(0, '2000-10-01', 3 * 365)
+    assert_events_equal(calculate_events(df.copy(), WINDOW, MIN_PERIODS, ALPHA, engine=engine), reference_events(df))
+
+
+def test_process_gauges_batch_matches_per_gauge_functions():
+    # gauges with different date ranges, so the batch is aligned on a shared index and trimmed back
+    series = {'03210000': synthetic_gauge(1, '2000-10-01', 3 * 365),
+              '03210001': synthetic_gauge(2, '2001-03-15', 2 * 365),
+              '03210002': synthetic_gauge(3, '1999-01-01', 800, gaps=12)}
+
+    results = process_gauges_batch(series, window=WINDOW, min_periods=MIN_PERIODS, alpha=ALPHA)
+
+    assert set(results) == set(series)
+    for gauge, df in series.items():
+        assert_events_equal(results[gauge], reference_events(df))
+
+
+def test_process_gauges_batch_with_all_missing_gauge():
+    # a gauge without any values gives no events and no warnings (e.g., 'Mean of empty slice')
+    series = {'03210000': synthetic_gauge(1, '2000-10-01', 2 * 365),
+              '03210001': synthetic_gauge(2, '2000-10-01', 2 * 365).assign(value=np.nan)}
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        results = process_gauges_batch(series, window=WINDOW, min_periods=MIN_PERIODS, alpha=ALPHA)
+
+    assert_events_equal(results['03210000'], reference_events(series['03210000']))
+    assert not results['03210001'].filter(like='_bool').to_numpy(bool).any()
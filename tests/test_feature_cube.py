@@ -0,0 +1,61 @@
+"""Rasters on other grids are resampled into the feature cube and pixel clusters, and their WarpedVRTs are closed."""
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+from rasterio.vrt import WarpedVRT
+
+import WatershedClustering_Utils
+from WatershedClustering_Utils import build_feature_cube, fit_pixel_clusters, label_pixels
+
+
+@pytest.fixture
+def rasters(tmp_path):
+    rng = np.random.default_rng(0)
+    profile = dict(driver='GTiff', height=120, width=90, count=1, dtype='float32', crs='EPSG:26916',
+                   transform=from_origin(600000, 4200000, 10, 10), nodata=-9999)
+    paths = []
+    for name, values in [('dem', 200 + rng.normal(0, 5, (120, 90))), ('slope', rng.gamma(2, 1, (120, 90)))]:
+        paths.append(str(tmp_path / f'{name}.tif'))
+        with rasterio.open(paths[-1], 'w', **profile) as dst:
+            dst.write(values.astype('float32'), 1)
+    # 20 m raster resampled onto the 10 m grid
+    paths.append(str(tmp_path / 'curvature.tif'))
+    with rasterio.open(paths[-1], 'w', **dict(profile, height=60, width=45, transform=from_origin(600000, 4200000, 20, 20))) as dst:
+        dst.write(rng.normal(0, 1, (60, 45)).astype('float32'), 1)
+    return paths
+
+
+@pytest.fixture
+def opened_vrts(monkeypatch):
+    vrts = []
+
+    class RecordedWarpedVRT(WarpedVRT):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            vrts.append(self)
+
+    monkeypatch.setattr(WatershedClustering_Utils, 'WarpedVRT', RecordedWarpedVRT)
+    return vrts
+
+
+def test_feature_cube_resamples_and_closes_vrts(tmp_path, rasters, opened_vrts):
+    cube = build_feature_cube(rasters, str(tmp_path / 'cube'), block_size=32, workers=1)
+
+    with rasterio.open(rasters[2]) as src, WarpedVRT(src, crs=src.crs, transform=from_origin(600000, 4200000, 10, 10),
+                                                     height=120, width=90, resampling=Resampling.nearest) as vrt:
+        np.testing.assert_array_equal(cube['data'][2], vrt.read(1))
+    with rasterio.open(rasters[0]) as src:
+        np.testing.assert_array_equal(cube['data'][0], src.read(1))
+
+    assert len(opened_vrts) == 1 and all(vrt.closed for vrt in opened_vrts)
+
+
+def test_pixel_clusters_close_vrts(tmp_path, rasters, opened_vrts):
+    model = fit_pixel_clusters(rasters, 3, sample_size=2000, block_size=32)
+    counts = label_pixels(rasters, model, str(tmp_path / 'labels.tif'), block_size=32)
+
+    assert counts.sum() == 120 * 90
+    assert len(opened_vrts) == 2 and all(vrt.closed for vrt in opened_vrts)
@@ -0,0 +1,152 @@
+"""Tiled flow routing matches single-tile routing, a reference priority-flood fill, D8 steepest descent, and accumulation
+along its own flow directions (and Whitebox, if its binary is installed)."""
+
+import heapq
+import os
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+from TerrainFeatures_Utils import D8_CODES, D8_COLS, D8_NODATA, D8_ROWS, flow_routing
+
+
+XRES = YRES = 10.0
+
+
+@pytest.fixture(scope='module')
+def routed(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('flow')
+    rng = np.random.default_rng(0)
+    height, width, nodata = 83, 71, -9999.0
+
+    # sloping surface with noise (many pits), a flat plateau, a flat-bottomed depression, and a nodata hole
+    rows, cols = np.mgrid[0:height, 0:width]
+    dem = 100 + 0.3 * rows + 0.2 * cols + 5 * np.sin(rows / 9) * np.cos(cols / 7) + rng.normal(0, 0.4, (height, width))
+    dem[10:25, 40:60] = 120.0
+    dem[50:60, 10:25] = 80.0
+    dem[65:72, 45:55] = np.nan
+    dem = np.round(dem, 2).astype('float32')
+
+    dem_path = str(directory / 'dem.tif')
+    with rasterio.open(dem_path, 'w', driver='GTiff', height=height, width=width, count=1, dtype='float32', crs='EPSG:26916',
+                       transform=from_origin(600000, 4100000, XRES, YRES), nodata=nodata) as dst:
+        dst.write(np.where(np.isnan(dem), nodata, dem), 1)
+
+    tiled = flow_routing(dem_path, str(directory / 'tiled'), tile_size=16, workers=1)
+    single = flow_routing(dem_path, str(directory / 'single'), tile_size=96, workers=1)
+    return dem_path, dem, tiled, single
+
+
+def read(path):
+    with rasterio.open(path) as src:
+        values = src.read(1)
+        return values, src.nodata
+
+
+def reference_fill(dem):
+    """Priority-flood (Barnes et al. 2014) from the map edge and cells next to nodata."""
+    height, width = dem.shape
+    filled = dem.astype('float64').copy()
+    done = np.isnan(dem)
+    heap = []
+    for r in range(height):
+        for c in range(width):
+            if done[r, c]:
+                continue
+            neighbors = [(r + dr, c + dc) for dr, dc in zip(D8_ROWS, D8_COLS)]
+            if any(not (0 <= rn < height and 0 <= cn < width) or np.isnan(dem[rn, cn]) for rn, cn in neighbors):
+                heapq.heappush(heap, (filled[r, c], r, c))
+                done[r, c] = True
+    while heap:
+        z, r, c = heapq.heappop(heap)
+        for dr, dc in zip(D8_ROWS, D8_COLS):
+            rn, cn = r + dr, c + dc
+            if 0 <= rn < height and 0 <= cn < width and not done[rn, cn]:
+                filled[rn, cn] = max(filled[rn, cn], z)
+                done[rn, cn] = True
+                heapq.heappush(heap, (filled[rn, cn], rn, cn))
+    return filled
+
+
+def test_tiled_identical_to_single_tile(routed):
+    _, _, tiled, single = routed
+    for output in tiled:
+        np.testing.assert_array_equal(read(tiled[output])[0], read(single[output])[0], err_msg=output)
+
+
+def test_fill_matches_priority_flood(routed):
+    _, dem, tiled, _ = routed
+    filled, nodata = read(tiled['filled_dem'])
+    expected = reference_fill(dem)
+    np.testing.assert_array_equal(filled == nodata, np.isnan(dem))
+    np.testing.assert_array_equal(filled[~np.isnan(dem)], expected[~np.isnan(dem)].astype('float32'))
+
+
+def test_directions_steepest_descent_and_accumulation(routed):
+    _, dem, tiled, _ = routed
+    filled, nodata = read(tiled['filled_dem'])
+    filled = np.where(filled == nodata, np.nan, filled.astype('float64'))
+    codes, _ = read(tiled['flow_direction'])
+    accumulation, _ = read(tiled['flow_accumulation'])
+    height, width = filled.shape
+    lengths = np.where((D8_ROWS != 0) & (D8_COLS != 0), np.hypot(XRES, YRES), XRES)
+
+    np.testing.assert_array_equal(codes == D8_NODATA, np.isnan(filled))
+
+    downstream = np.full(height * width, -1)
+    for r, c in zip(*np.nonzero(~np.isnan(filled))):
+        inside = [0 <= r + dr < height and 0 <= c + dc < width for dr, dc in zip(D8_ROWS, D8_COLS)]
+        neighbor = np.array([filled[r + dr, c + dc] if ok else np.nan for dr, dc, ok in zip(D8_ROWS, D8_COLS, inside)])
+        slopes = (filled[r, c] - neighbor) / lengths
+        code = codes[r, c]
+        if np.nanmax(slopes, initial=-np.inf) > 0:
+            # steepest downslope neighbor (any of tied neighbors)
+            k = int(np.nonzero(D8_CODES == code)[0][0])
+            assert np.isclose(slopes[k], np.nanmax(slopes)), (r, c)
+        elif code == 0:
+            # outlet: drains off the map or into nodata
+            assert np.isnan(neighbor).any(), (r, c)
+        else:
+            # flat cell drains to a cell of the same elevation
+            k = int(np.nonzero(D8_CODES == code)[0][0])
+            assert slopes[k] == 0, (r, c)
+        if code not in (0, D8_NODATA):
+            k = int(np.nonzero(D8_CODES == code)[0][0])
+            downstream[r * width + c] = (r + D8_ROWS[k]) * width + c + D8_COLS[k]
+
+    # every path reaches an outlet (no cycles), and accumulation counts the cells upstream of each cell
+    expected = np.zeros(height * width)
+    for start in np.nonzero(~np.isnan(filled).ravel())[0]:
+        cell, steps = downstream[start], 0
+        while cell >= 0:
+            expected[cell] += 1
+            cell, steps = downstream[cell], steps + 1
+            assert steps <= height * width
+    valid = ~np.isnan(filled).ravel()
+    np.testing.assert_array_equal(accumulation.ravel()[valid], expected[valid])
+
+
+def _whitebox_installed():
+    try:
+        import whitebox
+    except ImportError:
+        return False
+    # WhiteboxTools() downloads the binary if it is missing, so only run with an existing binary
+    return os.path.exists(os.path.join(os.path.dirname(whitebox.__file__), 'WBT', 'whitebox_tools' + ('.exe' if os.name == 'nt' else '')))
+
+
+@pytest.mark.skipif(not _whitebox_installed(), reason='whitebox binary not installed')
+def test_matches_whitebox(routed, tmp_path):
+    from FlowRouting_Validation import read_masked, run_whitebox
+
+    dem_path, _, tiled, _ = routed
+    reference = run_whitebox(dem_path, str(tmp_path))
+    filled = read_masked(tiled['filled_dem'])
+    np.testing.assert_allclose(filled, reference['filled_dem'], rtol=0, atol=1e-4, equal_nan=True)
+
+    # directions agree wherever flow is not decided by flat resolution (ties between equally steep neighbors may differ)
+    sloped = read_masked(tiled['flow_drop']) > 0
+    sloped[[0, -1], :] = sloped[:, [0, -1]] = False
+    assert np.mean(read_masked(tiled['flow_direction'])[sloped] == reference['flow_direction'][sloped]) > 0.99
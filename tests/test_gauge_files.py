@@ -0,0 +1,61 @@
+"""Gauge files without data (empty responses written by the scrapers) are skipped by batch runs rather than failing them."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from StreamFlowEvents_Utils import collect_frequencies, gauge_segment_durations, read_gauge_rdb
+
+
+def write_gauge(path, gauge, days=400):
+    index = pd.date_range('2000-10-01', periods=days * 4, freq='6h')
+    values = 2 + np.sin(np.arange(len(index)) / 200) + np.random.default_rng(0).gamma(2, 0.3, len(index))
+    pd.DataFrame({'agency_cd': 'USGS', 'site_no': gauge, 'datetime': index.strftime('%Y-%m-%d %H:%M'), 'tz_cd': 'EST',
+                  '86429_00065': values.round(2), '86429_00065_cd': 'A'}).to_csv(path, index=False)
+
+
+@pytest.mark.parametrize('content', ['', '# comment only\n#\n'])
+def test_read_gauge_rdb_raises_empty_data_error(tmp_path, content):
+    path = tmp_path / '03210000_x.csv'
+    path.write_text(content)
+    with pytest.raises(pd.errors.EmptyDataError):
+        read_gauge_rdb(str(path))
+
+
+def test_batch_runs_skip_empty_gauge_files(tmp_path):
+    (tmp_path / 'gauge_height').mkdir()
+    write_gauge(tmp_path / 'gauge_height' / '03210000_x.csv', '03210000')
+    (tmp_path / 'gauge_height' / '03210001_x.csv').write_text('')
+
+    jobs = [('03210000', 'gauge height'), ('03210001', 'gauge height')]
+    with pytest.warns(UserWarning, match='03210001.*EmptyDataError'):
+        results = collect_frequencies(jobs, workers=1, min_periods=30, data_dir=str(tmp_path))
+    assert results[0][1] is not None and results[1][1] is None
+
+    durations = gauge_segment_durations(['03210000', '03210001'], 'gauge height', '10D', data_dir=str(tmp_path))
+    assert durations.iloc[0] > pd.Timedelta(days=300) and pd.isna(durations.iloc[1])
+
+
+def test_gauge_store_matches_csv(tmp_path, monkeypatch):
+    import StreamFlowEvents_Utils
+    from StreamFlowEvents_Utils import build_gauge_store, load_gauge_data, read_gauge_store
+
+    (tmp_path / 'gauge_height').mkdir()
+    write_gauge(tmp_path / 'gauge_height' / '03210000_x.csv', '03210000')
+    store_dir = str(tmp_path / 'store')
+    build_gauge_store(str(tmp_path / 'gauge_height'), store_dir, 'gauge height')
+
+    raw = read_gauge_store(store_dir, '03210000', 'gauge height')
+    assert raw.index.name == 'datetime' and list(raw.columns) == ['value'] and raw['value'].dtype == np.float32
+
+    # index of the store is read once per gauge
+    reads = []
+    read_store_index = StreamFlowEvents_Utils.read_store_index
+    monkeypatch.setattr(StreamFlowEvents_Utils, 'read_store_index', lambda store_dir: reads.append(store_dir) or read_store_index(store_dir))
+    stored = load_gauge_data('03210000', 'gauge height', store_dir=store_dir)
+    assert reads == [store_dir]
+
+    expected = load_gauge_data('03210000', 'gauge height', data_dir=str(tmp_path))
+    pd.testing.assert_frame_equal(stored, expected, check_freq=False, rtol=1e-6)
+    with pytest.raises(FileNotFoundError):
+        load_gauge_data('03210001', 'gauge height', store_dir=store_dir)
@@ -0,0 +1,54 @@
+"""Pipeline node keys cover the code of the modules defining node functions (also behind decorators), and the
+watershed pipeline selects the same gauges as StreamFlowEvents_Pipeline."""
+
+import hashlib
+import importlib
+import inspect
+import textwrap
+
+from Pipeline_Utils import Output, code_version, pipeline_node, run_pipeline
+
+
+MODULE = '''
+from Instrumentation_Utils import instrumented
+
+
+@instrumented
+def write_value(output_path, value):
+    with open(output_path, 'w') as f:
+        f.write(str(value * {scale}))
+'''
+
+
+def test_code_version_unwraps_instrumented():
+    import TerrainFeatures_Utils
+
+    with open(inspect.getsourcefile(TerrainFeatures_Utils), 'rb') as f:
+        expected = hashlib.sha256(f.read()).hexdigest()
+    assert code_version(TerrainFeatures_Utils.flow_routing) == expected
+
+
+def test_editing_defining_module_reruns_node(tmp_path, monkeypatch):
+    module_path = tmp_path / 'pipeline_test_module.py'
+    module_path.write_text(textwrap.dedent(MODULE.format(scale=1)))
+    monkeypatch.syspath_prepend(str(tmp_path))
+    module = importlib.import_module('pipeline_test_module')
+    nodes = [pipeline_node('value', module.write_value, {'output_path': Output('value.txt'), 'value': 2})]
+    cache_dir = str(tmp_path / 'cache')
+
+    assert run_pipeline(nodes, cache_dir, workers=1, progress=None)['value']['status'] == 'built'
+    assert run_pipeline(nodes, cache_dir, workers=1, dry_run=True, progress=None)['value']['status'] == 'cached'
+
+    module_path.write_text(textwrap.dedent(MODULE.format(scale=10)))
+    assert run_pipeline(nodes, cache_dir, workers=1, dry_run=True, progress=None)['value']['status'] == 'stale'
+
+
+def test_gauge_jobs_apply_minimum_days():
+    import pandas as pd
+    from Watersheds_Pipeline import gauge_jobs
+
+    gauges = pd.DataFrame({'site_no': ['01', '02', '03'], 'gh': [1, 1, 0], 'sf': [1, 0, 1],
+                           'gh_diff': ['9000 days', '100 days', None], 'sf_diff': ['200 days', None, '400 days']})
+    assert gauge_jobs(gauges, 365) == [('01', 'gauge height'), ('03', 'streamflow')]
+    assert gauge_jobs(gauges, 0) == [('01', 'gauge height'), ('02', 'gauge height'), ('01', 'streamflow'), ('03', 'streamflow')]
+    assert gauges['gh'].tolist() == [1, 1, 0]
@@ -0,0 +1,42 @@
+"""Streamed RDB lines written in chunks give the same typed table as one chunk."""
+
+import pyarrow.parquet as pq
+import pytest
+
+from Data_Utils import write_rdb_lines
+
+
+LINES = ['# US Geological Survey', '#',
+         'agency_cd\tsite_no\tdatetime\ttz_cd\t86429_00065\t86429_00065_cd',
+         '5s\t15s\t20d\t6s\t14n\t10s',
+         'USGS\t03210000\t2023-11-05 00:45\tCDT\t0\tA',
+         'USGS\t03210000\t2023-11-05 01:00\tCDT\t1\tA',
+         'USGS\t03210000\t2023-11-05 01:15\tCDT\t2\tA',
+         'USGS\t03210000\t2023-11-05 01:00\tCST\t1.5\tA',
+         'USGS\t03210000\t2023-11-05 01:15\tCST\t\tP',
+         'USGS\t03210000\t2023-11-05 01:30\tCST\tIce\tP',
+         'USGS\t03210000\t2023-11-05 01:45\tCST\t3\tP']
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 4])
+def test_parquet_chunks_share_schema(tmp_path, chunk_size):
+    single, chunked = str(tmp_path / 'single.parquet'), str(tmp_path / 'chunked.parquet')
+    metadata = str(tmp_path / 'metadata.txt')
+    assert write_rdb_lines(LINES, single, output_format='parquet') == 7
+    assert write_rdb_lines(LINES, chunked, metadata, output_format='parquet', chunk_size=chunk_size) == 7
+
+    expected, result = pq.read_table(single), pq.read_table(chunked)
+    assert result.schema.field('86429_00065').type == 'double'
+    assert result.equals(expected)
+    assert result.column('86429_00065').to_pylist() == [0.0, 1.0, 2.0, 1.5, None, None, 3.0]
+    with open(metadata) as f:
+        assert f.read() == '# US Geological Survey\n#\n'
+
+
+def test_csv_chunks(tmp_path):
+    path = str(tmp_path / 'chunked.csv')
+    assert write_rdb_lines(LINES, path, chunk_size=2) == 7
+    with open(path) as f:
+        rows = f.read().splitlines()
+    assert rows[0] == 'agency_cd,site_no,datetime,tz_cd,86429_00065,86429_00065_cd'
+    assert rows[1:] == [line.replace('\t', ',') for line in LINES[4:]]
@@ -0,0 +1,82 @@
+"""Decimation keeps the extremes and endpoints of plotted series, and hydrograph batches skip only gauges without data."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from Rendering_Utils import decimate_series, lttb, minmax_decimate, render_hydrographs
+
+
+def noisy_series(n, seed=0, gaps=True):
+    rng = np.random.default_rng(seed)
+    y = np.cumsum(rng.normal(0, 1, n))
+    if gaps:
+        for start in rng.integers(0, n - 500, 8):
+            y[start:start + rng.integers(1, 500)] = np.nan
+    return np.arange(n, dtype=np.float64) * 900, y
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_minmax_decimate_keeps_extremes_endpoints_and_gaps(seed):
+    x, y = noisy_series(50000, seed)
+    selected = minmax_decimate(x, y, 1000)
+    valid = np.flatnonzero(~np.isnan(y))
+
+    assert len(selected) <= 5 * 1000 and np.all(np.diff(selected) > 0)
+    assert np.nanargmin(y) in selected and np.nanargmax(y) in selected
+    assert valid[0] in selected and valid[-1] in selected
+    # a missing value is kept in every gap, so plotted lines still break there
+    gap_starts = np.flatnonzero(np.diff(np.isnan(y).astype(np.int8)) == 1) + 1
+    kept = np.isnan(y[selected])
+    for start in gap_starts:
+        stop = start + np.argmax(~np.isnan(y[start:]))
+        assert kept[(selected >= start) & (selected < stop)].any()
+
+
+def test_lttb_keeps_endpoints_and_spikes():
+    x, y = noisy_series(20000, gaps=False)
+    y[7321], y[15002] = y.max() + 100, y.min() - 100
+    selected = lttb(x, y, 500)
+
+    assert len(selected) == 500 and np.all(np.diff(selected) > 0)
+    assert selected[0] == 0 and selected[-1] == len(y) - 1
+    assert np.argmax(y) in selected and np.argmin(y) in selected
+
+
+def test_short_series_unchanged():
+    x, y = noisy_series(3000)
+    np.testing.assert_array_equal(minmax_decimate(x, y, 1000), np.arange(3000))
+    np.testing.assert_array_equal(lttb(x[:100], y[:100], 500), np.arange(100))
+    series = pd.Series(y, index=pd.date_range('2000-01-01', periods=3000, freq='15min'))
+    for method in ['minmax', 'lttb']:
+        assert decimate_series(series, 4000, method) is series
+
+
+def test_decimate_series_lttb_breaks_at_gaps():
+    x, y = noisy_series(40000)
+    series = pd.Series(y, index=pd.date_range('2000-01-01', periods=len(y), freq='15min'))
+    decimated = decimate_series(series, 2000, 'lttb')
+    valid = series.dropna()
+    assert decimated.index[0] == valid.index[0] and decimated.index[-1] == valid.index[-1]
+    assert decimated.isna().sum() == (np.diff(np.isnan(y).astype(np.int8)) == 1).sum()
+
+
+def load_gauge(gauge, data_type):
+    """Load function of render_hydrographs with a gauge without data and a gauge with a bad column."""
+    if gauge == 'missing':
+        raise FileNotFoundError(f'no {data_type} file for gauge {gauge}')
+    index = pd.date_range('2000-01-01', periods=800, freq='D')
+    values = np.random.default_rng(0).gamma(2, 1, len(index))
+    df = pd.DataFrame({'value': values, 'percentile90': np.quantile(values, 0.9)}, index=index)
+    return df[['unknown']] if gauge == 'bad' else df
+
+
+def test_render_hydrographs_skips_only_gauges_without_data(tmp_path):
+    jobs = [('A', 'A', {'gauge height': ['01', '02'], 'streamflow': ['01']}), ('B', 'B', {'gauge height': ['missing']})]
+    results = render_hydrographs(jobs, load_gauge, str(tmp_path), workers=1, dpi=30)
+
+    assert (tmp_path / 'A_data.jpg').exists() and pd.isna(results.loc['A', 'error'])
+    assert pd.isna(results.loc['B', 'path']) and results.loc['B', 'error'].startswith('FileNotFoundError')
+
+    with pytest.raises(KeyError):
+        render_hydrographs([('C', 'C', {'gauge height': ['bad']})], load_gauge, str(tmp_path), workers=1, dpi=30)
@@ -0,0 +1,50 @@
+"""Fused single-pass rolling kernel matches pandas rolling mean, t-based margin of error, and quantiles."""
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import t
+
+from StreamFlowEvents_Utils import fused_rolling_statistics, _fused_rolling_kernel_jit
+
+
+ENGINES = ['numpy', pytest.param('numba', marks=pytest.mark.skipif(_fused_rolling_kernel_jit is None, reason='numba not installed'))]
+
+
+def pandas_rolling(values, window, min_periods, alpha, percentiles):
+    rolling = pd.Series(values).rolling(window, min_periods=min_periods)
+    count, std = rolling.count().to_numpy(), rolling.std().to_numpy()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        moe = np.where(count > 1, t.ppf(1 - alpha / 2, np.maximum(count - 1, 1)) * std / np.sqrt(count), np.nan)
+    expected = {'mean': rolling.mean().to_numpy(), 'moe': moe}
+    expected.update({p: rolling.quantile(p / 100).to_numpy() for p in percentiles})
+    return expected
+
+
+def series(kind, n=1500, seed=0):
+    rng = np.random.default_rng(seed)
+    if kind == 'gapped':
+        values = 1e3 + rng.lognormal(0, 1, n)
+        values[rng.random(n) < 0.2] = np.nan
+        values[300:420] = np.nan
+    elif kind == 'constant':
+        values = np.full(n, 5.25)
+    elif kind == 'ties':
+        values = rng.integers(0, 4, n).astype(float)
+    else:
+        values = np.full(n, np.nan)
+    return values
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('kind', ['gapped', 'constant', 'ties', 'missing'])
+@pytest.mark.parametrize('window, min_periods', [(90, 30), (7, 1), (30, 30)])
+def test_fused_rolling_statistics_matches_pandas(engine, kind, window, min_periods):
+    values = series(kind)
+    percentiles = (10, 50, 90, 99)
+    result = fused_rolling_statistics(values, window, min_periods, 0.05, percentiles, engine=engine)
+    expected = pandas_rolling(values, window, min_periods, 0.05, percentiles)
+    for key, value in expected.items():
+        # pandas rolling std of a constant window is not exactly zero
+        atol = 1e-6 if key == 'moe' else 1e-9
+        np.testing.assert_allclose(result[key], value, rtol=1e-9, atol=atol, equal_nan=True, err_msg=str(key))
@@ -0,0 +1,79 @@
+"""Vectorized ANOVA and Tukey HSD match scipy f_oneway and statsmodels anova_lm / pairwise_tukeyhsd."""
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import f_oneway
+from statsmodels.formula.api import ols
+from statsmodels.stats.anova import anova_lm
+from statsmodels.stats.multicomp import pairwise_tukeyhsd
+
+from StatisticalComparison_Utils import anova_oneway, compare_clusterings, tukey_hsd
+
+
+@pytest.fixture(scope='module')
+def frequencies():
+    """Frequency columns of watersheds in unequal clusters, with missing values and a cluster missing from one column."""
+    rng = np.random.default_rng(0)
+    labels = pd.Series(rng.choice([0, 1, 2, 3], 240, p=[0.4, 0.3, 0.2, 0.1]), index=[f'{i:010d}' for i in range(240)])
+    df = pd.DataFrame({'moe95_freq_gh': 10 + 2 * labels + rng.normal(0, 3, 240),
+                       'percentile90_freq_sf': 5 + rng.normal(0, 1, 240),
+                       'percentile99_freq_gh': 1e4 + 0.5 * (labels == 2) + rng.normal(0, 1, 240)}, index=labels.index)
+    df.iloc[rng.choice(240, 30, replace=False), 0] = np.nan
+    df.loc[labels == 3, 'percentile90_freq_sf'] = np.nan
+    labels.iloc[:5] = np.nan
+    return df, labels
+
+
+def test_anova_matches_scipy_and_statsmodels(frequencies):
+    df, labels = frequencies
+    table = anova_oneway(df, labels)
+
+    for column in df.columns:
+        data = pd.DataFrame({'value': df[column], 'cluster': labels}).dropna()
+        groups = [group['value'].to_numpy() for _, group in data.groupby('cluster')]
+        expected = f_oneway(*groups)
+        np.testing.assert_allclose(table.loc[column, 'F'], expected.statistic, rtol=1e-9)
+        np.testing.assert_allclose(table.loc[column, 'p_value'], expected.pvalue, rtol=1e-7, atol=1e-300)
+
+        lm = anova_lm(ols('value ~ C(cluster)', data=data).fit())
+        np.testing.assert_allclose(table.loc[column, ['df_between', 'df_within']].to_numpy(float), lm['df'].to_numpy(), rtol=0)
+        np.testing.assert_allclose(table.loc[column, ['ss_between', 'ss_within']].to_numpy(float), lm['sum_sq'].to_numpy(), rtol=1e-8)
+
+
+def test_tukey_hsd_matches_statsmodels(frequencies):
+    df, labels = frequencies
+    table = tukey_hsd(df, labels, alpha=0.05)
+
+    for column in df.columns:
+        data = pd.DataFrame({'value': df[column], 'cluster': labels}).dropna()
+        summary = pairwise_tukeyhsd(data['value'], data['cluster'], alpha=0.05).summary().data
+        expected = pd.DataFrame(summary[1:], columns=summary[0])
+        result = table[table['column'] == column]
+
+        assert len(result) == len(expected)
+        np.testing.assert_array_equal(result['group1'].to_numpy(float), expected['group1'].to_numpy(float))
+        np.testing.assert_array_equal(result['group2'].to_numpy(float), expected['group2'].to_numpy(float))
+        # summary values are rounded to 4 decimals
+        for ours, theirs in [('meandiff', 'meandiff'), ('p_adj', 'p-adj'), ('lower', 'lower'), ('upper', 'upper')]:
+            np.testing.assert_allclose(result[ours].to_numpy(float), expected[theirs].to_numpy(float), atol=6e-5, err_msg=f'{column} {ours}')
+        np.testing.assert_array_equal(result['reject'].to_numpy(bool), expected['reject'].to_numpy(bool))
+
+
+def test_compare_clusterings_resampling(frequencies):
+    df, labels = frequencies
+    shuffled = labels.sample(frac=1, random_state=1).set_axis(labels.index)
+    clusterings = pd.DataFrame({'clusters': labels, 'shuffled': shuffled})
+
+    serial = compare_clusterings(df, clusterings, n_resamples=999, workers=1, batch_size=128)
+    parallel = compare_clusterings(df, clusterings, n_resamples=999, workers=2, batch_size=128)
+    pd.testing.assert_frame_equal(serial, parallel)
+
+    # F and parametric p-values are those of anova_oneway; resampled p-values are valid and agree with them
+    pd.testing.assert_frame_equal(serial.loc['clusters'].drop(columns='p_resampled'), anova_oneway(df, labels))
+    assert serial['p_resampled'].between(1 / 1000, 1).all()
+    assert serial.loc[('clusters', 'moe95_freq_gh'), 'p_resampled'] == 1 / 1000
+    np.testing.assert_allclose(serial.loc['shuffled', 'p_resampled'], serial.loc['shuffled', 'p_value'], atol=0.1)
+
+    bootstrap = compare_clusterings(df, labels, n_resamples=499, method='bootstrap', workers=1)
+    assert bootstrap['p_resampled'].between(1 / 500, 1).all()
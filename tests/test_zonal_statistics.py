@@ -0,0 +1,65 @@
+"""Windowed zonal statistics match rasterstats.zonal_stats (all_touched), and sketch percentiles stay within their error bound."""
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+from rasterstats import zonal_stats
+
+from Benchmark_Utils import synthetic_watersheds
+from WatershedClustering_Utils import rasterize_zones, zonal_statistics_raster
+
+
+STATISTICS = ['count', 'sum', 'mean', 'std', 'min', 'max', 'range', 'median', 'majority', 'minority', 'unique',
+              'percentile_10', 'percentile_25', 'percentile_90']
+
+
+@pytest.fixture(scope='module')
+def zones_and_raster(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('zonal')
+    rng = np.random.default_rng(0)
+    height, width, nodata = 310, 270, -9999.0
+    transform = from_origin(500000, 4200000, 10, 10)
+
+    # smooth surface rounded to 0.1 (so majority and unique are not trivial) with a block of nodata
+    rows, cols = np.mgrid[0:height, 0:width]
+    values = np.round(200 + 30 * np.sin(rows / 40) + 20 * np.cos(cols / 25) + rng.normal(0, 2, (height, width)), 1)
+    values[40:90, 150:220] = nodata
+
+    raster_path = str(directory / 'dem.tif')
+    with rasterio.open(raster_path, 'w', driver='GTiff', height=height, width=width, count=1, dtype='float64',
+                       crs='EPSG:26916', transform=transform, nodata=nodata) as dst:
+        dst.write(values, 1)
+
+    bounds = (500000 + 35, 4200000 - height * 10 + 25, 500000 + width * 10 - 15, 4200000 - 45)
+    polygon_path = str(directory / 'watersheds.shp')
+    synthetic_watersheds(12, bounds, 'EPSG:26916').to_file(polygon_path)
+
+    zones = rasterize_zones(polygon_path, raster_path, cache_dir=str(directory / 'zone_cache'), index_col='huc10', block_size=64)
+    return polygon_path, raster_path, zones
+
+
+def test_zonal_statistics_raster_matches_rasterstats(zones_and_raster):
+    polygon_path, raster_path, zones = zones_and_raster
+    result = zonal_statistics_raster(raster_path, zones, STATISTICS, block_size=64, merge_threshold=1000)
+
+    gdf = gpd.read_file(polygon_path).set_index('huc10')
+    expected = pd.DataFrame(zonal_stats(gdf, raster_path, stats=STATISTICS, all_touched=True), index=gdf.index.astype(str))
+
+    assert list(result.index) == list(expected.index)
+    for stat in STATISTICS:
+        np.testing.assert_allclose(result[stat].to_numpy(float), expected[stat].to_numpy(float), rtol=1e-9, err_msg=stat)
+
+
+def test_sketch_percentiles_within_relative_error(zones_and_raster):
+    _, raster_path, zones = zones_and_raster
+    statistics = ['count', 'mean', 'median', 'percentile_10', 'percentile_90']
+    exact = zonal_statistics_raster(raster_path, zones, statistics, block_size=64)
+    sketch = zonal_statistics_raster(raster_path, zones, statistics, block_size=64, quantile_mode='sketch', relative_error=0.001)
+
+    np.testing.assert_array_equal(sketch['count'], exact['count'])
+    np.testing.assert_allclose(sketch['mean'], exact['mean'], rtol=1e-9)
+    for stat in ['median', 'percentile_10', 'percentile_90']:
+        np.testing.assert_allclose(sketch[stat], exact[stat], rtol=0.001 * 1.0001, err_msg=stat)